@@ -0,0 +1,153 @@
+"""
+Compare the plan search with and without the anytime schedule
+(chinatravel/agent/anytime.py).
+
+Every query is searched twice with the same TIME_CUT. The queries go over the
+supported city pairs for 1-3 days with one of these constraints:
+
+    budget       the trip costs at most --budget per person and day, tight
+                 enough that the depth-first search often runs out of time
+    attractions  at least --attractions attractions per day
+
+and --constraints adds a json list of hard_logic_py constraints as one more
+set. For each search it prints whether it succeeded, the constraints passed
+by the returned plan (the best one validated if the search failed), the time
+to the first feasible plan and the elapsed time, then how many queries each
+mode solved alone and how many searches ran past TIME_CUT.
+
+    python check_anytime.py --agent RuleNeSy --queries 6 --time-cut 15
+
+Without the schedule UrbanTrip switches to its repair mode in the last 20s of
+TIME_CUT, so compare it with a TIME_CUT well above 20s.
+"""
+
+import argparse
+
+import sys
+import os
+import json
+from contextlib import redirect_stdout
+
+project_root_path = os.path.dirname(os.path.abspath(__file__))
+if project_root_path not in sys.path:
+    sys.path.insert(0, project_root_path)
+
+from chinatravel.environment.world_env import WorldEnv
+from chinatravel.agent.search_harness import check_queries, run_search
+from chinatravel.symbol_verification.commonsense_constraint import (
+    func_commonsense_constraints,
+)
+from chinatravel.symbol_verification.hard_constraint import evaluate_constraints_py
+
+
+def budget_constraint(budget):
+    return (
+        "total_cost=0\n"
+        "for activity in allactivities(plan):\n"
+        "    total_cost+=activity_cost(activity)+innercity_transport_cost(activity_transports(activity))\n"
+        "result=(total_cost<={}*day_count(plan)*people_count(plan))".format(budget)
+    )
+
+
+def attractions_constraint(count):
+    return (
+        "count=0\n"
+        "for activity in allactivities(plan):\n"
+        "    if activity_type(activity)=='attraction':\n"
+        "        count=count+1\n"
+        "result=(count>={}*day_count(plan))".format(count)
+    )
+
+
+def grade(query, plan):
+    if not plan or not plan.get("itinerary"):
+        return "no plan"
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        try:
+            commonsense = bool(func_commonsense_constraints(query, plan))
+        except Exception:
+            commonsense = False
+        logic = sum(evaluate_constraints_py(query["hard_logic_py"], plan))
+    return "commonsense {}, logic {}/{}".format(
+        commonsense, logic, len(query["hard_logic_py"])
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Compare the plan search with and without the anytime schedule."
+    )
+    parser.add_argument(
+        "--agent", "-a", type=str, default="RuleNeSy", choices=["RuleNeSy", "UrbanTrip"]
+    )
+    parser.add_argument("--queries", type=int, default=6, help="Queries per constraint set.")
+    parser.add_argument(
+        "--time-cut", type=int, default=15, help="TIME_CUT of each search, in seconds."
+    )
+    parser.add_argument("--budget", type=int, default=800)
+    parser.add_argument("--attractions", type=int, default=2)
+    parser.add_argument(
+        "--constraints",
+        type=str,
+        default=None,
+        help="Json file with a list of hard_logic_py constraints.",
+    )
+    args = parser.parse_args()
+
+    if args.agent == "RuleNeSy":
+        from chinatravel.agent.nesy_agent.rule_driven_rec import RuleDrivenAgent as Agent
+    else:
+        from chinatravel.agent.UrbanTrip.urbantrip_agent import UrbanTrip as Agent
+
+    constraint_sets = {
+        "budget": [budget_constraint(args.budget)],
+        "attractions": [attractions_constraint(args.attractions)],
+    }
+    if args.constraints is not None:
+        with open(args.constraints, "r", encoding="utf-8") as f:
+            constraint_sets[os.path.basename(args.constraints)] = json.load(f)
+
+    env = WorldEnv()
+    solved = {False: 0, True: 0}
+    only = {False: 0, True: 0}
+    late = 0
+    for name, constraints in constraint_sets.items():
+        queries = check_queries(
+            env.support_cities, args.queries, hard_logic_py=constraints, people_number=2
+        )
+        for query in queries:
+            print(
+                "{}: {} -> {}, {} days".format(
+                    name, query["start_city"], query["target_city"], query["days"]
+                )
+            )
+            success = {}
+            for anytime_search in (False, True):
+                agent, success[anytime_search], plan, elapsed = run_search(
+                    Agent, env, query, args.time_cut, anytime_search=anytime_search
+                )
+                if not success[anytime_search]:
+                    plan = agent.best_plan()
+                first = agent.time_to_first_feasible
+                # a node of the search can finish a little after the deadline
+                late += int(elapsed > args.time_cut + 5)
+                print(
+                    "    {}: {} ({}), first feasible {}, {:.1f}s".format(
+                        "anytime" if anytime_search else "plain  ",
+                        success[anytime_search],
+                        grade(query, plan),
+                        "-" if first is None else "{:.1f}s".format(first),
+                        elapsed,
+                    )
+                )
+            for anytime_search in (False, True):
+                solved[anytime_search] += int(success[anytime_search])
+                only[anytime_search] += int(
+                    success[anytime_search] and not success[not anytime_search]
+                )
+    print(
+        "solved: plain {} ({} alone), anytime {} ({} alone); {} searches ran past TIME_CUT".format(
+            solved[False], only[False], solved[True], only[True], late
+        )
+    )
@@ -45,7 +45,8 @@ from chinatravel.symbol_verification.hard_constraint import (
     evaluate_constraints_py,
 )
 from chinatravel.symbol_verification.preference import evaluate_preference_py
-from chinatravel.environment.tools.poi.apis import Poi
+from chinatravel.symbol_verification.incremental import IncrementalValidator
+from chinatravel.environment.tools.catalog import get_catalog
 
 from ..nesy_verifier.verifier.commonsense_constraint_nl import collect_commonsense_constraints_error
 from ..nesy_verifier.verifier.personal_constraint_nl import collect_personal_error
@@ -71,7 +72,8 @@ class TPCAgent(BaseAgent):
         self.memory = {}
         self.TIME_CUT = 60 * 5 - 10
         self.debug = kwargs.get("debug", False)
-        self.poi_search = Poi()
+        self.poi_search = get_catalog().poi
+        self.validator = None
 
         self.visited_attractions = set()
         self.visited_restaurants = set()
@@ -144,6 +146,9 @@ class TPCAgent(BaseAgent):
             plan_out["search_nodes"] = self.search_nodes
         if hasattr(self, 'backtrack_count'):
             plan_out["backtrack_count"] = self.backtrack_count
+        env_stats = self.env.stats(reset=True)
+        if env_stats is not None:
+            plan_out["env_stats"] = env_stats
         if hasattr(self, 'constraints_validation_count'):
             plan_out["constraints_validation_count"] = self.constraints_validation_count
         if hasattr(self, 'commonsense_pass_count'):
@@ -356,6 +361,7 @@ class TPCAgent(BaseAgent):
         # 存储通过逻辑检查的次优计划
         self.least_plan_schema, self.least_plan_comm, self.least_plan_logic = None, None, None
         self.least_plan_logical_pass = -1
+        self.validator = IncrementalValidator(query)
         # 提取用户需求
         # 获取用户约束信息
         # constraints_json = self.extract_user_constraints(query)
@@ -1261,11 +1267,8 @@ class TPCAgent(BaseAgent):
                         # 有预算要求，按price从低到高排序
                         candidate_attr_ranked = candidate_res_filtered.sort_values(by="price").reset_index(drop=True)
                     else:
-                        candidate_res_filtered["distance"] = candidate_res_filtered.apply(
-                            lambda row: self.calculate_distance(
-                                query, current_position, row["name"]
-                            ),
-                            axis=1
+                        candidate_res_filtered["distance"] = self.calculate_distances(
+                            query, current_position, candidate_res_filtered["name"]
                         )
                         candidate_attr_ranked = candidate_res_filtered.sort_values(by="distance").reset_index(drop=True)
 
@@ -1893,11 +1896,8 @@ class TPCAgent(BaseAgent):
                     else:
                         print("sorted by distance")
                         # 根据current_position计算距离景点的距离并排序
-                        candidate_attr_filtered["distance"] = candidate_attr_filtered.apply(
-                            lambda row: self.calculate_distance(
-                                query, current_position, row["name"]
-                            ),
-                            axis=1
+                        candidate_attr_filtered["distance"] = self.calculate_distances(
+                            query, current_position, candidate_attr_filtered["name"]
                         )
                         candidate_attr_ranked = candidate_attr_filtered.sort_values(by="distance").reset_index(
                             drop=True)
@@ -2912,6 +2912,13 @@ class TPCAgent(BaseAgent):
         distance = geodesic(locationA, locationB).kilometers
         return distance
 
+    def calculate_distances(self, query, start, ends):
+        """
+        计算一个 POI 到多个 POI 的球面距离（公里），一次 goto_many 调用；未知地点为 NaN
+        """
+        res = self.env.goto_many(query["target_city"], start, ends, "00:00", "walk")
+        return np.where(res["valid"], res["distance"], np.nan)
+
     def get_transport_by_distance(self, distance):
         selected_modes = []
 
@@ -3344,7 +3351,11 @@ class TPCAgent(BaseAgent):
 
         self.least_plan_schema = deepcopy(res_plan)
 
-        bool_result = func_commonsense_constraints(query, res_plan, verbose=True)
+        if self.validator is None or self.validator.query is not query:
+            self.validator = IncrementalValidator(query)
+        bool_result = self.validator.check(plan)
+        if not bool_result:
+            print("Commonsense constraints failed!")
 
         # if not bool_result:
         #     exit(0)
@@ -3352,14 +3363,6 @@ class TPCAgent(BaseAgent):
         if bool_result:
             self.commonsense_pass_count += 1
 
-        try:
-            extracted_vars = get_symbolic_concepts(query, res_plan, need_ood=False)
-
-        except:
-            extracted_vars = None
-
-        print(extracted_vars)
-
         # 禁用 hard_logic_py 验证，一视同仁处理所有数据集
         # 所有数据集统一不使用 DSL 约束验证
         logical_result = []
@@ -3714,36 +3717,18 @@ class TPCAgent(BaseAgent):
         else:
             raise NotImplementedError
 
-        poi_info = self.env(
+        poi_info = self.env.fetch_all(
             "{func}('{city}', 'name', lambda x: True)".format(func=func_name, city=city)
         )["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                poi_info = pd.concat([poi_info, info_i], axis=0, ignore_index=True)
 
         # print(poi_info)
         return poi_info
 
     def collect_innercity_transport(self, city, start, end, start_time, trans_type):
 
-        call_str = (
-            'goto("{city}", "{start}", "{end}", "{start_time}", "{trans_type}")'.format(
-                city=city,
-                start=start,
-                end=end,
-                start_time=start_time,
-                trans_type=trans_type,
-            )
-        )
-
-        # print(call_str)
         if start == end:
             return []
-        info = self.env(call_str)["data"]
+        info = self.env.call("goto", city, start, end, start_time, trans_type)["data"]
 
         # print(f"transport: {info}")
 
@@ -3768,20 +3753,11 @@ class TPCAgent(BaseAgent):
 
     def collect_intercity_transport(self, source_city, target_city, trans_type):
 
-        info_return = self.env(
+        info_return = self.env.fetch_all(
             "intercity_transport_select('{source_city}', '{target_city}', '{trans_type}')".format(
                 source_city=source_city, target_city=target_city, trans_type=trans_type
             )
         )
         if not info_return["success"]:
             return pd.DataFrame([])
-        trans_info = info_return["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                trans_info = pd.concat([trans_info, info_i], axis=0, ignore_index=True)
-        # print(poi_info)
-        return trans_info
+        return info_return["data"]
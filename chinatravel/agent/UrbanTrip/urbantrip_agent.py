@@ -40,7 +40,12 @@ from chinatravel.symbol_verification.hard_constraint import (
     evaluate_constraints_py,
 )
 from chinatravel.symbol_verification.preference import evaluate_preference_py
-from chinatravel.environment.tools.poi.apis import Poi
+from chinatravel.symbol_verification.incremental import IncrementalValidator
+from chinatravel.symbol_verification.constraint_scorer import ConstraintScorer
+from chinatravel.agent.transposition import TranspositionTable, poi_state
+from chinatravel.agent.cost_ledger import CostLedger, min_innercity_cost
+from chinatravel.agent.anytime import AnytimeSchedule, BranchTimeOut
+from chinatravel.environment.tools.catalog import get_catalog
 
 from chinatravel.agent.nesy_verifier.verifier.commonsense_constraint_nl import collect_commonsense_constraints_error
 from chinatravel.agent.nesy_verifier.verifier.personal_constraint_nl import collect_personal_error
@@ -62,7 +67,19 @@ class UrbanTrip(BaseAgent):
         self.memory = {}
         self.TIME_CUT = 60 * 5 - 10
         self.debug = kwargs.get("debug", False)
-        self.poi_search = Poi()
+        self.poi_search = get_catalog().poi
+        self.validator = None
+        # 叶子节点检查 hard_logic_py 用的编译结果，每个查询编译一次
+        self.constraint_scorer = None
+        # 置换表保存的状态数，0 表示不使用
+        self.transposition_size = kwargs.get("transposition_size", 0)
+        self.transpositions = None
+        # 搜索路径上的各类花费，由 dfs_poi 随活动入栈出栈
+        self.costs = CostLedger()
+        # anytime 模式：按分支分配 TIME_CUT，临近截止时收窄搜索（见 anytime.py）
+        self.anytime_search = kwargs.get("anytime_search", False)
+        self.anytime = None
+        self.time_to_first_feasible = None
 
         self.visited_attractions = set()
         self.visited_restaurants = set()
@@ -147,19 +164,11 @@ class UrbanTrip(BaseAgent):
         if succ:
             plan_out = plan
         else:
+            plan_out = self.best_plan()
             if self.least_plan_logic is not None:
-                plan_out = self.least_plan_logic
-
                 print("The least plan with logic constraints: ", plan_out)
                 succ = True
 
-            elif self.least_plan_comm is not None:
-                plan_out = self.least_plan_comm
-            elif self.least_plan_schema is not None:
-                plan_out = self.least_plan_schema
-            else:
-                plan_out = {}
-
         # Calculate total inference time
         total_time = time.time() - total_start_time
 
@@ -181,6 +190,14 @@ class UrbanTrip(BaseAgent):
             plan_out["search_nodes"] = self.search_nodes
         if hasattr(self, 'backtrack_count'):
             plan_out["backtrack_count"] = self.backtrack_count
+        plan_out["time_to_first_feasible_sec"] = self.time_to_first_feasible
+        if self.anytime is not None:
+            plan_out["anytime"] = self.anytime.summary()
+        if self.transpositions is not None:
+            plan_out["transposition"] = self.transpositions.summary()
+        env_stats = self.env.stats(reset=True)
+        if env_stats is not None:
+            plan_out["env_stats"] = env_stats
         if hasattr(self, 'constraints_validation_count'):
             plan_out["constraints_validation_count"] = self.constraints_validation_count
         if hasattr(self, 'commonsense_pass_count'):
@@ -221,6 +238,10 @@ class UrbanTrip(BaseAgent):
         # 初始化计时器和计数器
         self.time_before_search = time.time()  # 记录搜索开始时间
         self.llm_inference_time_count = 0  # llm推理时间
+        self.time_to_first_feasible = None  # 找到第一个可行计划的用时
+        self.anytime = None
+        if self.anytime_search:
+            self.anytime = AnytimeSchedule(self.TIME_CUT, spent=self.search_time_spent)
 
         # 验证并设置查询中的必需字段的默认值
         if query.get("days") is None or query.get("days") == 0:
@@ -252,6 +273,9 @@ class UrbanTrip(BaseAgent):
         # 存储通过逻辑检查的次优计划
         self.least_plan_schema, self.least_plan_comm, self.least_plan_logic = None, None, None
         self.least_plan_logical_pass = -1
+        self.validator = IncrementalValidator(query)
+        if self.transposition_size > 0:
+            self.transpositions = TranspositionTable(self.transposition_size)
         # 提取用户需求
         # 获取用户约束信息
         # constraints_json = self.extract_user_constraints(query)
@@ -459,8 +483,7 @@ class UrbanTrip(BaseAgent):
             # 遍历排序后的返程交通
             for back_i in ranking_back:
                 if time.time() > self.time_before_search + self.TIME_CUT:
-                    self.default_plan["backtrack_count"] = self.backtrack_count
-                    return True, self.default_plan
+                    return True, self.timeout_plan()
 
                 back_info_i = back_info.iloc[back_i]  # 获取当前返程交通信息
                 if pd.isna(back_info_i["Cost"]):
@@ -545,13 +568,7 @@ class UrbanTrip(BaseAgent):
                         print("search: ...")
                         # 尝试通过 DFS 搜索 POI 计划
                         try:
-                            success, plan = self.dfs_poi(
-                                query,
-                                poi_plan, # go、back、accommodation
-                                plan=[],
-                                current_time="",
-                                current_position="",
-                            )
+                            success, plan = self.search_branch(query, poi_plan)
                         except TimeOutError as e:
                             print("TimeOutError")
                             return False, {"error_info": "TimeOutError"}
@@ -562,8 +579,7 @@ class UrbanTrip(BaseAgent):
                             return True, plan
                         else:
                             if time.time() > self.time_before_search + self.TIME_CUT:
-                                self.default_plan["backtrack_count"] = self.backtrack_count
-                                return True, self.default_plan
+                                return True, self.timeout_plan()
 
                             self.backtrack_count += 1
                             print("search failed given the intercity-transport and hotels, backtrack...")
@@ -638,13 +654,7 @@ class UrbanTrip(BaseAgent):
                         print("search: ...")
                         # 尝试通过 DFS 搜索 POI 计划
                         try:
-                            success, plan = self.dfs_poi(
-                                query,
-                                poi_plan, # go、back、accommodation
-                                plan=[],
-                                current_time="",
-                                current_position="",
-                            )
+                            success, plan = self.search_branch(query, poi_plan)
                         except TimeOutError as e:
                             print("TimeOutError")
                             return False, {"error_info": "TimeOutError"}
@@ -656,8 +666,7 @@ class UrbanTrip(BaseAgent):
                             return True, plan
                         else:
                             if time.time() > self.time_before_search + self.TIME_CUT:
-                                self.default_plan["backtrack_count"] = self.backtrack_count
-                                return True, self.default_plan
+                                return True, self.timeout_plan()
 
                             self.backtrack_count += 1
                             print("search failed given the intercity-transport and hotels, backtrack...")
@@ -727,13 +736,7 @@ class UrbanTrip(BaseAgent):
                             print("search: ...")
                             # 尝试通过 DFS 搜索 POI 计划
                             try:
-                                success, plan = self.dfs_poi(
-                                    query,
-                                    poi_plan,  # go、back、accommodation
-                                    plan=[],
-                                    current_time="",
-                                    current_position="",
-                                )
+                                success, plan = self.search_branch(query, poi_plan)
                             except TimeOutError as e:
                                 print("TimeOutError")
                                 return False, {"error_info": "TimeOutError"}
@@ -744,8 +747,7 @@ class UrbanTrip(BaseAgent):
                                 return True, plan
                             else:
                                 if time.time() > self.time_before_search + self.TIME_CUT:
-                                    self.default_plan["backtrack_count"] = self.backtrack_count
-                                    return True, self.default_plan
+                                    return True, self.timeout_plan()
 
                                 self.backtrack_count += 1
                                 print("search failed given the intercity-transport and hotels, backtrack...")
@@ -772,13 +774,7 @@ class UrbanTrip(BaseAgent):
                     print("search: ...")
                     # 尝试通过 DFS 搜索 POI 计划
                     try:
-                        success, plan = self.dfs_poi(
-                            query,
-                            poi_plan,
-                            plan=[],
-                            current_time="",
-                            current_position="",
-                        )
+                        success, plan = self.search_branch(query, poi_plan)
                     except TimeOutError as e:
                         print("TimeOutError")
                         return False, {"error_info": "TimeOutError"}
@@ -788,15 +784,107 @@ class UrbanTrip(BaseAgent):
                         return True, plan
                     else:
                         if time.time() > self.time_before_search + self.TIME_CUT:
-                            self.default_plan["backtrack_count"] = self.backtrack_count
-                            return True, self.default_plan
+                            return True, self.timeout_plan()
 
                         self.backtrack_count += 1
                         print("search failed given the intercity-transport and hotels, backtrack...")
 
         return False, {"error_info": "No solution found."}
 
+    def search_branch(self, query, poi_plan):
+        """
+        一个城际交通与酒店组合下的 POI 搜索；anytime 模式下超出该分支的时间
+        则视为失败，转到下一个组合
+        """
+        if self.anytime is not None:
+            self.anytime.enter_branch()
+        try:
+            return self.dfs_poi(
+                query,
+                poi_plan,  # go、back、accommodation
+                plan=[],
+                current_time="",
+                current_position="",
+            )
+        except BranchTimeOut:
+            self.anytime.expire(dict(poi_plan))
+            print("out of time for the intercity-transport and hotels, try the next ones...")
+            return False, []
+
+    def search_time_spent(self):
+        return time.time() - self.time_before_search - self.llm_inference_time_count
+
+    def candidate_width(self, n):
+        """
+        每个节点尝试的候选数：n，anytime 模式下临近截止时收窄
+        """
+        if self.anytime is None:
+            return n
+        return self.anytime.width(n)
+
+    def best_plan(self):
+        """
+        目前验证过的最好计划：满足全部约束，其次满足常识约束，其次最后检查的计划
+        """
+        if self.least_plan_logic is not None:
+            return self.least_plan_logic
+        if self.least_plan_comm is not None:
+            return self.least_plan_comm
+        if self.least_plan_schema is not None:
+            return self.least_plan_schema
+        return {}
+
+    def timeout_plan(self):
+        """
+        超时时返回的计划：空的 default_plan，anytime 模式下为目前最好的计划
+        """
+        plan = self.default_plan
+        if self.anytime is not None and len(self.best_plan()) > 0:
+            plan = self.best_plan()
+        plan["backtrack_count"] = self.backtrack_count
+        return plan
+
     def dfs_poi(self, query, poi_plan, plan, current_time, current_position, current_day=0):
+        """
+        search_poi，进入时把调用者新加入的活动的花费记入 self.costs，返回时撤销；
+        开启置换表时跳过已经搜索穷尽的状态（见 transposition.py）
+        """
+        if current_time == "":
+            # 新的城际交通与酒店组合
+            self.costs.clear()
+            if self.transpositions is not None:
+                self.transpositions.clear()
+        self.costs.push(plan)
+        try:
+            if self.transpositions is None or not (
+                current_time != "" and self.validator.prefix_passed(plan)
+            ):
+                return self.search_poi(query, poi_plan, plan, current_time, current_position, current_day)
+
+            # 放宽约束的标志会改变后续搜索，一并放入状态
+            state = poi_state(
+                plan, current_day, current_time, current_position,
+                extra=(self.all_satisfy_flag, self.too_many_backtrack),
+            )
+            if self.transpositions.exhausted(state):
+                # 命中时不会经过 search_poi 的超时检查，这里同样检查
+                if self.stop_search or time.time() - self.time_before_search > self.TIME_CUT + self.llm_inference_time_count:
+                    self.stop_search = True
+                    return True, self.timeout_plan()
+                if self.anytime is not None and self.anytime.branch_expired():
+                    raise BranchTimeOut
+                self.backtrack_count += 1
+                print("the same state was already searched, backtrack...")
+                return False, plan
+
+            success, plan = self.search_poi(query, poi_plan, plan, current_time, current_position, current_day)
+            if not success:
+                self.transpositions.add(state)
+            return success, plan
+        finally:
+            self.costs.pop()
+
+    def search_poi(self, query, poi_plan, plan, current_time, current_position, current_day=0):
         print("----------------------------------calling dfs_poi-----------------------------------------")
         # print(f"plan: {plan}")
         print(f"current_day: {current_day}")
@@ -806,7 +894,11 @@ class UrbanTrip(BaseAgent):
         print(self.backtrack_count)
         # if self.backtrack_count > 5800 or time.time() - self.time_before_search + 20 > self.TIME_CUT + self.llm_inference_time_count:
         #     self.too_many_backtrack = True
-        if time.time() - self.time_before_search + 20 > self.TIME_CUT + self.llm_inference_time_count:
+        if self.anytime is not None:
+            # anytime 模式下由时间表决定何时转入贪心修复
+            if self.anytime.phase() == "greedy":
+                self.too_many_backtrack = True
+        elif time.time() - self.time_before_search + 20 > self.TIME_CUT + self.llm_inference_time_count:
             self.too_many_backtrack = True
 
         if not self.all_satisfy_flag and not self.too_many_backtrack:
@@ -821,12 +913,12 @@ class UrbanTrip(BaseAgent):
         self.search_nodes += 1
         # 检查是否超时
         if self.stop_search:
-            self.default_plan["backtrack_count"] = self.backtrack_count
-            return True, self.default_plan
+            return True, self.timeout_plan()
         if time.time() - self.time_before_search > self.TIME_CUT + self.llm_inference_time_count:
             self.stop_search = True
-            self.default_plan["backtrack_count"] = self.backtrack_count
-            return True, self.default_plan
+            return True, self.timeout_plan()
+        if self.anytime is not None and self.anytime.branch_expired():
+            raise BranchTimeOut
 
         # 检查当前时间是否太晚，无法前往酒店或返程交通
         print("check if too late")
@@ -836,6 +928,12 @@ class UrbanTrip(BaseAgent):
                 print("The current time is too late to go hotel or back-transport, backtrack...")
                 return False, plan
 
+        # 已有花费加上之后必需的市内交通超出预算时，在展开前剪枝
+        if not self.too_many_backtrack:
+            legs = self.remaining_legs(query, poi_plan, current_day, current_time, current_position)
+            if self.check_budgets(plan, legs):
+                return False, plan
+
         # 处理第一天的去程城际交通
         if current_day == 0 and current_time == "":
             plan = [{"day": current_day + 1, "activities": []}]  # 初始化第一天的活动列表
@@ -1164,15 +1262,12 @@ class UrbanTrip(BaseAgent):
                         # 有预算要求，按price从低到高排序
                         candidate_attr_ranked = candidate_res_filtered.sort_values(by="price").reset_index(drop=True)
                     else:
-                        candidate_res_filtered["distance"] = candidate_res_filtered.apply(
-                            lambda row: self.calculate_distance(
-                                query, current_position, row["name"]
-                            ),
-                            axis=1
+                        candidate_res_filtered["distance"] = self.calculate_distances(
+                            query, current_position, candidate_res_filtered["name"]
                         )
                         candidate_attr_ranked = candidate_res_filtered.sort_values(by="distance").reset_index(drop=True)
 
-                    n = 30  # 选取前 n 个
+                    n = self.candidate_width(30)  # 选取前 n 个
 
                     # must see
                     must_candidates = pd.DataFrame()
@@ -1772,11 +1867,8 @@ class UrbanTrip(BaseAgent):
                     else:
                         print("sorted by distance")
                         # 根据current_position计算距离景点的距离并排序
-                        candidate_attr_filtered["distance"] = candidate_attr_filtered.apply(
-                            lambda row: self.calculate_distance(
-                                query, current_position, row["name"]
-                            ),
-                            axis=1
+                        candidate_attr_filtered["distance"] = self.calculate_distances(
+                            query, current_position, candidate_attr_filtered["name"]
                         )
                         candidate_attr_ranked = candidate_attr_filtered.sort_values(by="distance").reset_index(
                             drop=True)
@@ -1792,7 +1884,7 @@ class UrbanTrip(BaseAgent):
                     # elif "lunch" not in candidates_type and "dinner" not in candidates_type:
                     #     stage = 3
 
-                    n = 30  # 选取前 n 个景点
+                    n = self.candidate_width(30)  # 选取前 n 个景点
 
                     must_candidates = pd.DataFrame()
                     if self.must_see_attraction is not None:
@@ -2572,20 +2664,7 @@ class UrbanTrip(BaseAgent):
         logic_fail = False
         backtrack = False
 
-        overall_cost = 0
-        attraction_cost = 0
-        restaurant_cost = 0
-        innercity_cost = 0
-        for day_activities in plan:
-            for activity in day_activities["activities"]:
-                if activity["type"] in ["breakfast", "lunch", "dinner", "attraction"]:
-                    overall_cost += activity["cost"]
-                    restaurant_cost += activity["cost"]
-                if activity["type"] in ["attraction"]:
-                    overall_cost += activity["cost"]
-                    attraction_cost += activity["cost"]
-                innercity_cost += sum(transport.get("cost", 0) for transport in activity.get("transports", []))
-        self.overall_cost = overall_cost + innercity_cost + self.hotel_cost + self.intercity_cost
+        attraction_cost, restaurant_cost, innercity_cost = self.path_costs(plan)
         # print(f"overall cost: {self.overall_cost}, attraction cost:{attraction_cost}, restaurant cost: {restaurant_cost}, innercity cost: {innercity_cost}")
 
         if self.attraction_budget is not None and self.attraction_budget < attraction_cost:
@@ -2714,21 +2793,39 @@ class UrbanTrip(BaseAgent):
                     return True, False  # 有一组满足即可
             return False, False  # 所有组都不满足
 
-    def check_budgets(self, plan):
-        overall_cost = 0
-        attraction_cost = 0
-        restaurant_cost = 0
-        innercity_cost = 0
-        for day_activities in plan:
-            for activity in day_activities["activities"]:
-                if activity["type"] in ["breakfast", "lunch", "dinner", "attraction"]:
-                    overall_cost += activity["cost"]
-                    restaurant_cost += activity["cost"]
-                if activity["type"] in ["attraction"]:
-                    overall_cost += activity["cost"]
-                    attraction_cost += activity["cost"]
-                innercity_cost += sum(transport.get("cost", 0) for transport in activity.get("transports", []))
-        self.overall_cost = overall_cost + innercity_cost + self.hotel_cost + self.intercity_cost
+    def path_costs(self, plan, remaining_legs=0):
+        """
+        plan 的景点、餐饮、市内交通花费，取自 self.costs 的累计值（plan 中尚未记入的活动
+        一并计算），并更新 self.overall_cost。remaining_legs 为之后至少还要乘坐的市内交通
+        次数，其最低花费计入 self.overall_cost
+        """
+        totals = self.costs.totals(plan)
+        attraction_cost, restaurant_cost, innercity_cost = totals["attraction"], totals["meal"], totals["innercity"]
+        remaining_cost = 0
+        if self.transport_rules_by_distance is None:
+            # 按距离选择交通方式时每一程可用的方式不同，不做估计
+            remaining_cost = min_innercity_cost(
+                self.innercity_transports_ranking, remaining_legs, self.query["people_number"]
+            )
+        self.overall_cost = (
+            attraction_cost + restaurant_cost + innercity_cost + remaining_cost + self.hotel_cost + self.intercity_cost
+        )
+        return attraction_cost, restaurant_cost, innercity_cost
+
+    def remaining_legs(self, query, poi_plan, current_day, current_time, current_position):
+        """
+        之后至少还要乘坐的市内交通次数：今晚回酒店（已在酒店则不用），最后一天去返程车站
+        """
+        if current_time == "":
+            return 0
+        if current_day < query["days"] - 1 and "accommodation" in poi_plan:
+            return (current_position != poi_plan["accommodation"]["name"]) + 1
+        if current_day == query["days"] - 1:
+            return int(current_position != poi_plan["back_transport"]["From"])
+        return 0
+
+    def check_budgets(self, plan, remaining_legs=0):
+        attraction_cost, restaurant_cost, innercity_cost = self.path_costs(plan, remaining_legs)
 
         if self.attraction_budget is not None and self.attraction_budget < attraction_cost:
             self.backtrack_count += 1
@@ -2766,6 +2863,13 @@ class UrbanTrip(BaseAgent):
         distance = geodesic(locationA, locationB).kilometers
         return distance
 
+    def calculate_distances(self, query, start, ends):
+        """
+        计算一个 POI 到多个 POI 的球面距离（公里），一次 goto_many 调用；未知地点为 NaN
+        """
+        res = self.env.goto_many(query["target_city"], start, ends, "00:00", "walk")
+        return np.where(res["valid"], res["distance"], np.nan)
+
     def get_transport_by_distance(self, distance):
         selected_modes = []
 
@@ -3170,6 +3274,17 @@ class UrbanTrip(BaseAgent):
 
         return results_main, results_list
 
+    def get_constraint_scorer(self, query):
+        """
+        The ConstraintScorer of the hard_logic_py of the query, compiled once.
+        """
+        if (
+            self.constraint_scorer is None
+            or self.constraint_scorer.codes != query["hard_logic_py"]
+        ):
+            self.constraint_scorer = ConstraintScorer(query["hard_logic_py"])
+        return self.constraint_scorer
+
     def constraints_validation(self, query, plan, poi_plan):
 
         self.constraints_validation_count += 1
@@ -3185,7 +3300,11 @@ class UrbanTrip(BaseAgent):
 
         self.least_plan_schema = deepcopy(res_plan)
 
-        bool_result = func_commonsense_constraints(query, res_plan, verbose=True)
+        if self.validator is None or self.validator.query is not query:
+            self.validator = IncrementalValidator(query)
+        bool_result = self.validator.check(plan)
+        if not bool_result:
+            print("Commonsense constraints failed!")
 
         # if not bool_result:
         #     exit(0)
@@ -3193,17 +3312,10 @@ class UrbanTrip(BaseAgent):
         if bool_result:
             self.commonsense_pass_count += 1
 
-        try:
-            extracted_vars = get_symbolic_concepts(query, res_plan, need_ood=False)
-
-        except:
-            extracted_vars = None
-
-        print(extracted_vars)
-
         # Check if hard_logic_py exists and is not empty
         if "hard_logic_py" in query and query["hard_logic_py"] and len(query["hard_logic_py"]) > 0:
-            logical_result = evaluate_constraints_py(query["hard_logic_py"], res_plan, verbose=True)
+            # 结果与 evaluate_constraints_py 相同
+            logical_result = self.get_constraint_scorer(query).evaluate(res_plan)
             print(logical_result)
 
             logical_pass = True
@@ -3234,6 +3346,8 @@ class UrbanTrip(BaseAgent):
         if bool_result:
             print("\n Pass! \n")
             self.all_constraints_pass += 1
+            if self.time_to_first_feasible is None:
+                self.time_to_first_feasible = time.time() - self.time_before_search
 
             if self.least_plan_logic is None:
                 self.least_plan_logic = res_plan
@@ -3549,36 +3663,18 @@ class UrbanTrip(BaseAgent):
         else:
             raise NotImplementedError
 
-        poi_info = self.env(
+        poi_info = self.env.fetch_all(
             "{func}('{city}', 'name', lambda x: True)".format(func=func_name, city=city)
         )["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                poi_info = pd.concat([poi_info, info_i], axis=0, ignore_index=True)
 
         # print(poi_info)
         return poi_info
 
     def collect_innercity_transport(self, city, start, end, start_time, trans_type):
 
-        call_str = (
-            'goto("{city}", "{start}", "{end}", "{start_time}", "{trans_type}")'.format(
-                city=city,
-                start=start,
-                end=end,
-                start_time=start_time,
-                trans_type=trans_type,
-            )
-        )
-
-        # print(call_str)
         if start == end:
             return []
-        info = self.env(call_str)["data"]
+        info = self.env.call("goto", city, start, end, start_time, trans_type)["data"]
 
         # print(f"transport: {info}")
 
@@ -3603,20 +3699,11 @@ class UrbanTrip(BaseAgent):
 
     def collect_intercity_transport(self, source_city, target_city, trans_type):
 
-        info_return = self.env(
+        info_return = self.env.fetch_all(
             "intercity_transport_select('{source_city}', '{target_city}', '{trans_type}')".format(
                 source_city=source_city, target_city=target_city, trans_type=trans_type
             )
         )
         if not info_return["success"]:
             return pd.DataFrame([])
-        trans_info = info_return["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                trans_info = pd.concat([trans_info, info_i], axis=0, ignore_index=True)
-        # print(poi_info)
-        return trans_info
+        return info_return["data"]
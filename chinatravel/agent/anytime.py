@@ -0,0 +1,146 @@
+"""
+Deadline-aware scheduling of the plan search (anytime mode).
+
+Without it the agents run a depth-first search until TIME_CUT and, when that
+runs out, return what they happened to keep: often nothing, since the first
+branches can take the whole budget without completing a plan. In anytime mode
+`AnytimeSchedule` spreads the budget and narrows the search as the deadline
+approaches:
+
+- each top-level branch (go transport, back transport, hotel) gets a share of
+  the remaining time, `branch_share` of it but at least `min_branch_share` of
+  the budget; a branch out of its time raises `BranchTimeOut` and the next
+  one is searched. The serial search of NesyAgent searches the branches
+  left unfinished again, in order, once the others are done and if time
+  remains (`rounds`),
+- the strategy follows the share of the budget spent:
+
+      dfs     the full search, up to `beam_at`
+      beam    at most `beam_width` candidates per node, up to `greedy_at`
+      greedy  one candidate per node, and the repair mode of the agent if it
+              has one, until the deadline
+
+The agents keep the best plans they validate, and return the best one when
+the search ends without a feasible plan.
+
+check_anytime.py, at the root of the repository, compares the search with and
+without the schedule.
+"""
+
+import time
+
+
+class BranchTimeOut(Exception):
+    pass
+
+
+class AnytimeSchedule:
+    def __init__(
+        self,
+        time_budget,
+        spent=None,
+        beam_at: float = 0.5,
+        greedy_at: float = 0.8,
+        beam_width: int = 3,
+        branch_share: float = 0.5,
+        min_branch_share: float = 0.05,
+    ):
+        """
+        `spent()` gives the seconds of the budget used so far, the wall time
+        since start() by default.
+        """
+        self.time_budget = time_budget
+        self._spent = spent
+        self.beam_at = beam_at
+        self.greedy_at = greedy_at
+        self.beam_width = beam_width
+        self.branch_share = branch_share
+        self.min_branch_share = min_branch_share
+        self.start()
+
+    def start(self):
+        self.start_time = time.time()
+        self.branch_deadline = None
+        self.branches = 0
+        self.expired = []
+        self.expired_count = 0
+        self.rounds_count = 0
+        # seconds spent when each phase began
+        self.phase_times = {"dfs": 0.0}
+
+    def spent(self) -> float:
+        if self._spent is not None:
+            return self._spent()
+        return time.time() - self.start_time
+
+    def remaining(self) -> float:
+        return max(0.0, self.time_budget - self.spent())
+
+    def phase(self) -> str:
+        spent = self.spent()
+        fraction = spent / self.time_budget if self.time_budget > 0 else 1.0
+        if fraction < self.beam_at:
+            phase = "dfs"
+        elif fraction < self.greedy_at:
+            phase = "beam"
+        else:
+            phase = "greedy"
+        if phase not in self.phase_times:
+            self.phase_times[phase] = round(spent, 2)
+        return phase
+
+    def width(self, search_width=None):
+        """
+        Candidates to try per node: `search_width` (None: all) in the dfs
+        phase, fewer later.
+        """
+        phase = self.phase()
+        if phase == "dfs":
+            return search_width
+        width = self.beam_width if phase == "beam" else 1
+        return width if search_width is None else min(width, search_width)
+
+    def enter_branch(self):
+        self.branches += 1
+        remaining = self.remaining()
+        share = max(
+            self.min_branch_share * self.time_budget, self.branch_share * remaining
+        )
+        # on the clock of spent(), so time the agent leaves out of the budget
+        # (LLM calls) does not use up the share of the branch either
+        self.branch_deadline = self.spent() + min(share, remaining)
+
+    def branch_expired(self) -> bool:
+        return self.branch_deadline is not None and self.spent() > self.branch_deadline
+
+    def expire(self, branch):
+        """
+        Record a branch that ran out of its time, to search it again later.
+        """
+        self.expired.append(branch)
+        self.expired_count += 1
+
+    def rounds(self, branches):
+        """
+        The branches in order, then the expired ones again while time remains
+        and some of them were cut short.
+        """
+        pending = branches
+        while True:
+            self.rounds_count += 1
+            self.expired = []
+            for branch in pending:
+                yield branch
+            if len(self.expired) == 0 or self.remaining() <= 0:
+                return
+            pending = self.expired
+
+    def summary(self) -> dict:
+        return {
+            # the last phase the search reached
+            "phase": list(self.phase_times)[-1],
+            "phase_times": dict(self.phase_times),
+            "branches": self.branches,
+            "expired_branches": self.expired_count,
+            "rounds": self.rounds_count,
+        }
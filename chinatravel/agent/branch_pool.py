@@ -0,0 +1,133 @@
+"""
+Parallel search over the top-level branches of a plan search.
+
+The agents enumerate go-transport x back-transport x hotel combinations in
+ranking order and run a full POI search for each, stopping at the first one
+that settles the query. `search_branches` runs these searches in forked
+worker processes instead: each worker inherits the agent and its
+environment (and only reads them), takes the next branch in ranking order,
+and reports back. The outcome is the one of the serial loop: the results of
+the branches in ranking order up to the first branch whose search says to
+stop, even when a later branch finished first. As soon as a branch stops,
+the workers on later branches are cancelled.
+
+`search(branch, cancelled)` is called in the worker and returns
+(stop, result); `cancelled()` turns True once the branch can no longer
+matter, and the search then raises `BranchCancelled`. Results are pickled.
+
+Forking needs a backbone LLM that survives it: the rule-based one, or an
+API client. A model loaded in-process (vllm) does not.
+"""
+
+import sys
+import queue
+import multiprocessing
+
+
+class BranchCancelled(Exception):
+    pass
+
+
+class BranchSearchError(Exception):
+    pass
+
+
+def _worker(search, initializer, tasks, results, cutoff):
+    if initializer is not None:
+        initializer()
+    while True:
+        task = tasks.get()
+        if task is None:
+            break
+        rank, branch = task
+        if rank > cutoff.value:
+            results.put((rank, "cancelled", None))
+            continue
+        try:
+            stop, result = search(branch, lambda: cutoff.value < rank)
+            status = "stop" if stop else "continue"
+        except BranchCancelled:
+            status, result = "cancelled", None
+        except Exception as e:
+            status, result = "error", f"{type(e).__name__}: {e}"
+        if status in ("stop", "error"):
+            with cutoff.get_lock():
+                cutoff.value = min(cutoff.value, rank)
+        results.put((rank, status, result))
+
+
+def _settled(outcomes):
+    """
+    Results in ranking order up to the first stop, None if still open.
+    """
+    settled = []
+    for rank in range(len(outcomes)):
+        if rank not in outcomes:
+            return None
+        status, result = outcomes[rank]
+        if status == "error":
+            raise BranchSearchError(f"branch {rank}: {result}")
+        settled.append(result)
+        if status == "stop":
+            return settled
+    return None
+
+
+def search_branches(branches, search, workers: int, initializer=None) -> list:
+    """
+    Results of `search` for the `branches` (an iterable, consumed lazily and
+    in order) in ranking order, up to the first that stops the search or
+    over all of them. `initializer()` runs once in every worker.
+    """
+    ctx = multiprocessing.get_context("fork")
+    tasks, results = ctx.Queue(), ctx.Queue()
+    # lowest rank that stopped the search; later branches are cancelled
+    cutoff = ctx.Value("q", sys.maxsize)
+    processes = [
+        ctx.Process(
+            target=_worker,
+            args=(search, initializer, tasks, results, cutoff),
+            daemon=True,
+        )
+        for _ in range(workers)
+    ]
+    for process in processes:
+        process.start()
+
+    branches = iter(branches)
+    outcomes = {}
+    sent, exhausted = 0, False
+    try:
+        while True:
+            # keep one branch queued per worker, so that the branches are
+            # generated no earlier than the serial loop would need them
+            while not exhausted and sent - len(outcomes) < workers and sent <= cutoff.value:
+                try:
+                    branch = next(branches)
+                except StopIteration:
+                    exhausted = True
+                    break
+                tasks.put((sent, branch))
+                sent += 1
+            if exhausted and len(outcomes) == sent:
+                return [result for _, result in (outcomes[rank] for rank in range(sent))]
+            try:
+                rank, status, result = results.get(timeout=1)
+            except queue.Empty:
+                if not any(process.is_alive() for process in processes):
+                    raise BranchSearchError("the search workers exited")
+                continue
+            outcomes[rank] = (status, result)
+            settled = _settled(outcomes)
+            if settled is not None:
+                return settled
+    finally:
+        with cutoff.get_lock():
+            cutoff.value = -1
+        for _ in processes:
+            tasks.put(None)
+        tasks.cancel_join_thread()
+        for process in processes:
+            process.join(timeout=1)
+            if process.is_alive():
+                process.terminate()
@@ -0,0 +1,114 @@
+"""
+Running cost totals of the partial plan of the POI search.
+
+The budget checks of the agents used to walk the whole partial plan at every
+node. `CostLedger` keeps the totals per category instead: dfs_poi pushes the
+activities its caller has just added when it enters a node and pops them when
+it leaves, so a node reads the totals of its path without a walk. The totals
+are kept as a stack of prefix sums, so popping restores them exactly.
+
+`min_innercity_cost` is a lower bound on the inner-city transport the rest of
+the trip still has to pay, added to the totals before comparing them with a
+budget. Walking is free, and a metro route can be walking only, so the bound
+is not zero only when the search rides taxis alone. Meals are not part of it:
+the commonsense constraints do not require a lunch or a dinner, so none of
+them is unavoidable.
+"""
+
+from chinatravel.environment.tools.transportation.apis import calculate_cost_taxi
+
+CATEGORIES = ("attraction", "meal", "innercity")
+
+ACTIVITY_CATEGORY = {
+    "attraction": "attraction",
+    "breakfast": "meal",
+    "lunch": "meal",
+    "dinner": "meal",
+}
+
+# lowest fare of a ride, per person (metro) or per car (taxi)
+MIN_FARE = {"walk": 0, "metro": 0, "taxi": calculate_cost_taxi(0)}
+
+
+def activity_costs(activity) -> dict:
+    costs = dict.fromkeys(CATEGORIES, 0)
+    category = ACTIVITY_CATEGORY.get(activity.get("type"))
+    if category is not None:
+        costs[category] += activity.get("cost", 0)
+    for transport in activity.get("transports", []):
+        costs["innercity"] += transport.get("cost", 0)
+    return costs
+
+
+class CostLedger:
+    def __init__(self):
+        # (activities counted, totals per category) of the path
+        self._stack = [(0, dict.fromkeys(CATEGORIES, 0))]
+
+    def _extend(self, plan):
+        """
+        Count and totals of `plan`, from the top of the stack and the
+        activities added after it.
+        """
+        count, totals = self._stack[-1]
+        added = sum(len(day["activities"]) for day in plan) - count
+        if added < 0:
+            # not an extension of the path, count everything
+            count, totals, added = 0, dict.fromkeys(CATEGORIES, 0), count + added
+        if added == 0:
+            return count, totals
+        activities = []
+        for day in reversed(plan):
+            for activity in reversed(day["activities"]):
+                if len(activities) == added:
+                    break
+                activities.append(activity)
+        totals = dict(totals)
+        for activity in reversed(activities):
+            costs = activity_costs(activity)
+            for c in CATEGORIES:
+                totals[c] += costs[c]
+        return count + added, totals
+
+    def push(self, plan):
+        """
+        Count the activities the caller has added to `plan` since the last
+        push.
+        """
+        self._stack.append(self._extend(plan))
+
+    def pop(self):
+        self._stack.pop()
+
+    def clear(self):
+        del self._stack[1:]
+
+    def totals(self, plan=None) -> dict:
+        """
+        Costs per category of the path, or of `plan` if it has activities
+        added but not pushed yet.
+        """
+        if plan is None:
+            return self._stack[-1][1]
+        return self._extend(plan)[1]
+
+    def total(self, plan=None):
+        return sum(self.totals(plan).values())
+
+
+def min_innercity_cost(transport_modes, legs: int, people_number: int):
+    """
+    Lowest cost of `legs` more inner-city rides with the modes the search
+    tries, for `people_number` people.
+    """
+    if legs <= 0 or len(transport_modes) == 0:
+        return 0
+    fares = []
+    for mode in transport_modes:
+        if mode == "taxi":
+            fares.append(MIN_FARE["taxi"] * (int((people_number - 1) / 4) + 1))
+        elif mode == "metro":
+            fares.append(MIN_FARE["metro"] * people_number)
+        else:
+            fares.append(MIN_FARE.get(mode, 0))
+    return legs * min(fares)
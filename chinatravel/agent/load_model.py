@@ -22,6 +22,9 @@ def init_agent(kwargs):
             backbone_llm=kwargs["backbone_llm"],
             cache_dir=kwargs["cache_dir"],
             debug=kwargs["debug"],
+            search_workers=kwargs.get("search_workers", 1),
+            transposition_size=kwargs.get("transposition_size", 0),
+            anytime_search=kwargs.get("anytime_search", False),
         )
     elif kwargs["method"] == "LLMNeSy":
         agent = LLMDrivenAgent(
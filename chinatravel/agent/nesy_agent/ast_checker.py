@@ -2,6 +2,7 @@ import ast
 
 import os
 import sys
+import numpy as np
 from fuzzywuzzy import process as fuzzy_process
 
 
@@ -11,7 +12,7 @@ project_path = os.path.abspath(
 if project_path not in sys.path:
     sys.path.append(project_path)
 
-from chinatravel.environment.tools import Poi
+from chinatravel.environment.tools import get_catalog
 
 
 class FunctionValueTracker(ast.NodeVisitor):
@@ -255,7 +256,7 @@ class CodeBlockChecker:
 
 
 class HardLogicPyChecker(CodeBlockChecker):
-    _poi = Poi()
+    _poi = get_catalog().poi
 
     def __init__(self, target_city):
         func_name_list = [
@@ -423,6 +424,413 @@ class HardLogicPyChecker(CodeBlockChecker):
         super().__init__(func_name_list, valid_values_list, need_fuzzy_list)
 
 
+# 预过滤：提供各类活动的候选表，以及约束函数对应的表和列
+FILTER_TABLE_ACTIVITIES = {
+    "attractions": {"attraction"},
+    "restaurants": {"lunch", "dinner"},
+    "accommodations": {"accommodation"},
+}
+FILTER_FUNC_COLUMNS = {
+    "attraction_type": ("attractions", "type"),
+    "restaurant_type": ("restaurants", "cuisine"),
+    "accommodation_type": ("accommodations", "featurehoteltype"),
+    "activity_position": (None, "name"),
+}
+INNERCITY_TRANSPORT = "innercity_transport"
+
+
+class CandidateFilters:
+    """
+    预过滤条件：(表, 列) 上允许的取值集合与禁止的取值集合，以及市内交通方式。
+    每个条件都只是某条约束的必要条件，删掉的候选不可能出现在满足该约束的计划中；
+    所有约束仍然在叶子节点由 evaluate_constraints_py 完整验证。
+    """
+
+    def __init__(self):
+        self.allowed = {}
+        self.forbidden = {}
+        self.compiled = []  # 被识别的约束序号
+        self.sizes = {}  # 表名 -> (过滤前行数, 过滤后行数)
+
+    def allow(self, key, values):
+        values = set(values)
+        self.allowed[key] = self.allowed[key] & values if key in self.allowed else values
+
+    def forbid(self, key, values):
+        self.forbidden[key] = self.forbidden.get(key, set()) | set(values)
+
+    def apply(self, memory):
+        """
+        过滤 memory 中的候选表，返回新的 memory。会删光一张表的条件不生效，
+        这样搜索仍能给出违反该约束的次优计划。
+        """
+        filtered = dict(memory)
+        for table in FILTER_TABLE_ACTIVITIES:
+            if table not in memory:
+                continue
+            data = memory[table]
+            mask = np.ones(len(data), dtype=bool)
+            for (t, column), values in self.allowed.items():
+                if t == table:
+                    mask &= data[column].isin(values).to_numpy()
+            for (t, column), values in self.forbidden.items():
+                if t == table:
+                    mask &= ~data[column].isin(values).to_numpy()
+            if mask.all() or not mask.any():
+                self.sizes[table] = (len(data), len(data))
+                continue
+            data = data[mask].reset_index(drop=True)
+            self.sizes[table] = (len(mask), len(data))
+            filtered[table] = data
+        return filtered
+
+    def filter_transports(self, ranking):
+        key = (INNERCITY_TRANSPORT, None)
+        result = [
+            t
+            for t in ranking
+            if (key not in self.allowed or t in self.allowed[key])
+            and t not in self.forbidden.get(key, ())
+        ]
+        return result if len(result) > 0 else ranking
+
+    def summary(self):
+        summary = {"constraints": len(self.compiled)}
+        for table, (before, after) in self.sizes.items():
+            summary[table] = [before, after]
+        return summary
+
+
+class CandidateFilterCompiler:
+    """
+    从 hard_logic_py 中识别只限制候选 POI、酒店或市内交通方式的约束，编译成预过滤条件。
+    识别两种写法（activity 为循环变量）：
+
+    1. 收集集合后比较：
+        s=set()
+        for activity in allactivities(plan):
+          if activity_type(activity) in [...]: s.add(f(activity, ...))
+        result=(s<={...})                  # 允许的取值，也可以是 == / issubset
+        result=(not s&{...})               # 禁止的取值，也可以是 isdisjoint / len(...)==0
+        result=({...}<=s)                  # 必须的取值，只用于酒店（整个行程住同一家）
+
+    2. 逐个活动检查：
+        result=True
+        for activity in allactivities(plan):
+          if activity_type(activity)=='...' and f(activity, ...) in [...]: result=False
+
+    f 为 FILTER_FUNC_COLUMNS 中的函数或 innercity_transport_type。条件中只能有活动
+    类型的判断，并且要覆盖候选表提供的全部活动类型，否则不做过滤；带
+    activity_transports(activity)!=[] 的条件只约束有市内交通的活动，只能编译成市内
+    交通方式的过滤。其他约束保持原样，只在叶子节点验证。
+    """
+
+    def compile(self, codes):
+        filters = CandidateFilters()
+        if not isinstance(codes, list):
+            return filters
+        for idx, code in enumerate(codes):
+            try:
+                tree = ast.parse(code)
+            except SyntaxError:
+                continue
+            if self._compile_set(tree.body, filters) or self._compile_flag(
+                tree.body, filters
+            ):
+                filters.compiled.append(idx)
+        return filters
+
+    def _compile_set(self, body, filters):
+        if len(body) != 3:
+            return False
+        init, loop, final = body
+        if not (
+            isinstance(init, ast.Assign)
+            and len(init.targets) == 1
+            and isinstance(init.targets[0], ast.Name)
+            and self._is_call(init.value, "set")
+            and len(init.value.args) == 0
+        ):
+            return False
+        name = init.targets[0].id
+        var = self._activity_loop(loop)
+        if var is None or len(loop.body) != 1:
+            return False
+        if not (
+            isinstance(final, ast.Assign)
+            and len(final.targets) == 1
+            and isinstance(final.targets[0], ast.Name)
+            and final.targets[0].id == "result"
+        ):
+            return False
+
+        stmt, types, guarded = loop.body[0], None, False
+        if isinstance(stmt, ast.If):
+            if len(stmt.body) != 1 or stmt.orelse:
+                return False
+            types = self._activity_types(stmt.test, var)
+            if types is False:
+                return False
+            guarded = self._transports_guarded(stmt.test, var)
+            stmt = stmt.body[0]
+        if not (
+            isinstance(stmt, ast.Expr)
+            and isinstance(stmt.value, ast.Call)
+            and isinstance(stmt.value.func, ast.Attribute)
+            and stmt.value.func.attr == "add"
+            and isinstance(stmt.value.func.value, ast.Name)
+            and stmt.value.func.value.id == name
+            and len(stmt.value.args) == 1
+        ):
+            return False
+        keys = self._filter_keys(stmt.value.args[0], var, types, guarded)
+        if len(keys) == 0:
+            return False
+
+        kind, values = self._set_comparison(final.value, name)
+        if kind == "required":
+            # 搜索为整个行程选择同一家酒店，必须的取值只能有一个
+            keys = [key for key in keys if key[0] == "accommodations"]
+            if len(keys) == 0 or len(values) != 1:
+                return False
+            kind = "allowed"
+        if kind is None:
+            return False
+        for key in keys:
+            if kind == "allowed":
+                filters.allow(key, values)
+            else:
+                filters.forbid(key, values)
+        return True
+
+    def _compile_flag(self, body, filters):
+        if len(body) != 2:
+            return False
+        init, loop = body
+        if not (
+            isinstance(init, ast.Assign)
+            and len(init.targets) == 1
+            and isinstance(init.targets[0], ast.Name)
+            and init.targets[0].id == "result"
+            and isinstance(init.value, ast.Constant)
+            and init.value.value is True
+        ):
+            return False
+        var = self._activity_loop(loop)
+        if var is None:
+            return False
+        compiled = False
+        # 每个 if 单独就是约束的必要条件，不能识别的 if 直接跳过
+        for stmt in loop.body:
+            if not (
+                isinstance(stmt, ast.If)
+                and not stmt.orelse
+                and len(stmt.body) == 1
+                and isinstance(stmt.body[0], ast.Assign)
+                and isinstance(stmt.body[0].targets[0], ast.Name)
+                and stmt.body[0].targets[0].id == "result"
+                and isinstance(stmt.body[0].value, ast.Constant)
+                and stmt.body[0].value.value is False
+            ):
+                continue
+            terms = (
+                stmt.test.values
+                if isinstance(stmt.test, ast.BoolOp) and isinstance(stmt.test.op, ast.And)
+                else [stmt.test]
+            )
+            types, guarded, value_terms = None, False, []
+            for term in terms:
+                term_types = self._activity_types(term, var)
+                if term_types is False:
+                    value_terms.append(term)
+                elif term_types is not None:
+                    types = term_types if types is None else types & term_types
+                guarded = guarded or self._transports_guarded(term, var)
+            if len(value_terms) != 1:
+                continue
+            term = value_terms[0]
+            if not (
+                isinstance(term, ast.Compare)
+                and len(term.ops) == 1
+                and isinstance(term.ops[0], (ast.In, ast.NotIn, ast.Eq, ast.NotEq))
+            ):
+                continue
+            values = self._constant_values(term.comparators[0])
+            keys = self._filter_keys(term.left, var, types, guarded)
+            if values is None or len(keys) == 0:
+                continue
+            for key in keys:
+                if isinstance(term.ops[0], (ast.In, ast.Eq)):
+                    filters.forbid(key, values)
+                else:
+                    filters.allow(key, values)
+            compiled = True
+        return compiled
+
+    def _activity_loop(self, node):
+        """
+        `for var in allactivities(plan)` 的循环变量名。
+        """
+        if (
+            isinstance(node, ast.For)
+            and isinstance(node.target, ast.Name)
+            and self._is_call(node.iter, "allactivities")
+            and not node.orelse
+        ):
+            return node.target.id
+        return None
+
+    def _activity_types(self, node, var):
+        """
+        条件限定的活动类型集合；None 表示不限定类型（包括 activity_transports(var)!=[]），
+        False 表示条件中有类型以外的判断。
+        """
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            types = None
+            for value in node.values:
+                value_types = self._activity_types(value, var)
+                if value_types is False:
+                    return False
+                if value_types is not None:
+                    types = value_types if types is None else types & value_types
+            return types
+        if not (isinstance(node, ast.Compare) and len(node.ops) == 1):
+            return False
+        left, op, right = node.left, node.ops[0], node.comparators[0]
+        if self._transports_guarded(node, var):
+            return None
+        if not self._is_call(left, "activity_type", var):
+            return False
+        values = self._constant_values(right)
+        if values is None:
+            return False
+        if isinstance(op, (ast.Eq, ast.In)):
+            return values
+        return False
+
+    def _transports_guarded(self, node, var):
+        """
+        条件中是否有 activity_transports(var)!=[]。
+        """
+        if isinstance(node, ast.BoolOp) and isinstance(node.op, ast.And):
+            return any(self._transports_guarded(value, var) for value in node.values)
+        return (
+            isinstance(node, ast.Compare)
+            and len(node.ops) == 1
+            and self._is_call(node.left, "activity_transports", var)
+            and isinstance(node.ops[0], ast.NotEq)
+            and isinstance(node.comparators[0], ast.List)
+            and len(node.comparators[0].elts) == 0
+        )
+
+    def _filter_keys(self, node, var, types, guarded=False):
+        """
+        取值表达式对应的 (表, 列)，条件没有覆盖候选表的全部活动类型时不返回该表。
+        guarded 表示条件只看有市内交通的活动，此时不过滤 POI 表：没有市内交通的活动
+        仍然可以取被排除的取值。
+        """
+        if self._is_call(node, "innercity_transport_type") and len(node.args) == 1:
+            if types is None and self._is_call(node.args[0], "activity_transports", var):
+                return [(INNERCITY_TRANSPORT, None)]
+            return []
+        if guarded:
+            return []
+        for func, (table, column) in FILTER_FUNC_COLUMNS.items():
+            if self._is_call(node, func, var):
+                tables = [table] if table is not None else list(FILTER_TABLE_ACTIVITIES)
+                return [
+                    (t, column)
+                    for t in tables
+                    if types is None or FILTER_TABLE_ACTIVITIES[t] <= types
+                ]
+        return []
+
+    def _set_comparison(self, node, name):
+        """
+        集合 name 与常量集合的比较：("allowed" / "forbidden" / "required", 取值)。
+        """
+        if isinstance(node, ast.Compare) and len(node.ops) == 1:
+            left, op, right = node.left, node.ops[0], node.comparators[0]
+            if self._is_name(left, name) and isinstance(op, (ast.LtE, ast.Eq)):
+                values = self._constant_values(right)
+                if values is not None:
+                    return "allowed", values
+            if self._is_name(right, name) and isinstance(op, ast.LtE):
+                values = self._constant_values(left)
+                if values is not None:
+                    return "required", values
+            if self._is_name(left, name) and isinstance(op, ast.GtE):
+                values = self._constant_values(right)
+                if values is not None:
+                    return "required", values
+            if (
+                self._is_call(left, "len")
+                and isinstance(op, ast.Eq)
+                and isinstance(right, ast.Constant)
+                and right.value == 0
+            ):
+                values = self._intersection_values(left.args[0], name)
+                if values is not None:
+                    return "forbidden", values
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.Not):
+            values = self._intersection_values(node.operand, name)
+            if values is not None:
+                return "forbidden", values
+        if (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Attribute)
+            and self._is_name(node.func.value, name)
+            and len(node.args) == 1
+        ):
+            values = self._constant_values(node.args[0])
+            kind = {
+                "issubset": "allowed",
+                "isdisjoint": "forbidden",
+                "issuperset": "required",
+            }.get(node.func.attr)
+            if kind is not None and values is not None:
+                return kind, values
+        return None, None
+
+    def _intersection_values(self, node, name):
+        if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitAnd):
+            if self._is_name(node.left, name):
+                return self._constant_values(node.right)
+            if self._is_name(node.right, name):
+                return self._constant_values(node.left)
+        return None
+
+    def _constant_values(self, node):
+        if isinstance(node, ast.Constant):
+            return {node.value}
+        if isinstance(node, (ast.List, ast.Set, ast.Tuple)) and all(
+            isinstance(elt, ast.Constant) for elt in node.elts
+        ):
+            return {elt.value for elt in node.elts}
+        return None
+
+    def _is_name(self, node, name):
+        return isinstance(node, ast.Name) and node.id == name
+
+    def _is_call(self, node, func, var=None):
+        """
+        node 是否为 func(...) 的调用；给出 var 时第一个参数须为该变量。
+        """
+        if not (
+            isinstance(node, ast.Call)
+            and isinstance(node.func, ast.Name)
+            and node.func.id == func
+        ):
+            return False
+        if var is None:
+            return True
+        return len(node.args) >= 1 and self._is_name(node.args[0], var)
+
+
+def compile_candidate_filters(codes):
+    return CandidateFilterCompiler().compile(codes)
+
+
 def test_data():
     import os
     import sys
@@ -262,13 +262,8 @@ class LLMDrivenAgent(NesyAgent):
 
         ranking_price = np.argsort(np.array(attr_price))
 
-        attr_dist = []
-        for i in range(num_attractions):
-            if current_position == attr_info.iloc[i]["name"]:
-                attr_dist.append(0)
-            else:
-                transports_sel = self.collect_innercity_transport(self.query["target_city"], current_position, attr_info.iloc[i]["name"], current_time, "walk")
-                attr_dist.append(transports_sel[0]["distance"])
+        transports_all = self.env.goto_many(self.query["target_city"], current_position, attr_info["name"].tolist(), current_time, "walk")
+        attr_dist = np.where(transports_all["valid"], transports_all["distance"], 0)
         
 
         ranking_dist = np.argsort(np.array(attr_dist))
@@ -319,14 +314,8 @@ class LLMDrivenAgent(NesyAgent):
 
         ranking_price = np.argsort(np.array(res_price))
 
-        attr_dist = []
-        for i in range(num_restaurants):
-
-            if current_position == res_info.iloc[i]["name"]:
-                attr_dist.append(0)
-            else:
-                transports_sel = self.collect_innercity_transport(self.query["target_city"], current_position, res_info.iloc[i]["name"], current_time, "walk")
-                attr_dist.append(transports_sel[0]["distance"])
+        transports_all = self.env.goto_many(self.query["target_city"], current_position, res_info["name"].tolist(), current_time, "walk")
+        attr_dist = np.where(transports_all["valid"], transports_all["distance"], 0)
         
 
         ranking_dist = np.argsort(np.array(attr_dist))
@@ -35,11 +35,32 @@ from chinatravel.symbol_verification.hard_constraint import (
     evaluate_constraints_py,
 )
 from chinatravel.symbol_verification.preference import evaluate_preference_py
+from chinatravel.symbol_verification.incremental import IncrementalValidator
+from chinatravel.symbol_verification.constraint_scorer import ConstraintScorer
+from chinatravel.environment.env_server import RemoteWorldEnv
+from chinatravel.agent.branch_pool import search_branches, BranchCancelled
+from chinatravel.agent.transposition import TranspositionTable, poi_state
+from chinatravel.agent.cost_ledger import CostLedger, min_innercity_cost
+from chinatravel.agent.anytime import AnytimeSchedule, BranchTimeOut
+from chinatravel.agent.nesy_agent.ast_checker import compile_candidate_filters
 
 from chinatravel.symbol_verification.concept_func import *
 from chinatravel.agent.nesy_agent.nl2sl_hybrid import nl2sl_reflect
 from copy import deepcopy
 
+# counters a branch search adds to, summed over the search workers
+SEARCH_COUNTERS = [
+    "search_nodes",
+    "backtrack_count",
+    "llm_rec_count",
+    "llm_rec_format_error",
+    "llm_inference_time_count",
+    "constraints_validation_count",
+    "commonsense_pass_count",
+    "logical_pass_count",
+    "all_constraints_pass",
+]
+
 
 class NesyAgent(BaseAgent):
     # def __init__(
@@ -72,6 +93,36 @@ class NesyAgent(BaseAgent):
         self.least_plan_schema, self.least_plan_comm = None, None
         self.method = kwargs["method"]
 
+        self.validator = None
+        # backtrack as soon as the partial plan breaks a commonsense constraint
+        self.prune_invalid_prefix = kwargs.get("prune_invalid_prefix", True)
+
+        # > 1: search the intercity-transport and hotel combinations in parallel
+        self.search_workers = kwargs.get("search_workers", 1)
+        self.search_cancelled = None
+
+        # states kept by the transposition table of dfs_poi, 0: no table
+        self.transposition_size = kwargs.get("transposition_size", 0)
+        self.transpositions = None
+
+        # costs of the partial plan, pushed and popped by dfs_poi
+        self.costs = CostLedger()
+
+        # drop the POIs, hotels and inner-city transports that a hard_logic_py
+        # constraint rules out before the search (see ast_checker.py)
+        self.prefilter_candidates = kwargs.get("prefilter_candidates", True)
+        self.candidate_filters = None
+
+        # hard_logic_py compiled for the reranking of candidates and the checks
+        # of the leaves
+        self.constraint_scorer = None
+
+        # spread TIME_CUT over the branches and narrow the search as it runs
+        # out (see anytime.py)
+        self.anytime_search = kwargs.get("anytime_search", False)
+        self.anytime = None
+        self.time_to_first_feasible = None
+
         print("cache dir:", self.cache_dir)
         if not os.path.exists(
             os.path.join(self.cache_dir, self.method + "_" + self.backbone_llm.name)
@@ -154,22 +205,14 @@ class NesyAgent(BaseAgent):
         if succ:
             plan_out = plan
         else:
+            plan_out = self.best_plan()
             if self.least_plan_logic is not None:
-                plan_out = self.least_plan_logic
-
                 if preference_search:
                     plan_out["preference_value"] = self.least_plan_logic_pvalue
 
                 print("The least plan with logic constraints: ", plan_out)
                 succ = True
 
-            elif self.least_plan_comm is not None:
-                plan_out = self.least_plan_comm
-            elif self.least_plan_schema is not None:
-                plan_out = self.least_plan_schema
-            else:
-                plan_out = {}
-
             plan_out["search_time_sec"] = time.time() - self.time_before_search
             plan_out["llm_inference_time_sec"] = self.llm_inference_time_count
             if plan_out["search_time_sec"] > self.TIME_CUT:
@@ -199,12 +242,35 @@ class NesyAgent(BaseAgent):
 
         plan_out["search_nodes"] = self.search_nodes
         plan_out["backtrack_count"] = self.backtrack_count
+        plan_out["time_to_first_feasible_sec"] = self.time_to_first_feasible
+        if self.anytime is not None:
+            plan_out["anytime"] = self.anytime.summary()
+        if self.transpositions is not None:
+            plan_out["transposition"] = self.transpositions.summary()
+        if self.candidate_filters is not None:
+            plan_out["candidate_filters"] = self.candidate_filters.summary()
+        env_stats = self.env.stats(reset=True)
+        if env_stats is not None:
+            plan_out["env_stats"] = env_stats
         plan_out["constraints_validation_count"] = self.constraints_validation_count
         plan_out["commonsense_pass_count"] = self.commonsense_pass_count
         plan_out["logical_pass_count"] = self.logical_pass_count
         plan_out["all_constraints_pass"] = self.all_constraints_pass
         return succ, plan_out
 
+    def best_plan(self):
+        """
+        The best plan validated so far: passing every constraint, else passing
+        the commonsense ones, else the last one checked.
+        """
+        if self.least_plan_logic is not None:
+            return self.least_plan_logic
+        if self.least_plan_comm is not None:
+            return self.least_plan_comm
+        if self.least_plan_schema is not None:
+            return self.least_plan_schema
+        return {}
+
     def constraints_validation(self, query, plan, poi_plan):
 
         self.constraints_validation_count += 1
@@ -220,7 +286,11 @@ class NesyAgent(BaseAgent):
 
         self.least_plan_schema = deepcopy(res_plan)
 
-        bool_result = func_commonsense_constraints(query, res_plan, verbose=True)
+        if self.validator is None or self.validator.query is not query:
+            self.validator = IncrementalValidator(query)
+        bool_result = self.validator.check(plan)
+        if not bool_result:
+            print("Commonsense constraints failed!")
 
         # if not bool_result:
         #     exit(0)
@@ -228,15 +298,9 @@ class NesyAgent(BaseAgent):
         if bool_result:
             self.commonsense_pass_count += 1
 
-        try:
-            extracted_vars = get_symbolic_concepts(query, res_plan, need_ood=False)
-
-        except:
-            extracted_vars = None
-
-        print(extracted_vars)
-
-        logical_result = evaluate_constraints_py(query["hard_logic_py"], res_plan, verbose=True)
+        # the constraints compiled once per query, with the results of
+        # evaluate_constraints_py
+        logical_result = self.get_constraint_scorer(query).evaluate(res_plan)
 
         print(logical_result)
 
@@ -263,6 +327,8 @@ class NesyAgent(BaseAgent):
         if bool_result:
             print("\n Pass! \n")
             self.all_constraints_pass += 1
+            if self.time_to_first_feasible is None:
+                self.time_to_first_feasible = time.time() - self.time_before_search
 
             if self.least_plan_logic is None:
                 self.least_plan_logic = res_plan
@@ -391,6 +457,17 @@ class NesyAgent(BaseAgent):
     def add_restaurant(
         self, current_plan, poi_type, poi_sel, current_day, arrived_time, transports_sel
     ):
+        activity = self.restaurant_activity(
+            poi_type, poi_sel, arrived_time, transports_sel
+        )
+        tmp_plan = deepcopy(current_plan)
+        tmp_plan[current_day]["activities"].append(activity)
+        return tmp_plan
+
+    def restaurant_activity(self, poi_type, poi_sel, arrived_time, transports_sel):
+        """
+        The activity add_restaurant adds, without a copy of the plan.
+        """
 
         # 开放时间
         opentime, endtime = (
@@ -434,9 +511,8 @@ class NesyAgent(BaseAgent):
         if time_compare_if_earlier_equal(endtime, act_end_time):
             act_end_time = endtime
 
-        tmp_plan = deepcopy(current_plan)
-        tmp_plan[current_day]["activities"] = self.add_poi(
-            activities=tmp_plan[current_day]["activities"],
+        return self.add_poi(
+            activities=[],
             position=poi_sel["name"],
             poi_type=poi_type,
             price=int(poi_sel["price"]),
@@ -444,12 +520,22 @@ class NesyAgent(BaseAgent):
             start_time=act_start_time,
             end_time=act_end_time,
             innercity_transports=transports_sel,
-        )
-        return tmp_plan
+        )[-1]
 
     def add_attraction(
         self, current_plan, poi_type, poi_sel, current_day, arrived_time, transports_sel
     ):
+        activity = self.attraction_activity(
+            poi_type, poi_sel, arrived_time, transports_sel
+        )
+        tmp_plan = deepcopy(current_plan)
+        tmp_plan[current_day]["activities"].append(activity)
+        return tmp_plan
+
+    def attraction_activity(self, poi_type, poi_sel, arrived_time, transports_sel):
+        """
+        The activity add_attraction adds, without a copy of the plan.
+        """
 
         # 开放时间
         opentime, endtime = (
@@ -474,9 +560,8 @@ class NesyAgent(BaseAgent):
         if time_compare_if_earlier_equal(endtime, act_end_time):
             act_end_time = endtime
 
-        tmp_plan = deepcopy(current_plan)
-        tmp_plan[current_day]["activities"] = self.add_poi(
-            activities=tmp_plan[current_day]["activities"],
+        activity = self.add_poi(
+            activities=[],
             position=poi_sel["name"],
             poi_type=poi_type,
             price=int(poi_sel["price"]),
@@ -484,10 +569,10 @@ class NesyAgent(BaseAgent):
             start_time=act_start_time,
             end_time=act_end_time,
             innercity_transports=transports_sel,
-        )
-        tmp_plan[current_day]["activities"][-1]["tickets"] = self.query["people_number"]
+        )[-1]
+        activity["tickets"] = self.query["people_number"]
 
-        return tmp_plan
+        return activity
 
     def check_if_too_late(
         self, query, current_day, current_time, current_position, poi_plan
@@ -688,12 +773,39 @@ class NesyAgent(BaseAgent):
         # exit(0)
         return reranking_list
 
+    def get_constraint_scorer(self, query):
+        """
+        The ConstraintScorer of the hard_logic_py of the query, compiled once.
+        """
+        if (
+            self.constraint_scorer is None
+            or self.constraint_scorer.codes != query["hard_logic_py"]
+        ):
+            self.constraint_scorer = ConstraintScorer(query["hard_logic_py"])
+        return self.constraint_scorer
+
+    def score_candidates(self, query, plan, current_day, activities):
+        """
+        Number of constraints passed with each candidate activity added to the
+        plan, 0 for None, scored in one batch against the shared plan.
+        """
+        res_plan = {
+            "people_number": query["people_number"],
+            "start_city": query["start_city"],
+            "target_city": query["target_city"],
+            "itinerary": plan,
+        }
+        return self.get_constraint_scorer(query).score_candidates(
+            res_plan, current_day, activities
+        )
+
     def reranking_hotel_with_constraints(
         self, ranking_hotel, hotel_info, query, query_room_number
     ):
 
         pass_num_list = np.zeros(len(hotel_info))
         ### check constraints
+        scorer = self.get_constraint_scorer(query)
 
         for idx in range(len(hotel_info)):
             hotel_sel = hotel_info.iloc[idx]
@@ -725,11 +837,7 @@ class NesyAgent(BaseAgent):
             # print("validate the plan [for query {}]: ".format(query["uid"]))
             # print(res_plan)
 
-            logical_result = evaluate_constraints_py(query["hard_logic_py"], res_plan)
-
-            # print(logical_result)
-
-            pass_num_list[idx] = np.sum(logical_result)
+            pass_num_list[idx] = scorer.score(res_plan)
 
         pass_maxx = int(np.max(pass_num_list))
 
@@ -765,9 +873,17 @@ class NesyAgent(BaseAgent):
         ranking_restaurants,
     ):
 
-        pass_num_list = []
         ### check constraints
 
+        transports_all = self.collect_innercity_transport_many(
+            query["target_city"],
+            current_position,
+            rest_info["name"].tolist(),
+            current_time,
+            "taxi",
+        )
+        # the candidate activities, None for a POI that cannot be added
+        activities = []
         for idx in range(len(rest_info)):
             poi_sel = rest_info.iloc[idx]
             self.search_nodes += 1
@@ -776,13 +892,7 @@ class NesyAgent(BaseAgent):
                 arrived_time = current_time
             else:
 
-                transports_sel = self.collect_innercity_transport(
-                    query["target_city"],
-                    current_position,
-                    poi_sel["name"],
-                    current_time,
-                    "taxi",
-                )
+                transports_sel = transports_all[idx]
                 if not isinstance(transports_sel, list):
                     self.backtrack_count += 1
                     print("inner-city transport error, backtrack...")
@@ -795,25 +905,15 @@ class NesyAgent(BaseAgent):
 
 
             try:
-                tmp_plan = self.add_restaurant(
-                    plan, poi_type, poi_sel, current_day, arrived_time, transports_sel
-                )
-                res_plan = {
-                    "people_number": query["people_number"],
-                    "start_city": query["start_city"],
-                    "target_city": query["target_city"],
-                    "itinerary": tmp_plan,
-                }
-                logical_result = evaluate_constraints_py(
-                    query["hard_logic_py"], res_plan
+                activities.append(
+                    self.restaurant_activity(
+                        poi_type, poi_sel, arrived_time, transports_sel
+                    )
                 )
-                pass_num_list.append(np.sum(logical_result))
             except:
-                pass_num_list.append(0)
-
-            # print(logical_result)
-            # pass_num_list.append(np.sum(logical_result))
+                activities.append(None)
 
+        pass_num_list = self.score_candidates(query, plan, current_day, activities)
         pass_maxx = np.max(pass_num_list)
 
         # print(pass_num_list)
@@ -852,9 +952,17 @@ class NesyAgent(BaseAgent):
         ranking_attractions,
     ):
 
-        pass_num_list = []
         ### check constraints
 
+        transports_all = self.collect_innercity_transport_many(
+            query["target_city"],
+            current_position,
+            attr_info["name"].tolist(),
+            current_time,
+            "taxi",
+        )
+        # the candidate activities, None for a POI that cannot be added
+        activities = []
         for idx in range(len(attr_info)):
             poi_sel = attr_info.iloc[idx]
             self.search_nodes += 1
@@ -862,13 +970,7 @@ class NesyAgent(BaseAgent):
                 transports_sel = []
                 arrived_time = current_time
             else:
-                transports_sel = self.collect_innercity_transport(
-                    query["target_city"],
-                    current_position,
-                    poi_sel["name"],
-                    current_time,
-                    "taxi",
-                )
+                transports_sel = transports_all[idx]
                 if not isinstance(transports_sel, list):
                     self.backtrack_count += 1
                     print("inner-city transport error, backtrack...")
@@ -881,21 +983,15 @@ class NesyAgent(BaseAgent):
 
 
             try:
-                tmp_plan = self.add_attraction(
-                    plan, poi_type, poi_sel, current_day, arrived_time, transports_sel
-                )
-                res_plan = {
-                    "people_number": query["people_number"],
-                    "start_city": query["start_city"],
-                    "target_city": query["target_city"],
-                    "itinerary": tmp_plan,
-                }
-                logical_result = evaluate_constraints_py(
-                    query["hard_logic_py"], res_plan
+                activities.append(
+                    self.attraction_activity(
+                        poi_type, poi_sel, arrived_time, transports_sel
+                    )
                 )
-                pass_num_list.append(np.sum(logical_result))
             except:
-                pass_num_list.append(0)
+                activities.append(None)
+
+        pass_num_list = self.score_candidates(query, plan, current_day, activities)
         pass_maxx = np.max(pass_num_list)
 
         # print(pass_num_list)
@@ -917,8 +1013,66 @@ class NesyAgent(BaseAgent):
     def dfs_poi(
         self, query, poi_plan, plan, current_time, current_position, current_day=0
     ):
+        """
+        search_poi with the activity the caller has just added pushed on the
+        cost ledger, skipping the states (see transposition.py) whose search
+        was already exhausted if the transposition table is on.
+        """
+        if current_time == "":
+            # a new intercity-transport and hotel branch
+            self.costs.clear()
+            if self.transpositions is not None:
+                self.transpositions.clear()
+        self.costs.push(plan)
+        try:
+            if self.transpositions is None or not (
+                current_time != "" and self.validator.prefix_passed(plan)
+            ):
+                return self.search_poi(
+                    query, poi_plan, plan, current_time, current_position, current_day
+                )
+
+            state = poi_state(plan, current_day, current_time, current_position)
+            if self.transpositions.exhausted(state):
+                # a hit does not reach the time check of search_poi, and the
+                # loops above can go through many of them
+                self.check_search_time()
+                self.backtrack_count += 1
+                print("the same state was already searched, backtrack...")
+                return False, plan
+
+            success, plan = self.search_poi(
+                query, poi_plan, plan, current_time, current_position, current_day
+            )
+            if not success:
+                self.transpositions.add(state)
+            return success, plan
+        finally:
+            self.costs.pop()
+
+    def min_remaining_innercity_cost(
+        self, query, poi_plan, current_day, current_time, current_position
+    ):
+        """
+        Lower bound on the inner-city transport still to pay: the ride to the
+        hotel tonight unless already there, and the ride to the station of the
+        back transport on the last day.
+        """
+        if current_time == "":
+            return 0
+        legs = 0
+        if current_day < query["days"] - 1 and "accommodation" in poi_plan:
+            legs += current_position != poi_plan["accommodation"]["name"]
+            legs += 1
+        elif current_day == query["days"] - 1:
+            legs += current_position != poi_plan["back_transport"]["From"]
+        return min_innercity_cost(
+            self.innercity_transports_ranking_from_query,
+            legs,
+            query["people_number"],
+        )
 
-        self.search_nodes += 1
+    def check_search_time(self):
         if (
             time.time() - self.time_before_search
             > self.TIME_CUT + self.llm_inference_time_count
@@ -926,6 +1080,31 @@ class NesyAgent(BaseAgent):
 
             raise TimeOutError
 
+        if self.search_cancelled is not None and self.search_cancelled():
+            raise BranchCancelled
+
+        if self.anytime is not None and self.anytime.branch_expired():
+            raise BranchTimeOut
+
+    def search_time_spent(self):
+        return time.time() - self.time_before_search - self.llm_inference_time_count
+
+    def current_search_width(self):
+        """
+        Candidates tried per node: search_width, narrowed near the deadline
+        in anytime mode.
+        """
+        if self.anytime is None:
+            return self.search_width
+        return self.anytime.width(self.search_width)
+
+    def search_poi(
+        self, query, poi_plan, plan, current_time, current_position, current_day=0
+    ):
+
+        self.search_nodes += 1
+        self.check_search_time()
+
         if self.check_if_too_late(
             query, current_day, current_time, current_position, poi_plan
         ):
@@ -934,22 +1113,26 @@ class NesyAgent(BaseAgent):
             return False, plan
 
         if self.required_budget != None:
-            total_cost = 0
-            for day_activities in plan:
-                for activity in day_activities["activities"]:
-                    if activity["type"] in [
-                        "breakfast",
-                        "lunch",
-                        "dinner",
-                        "attraction",
-                    ]:
-                        total_cost += activity["cost"]
-
-            if total_cost + self.intercity_with_hotel_cost > self.required_budget:
+            # spent so far, including inner-city transport, and what the rest
+            # of the trip cannot avoid
+            total_cost = (
+                self.costs.total()
+                + self.intercity_with_hotel_cost
+                + self.min_remaining_innercity_cost(
+                    query, poi_plan, current_day, current_time, current_position
+                )
+            )
+
+            if total_cost > self.required_budget:
                 self.backtrack_count += 1
                 print("budget exceeded, backtrack...")
                 return False, plan
 
+        if self.prune_invalid_prefix and self.validator.prefix_failed(plan):
+            self.backtrack_count += 1
+            print("the plan already breaks a commonsense constraint, backtrack...")
+            return False, plan
+
         # intercity_transport - go
         if current_day == 0 and current_time == "":
             plan = [{"day": current_day + 1, "activities": []}]
@@ -1024,6 +1207,10 @@ class NesyAgent(BaseAgent):
         print("candidates_type: ", candidates_type)
 
         while len(candidates_type) > 0:
+            # select_next_poi_type of RuleDrivenAgent can pick the same type
+            # again, and a type whose candidates are all cut by the search
+            # width does not reach the time check of the next node
+            self.check_search_time()
 
             poi_type, candidates_type = self.select_next_poi_type(
                 candidates_type,
@@ -1162,10 +1349,11 @@ class NesyAgent(BaseAgent):
 
                     for sea_i, r_i in enumerate(ranking_idx):
 
-                        if self.search_width != None and sea_i >= self.search_width:
+                        search_width = self.current_search_width()
+                        if search_width != None and sea_i >= search_width:
                             print(
                                 "Out of search_width [{}], break".format(
-                                    self.search_width
+                                    search_width
                                 )
                             )
                             break
@@ -1269,10 +1457,11 @@ class NesyAgent(BaseAgent):
 
                     for sea_i, r_i in enumerate(ranking_idx):
 
-                        if self.search_width != None and sea_i >= self.search_width:
+                        search_width = self.current_search_width()
+                        if search_width != None and sea_i >= search_width:
                             print(
                                 "Out of search_width [{}], break".format(
-                                    self.search_width
+                                    search_width
                                 )
                             )
                             break
@@ -1550,9 +1739,12 @@ class NesyAgent(BaseAgent):
 
         self.time_before_search = time.time()
         self.llm_inference_time_count = 0
+        self.time_to_first_feasible = None
+        self.anytime = None
+        if self.anytime_search:
+            self.anytime = AnytimeSchedule(self.TIME_CUT, spent=self.search_time_spent)
 
         # reset the cache before searching
-        poi_plan = {}
         self.restaurants_visiting = []
         self.attractions_visiting = []
         self.food_type_visiting = []
@@ -1574,6 +1766,12 @@ class NesyAgent(BaseAgent):
 
         self.least_plan_schema, self.least_plan_comm, self.least_plan_logic = None, None, None
         self.least_plan_logical_pass = -1
+        self.validator = IncrementalValidator(query)
+        # off in preference search: a state reached another way completes
+        # into other plans, whose preference value is not the one scored
+        self.transpositions = None
+        if self.transposition_size > 0 and not self.preference_search:
+            self.transpositions = TranspositionTable(self.transposition_size)
 
         ranking_go = self.ranking_intercity_transport_go(go_info, query)
         ranking_go = self.reranking_intercity_transport_go_with_constraints(
@@ -1589,10 +1787,79 @@ class NesyAgent(BaseAgent):
         )
 
         self.innercity_transports_ranking_from_query = self.ranking_innercity_transport_from_query(query)
+        if self.candidate_filters is not None:
+            self.innercity_transports_ranking_from_query = (
+                self.candidate_filters.filter_transports(
+                    self.innercity_transports_ranking_from_query
+                )
+            )
+
+        branches = self.iter_search_branches(
+            query,
+            go_info,
+            back_info,
+            ranking_go,
+            ranking_hotel,
+            query_room_number,
+            query_room_type,
+        )
+        if self.search_workers > 1:
+            return self.search_in_parallel(query, branches)
+
+        if self.anytime is not None:
+            branches = self.anytime.rounds(branches)
+
+        for branch in branches:
+            self.enter_branch(branch)
+            print("search: ...")
+            try:
+                success, plan = self.dfs_poi(
+                    query,
+                    branch["poi_plan"],
+                    plan=[],
+                    current_time="",
+                    current_position="",
+                )
+            except TimeOutError as e:
+                print("TimeOutError")
+                return False, {"error_info": "TimeOutError"}
+            except BranchTimeOut:
+                self.anytime.expire(branch)
+                self.backtrack_count += 1
+                print("out of time for the intercity-transport and hotels, try the next ones...")
+                continue
+            # exit(0)
+
+            print(success, plan)
+            if success:
+                return True, plan
+            else:
+                if time.time() > self.time_before_search + self.TIME_CUT:
+                    print("Searching TIME OUT !!!")
+                    return False, {"error_info": "TimeOutError"}
+
+                self.backtrack_count += 1
+                print("search failed given the intercity-transport and hotels, backtrack...")
+
+        return False, {"error_info": "No solution found."}
 
+    def iter_search_branches(
+        self,
+        query,
+        go_info,
+        back_info,
+        ranking_go,
+        ranking_hotel,
+        query_room_number,
+        query_room_type,
+    ):
+        """
+        The go-transport x back-transport x hotel combinations worth a POI
+        search, in ranking order, as {"poi_plan", "required_rooms",
+        "intercity_with_hotel_cost"}.
+        """
         for go_i in ranking_go:
             go_info_i = go_info.iloc[go_i]
-            poi_plan["go_transport"] = go_info_i
             self.search_nodes += 1
 
             ranking_back = self.ranking_intercity_transport_back(
@@ -1605,13 +1872,13 @@ class NesyAgent(BaseAgent):
 
             for back_i in ranking_back:
                 back_info_i = back_info.iloc[back_i]
-                poi_plan["back_transport"] = back_info_i
+                poi_plan = {"go_transport": go_info_i, "back_transport": back_info_i}
                 self.search_nodes += 1
 
                 if query["days"] > 1:
                     for hotel_i in ranking_hotel:
-                        poi_plan["accommodation"] = self.memory["accommodations"].iloc[hotel_i]
-                        room_type = poi_plan["accommodation"]["numbed"]
+                        accommodation = self.memory["accommodations"].iloc[hotel_i]
+                        room_type = accommodation["numbed"]
                         self.search_nodes += 1
 
                         required_rooms = (int((query["people_number"] - 1) / room_type) + 1)
@@ -1640,19 +1907,17 @@ class NesyAgent(BaseAgent):
                                     self.backtrack_count += 1
                                     print("room_number * room_type not match, backtrack...")
                                 continue
-                        self.required_rooms = required_rooms
 
-                        self.intercity_with_hotel_cost = (
-                            poi_plan["go_transport"]["Cost"]
-                            + poi_plan["back_transport"]["Cost"]
-                        ) * query["people_number"] + poi_plan["accommodation"][
+                        intercity_with_hotel_cost = (
+                            go_info_i["Cost"] + back_info_i["Cost"]
+                        ) * query["people_number"] + accommodation[
                             "price"
                         ] * required_rooms * (
                             query["days"] - 1
                         )
                         if (
                             self.required_budget != None
-                            and self.required_budget - self.intercity_with_hotel_cost
+                            and self.required_budget - intercity_with_hotel_cost
                             <= self.query["people_number"]
                             * (self.query["days"] - 1)
                             * 100
@@ -1661,71 +1926,179 @@ class NesyAgent(BaseAgent):
                             print("required_budget - intercity_with_hotel_cost <= 100 * people_number * (days-1), backtrack...")
                             continue
 
-                        print("search: ...")
-                        try:
-                            success, plan = self.dfs_poi(
-                                query,
-                                poi_plan,
-                                plan=[],
-                                current_time="",
-                                current_position="",
-                            )
-                        except TimeOutError as e:
-                            print("TimeOutError")
-                            return False, {"error_info": "TimeOutError"}
-                        # exit(0)
-
-                        print(success, plan)
-                        if success:
-                            return True, plan
-                        else:
-                            if time.time() > self.time_before_search + self.TIME_CUT:
-                                print("Searching TIME OUT !!!")
-                                return False, {"error_info": "TimeOutError"}
-
-                            self.backtrack_count += 1
-                            print("search failed given the intercity-transport and hotels, backtrack...")
+                        yield {
+                            "poi_plan": dict(poi_plan, accommodation=accommodation),
+                            "required_rooms": required_rooms,
+                            "intercity_with_hotel_cost": intercity_with_hotel_cost,
+                        }
 
                 else:
                     if time_compare_if_earlier_equal(
-                        poi_plan["back_transport"]["BeginTime"],
-                        poi_plan["go_transport"]["EndTime"],
+                        back_info_i["BeginTime"],
+                        go_info_i["EndTime"],
                     ):
                         self.backtrack_count += 1
                         print("back_transport BeginTime earlier than go_transport EndTime, backtrack...")
                         continue
 
-                    self.intercity_with_hotel_cost = (
-                        poi_plan["go_transport"]["Cost"]
-                        + poi_plan["back_transport"]["Cost"]
-                    ) * query["people_number"]
-                    print("search: ...")
-                    try:
-                        success, plan = self.dfs_poi(
-                            query,
-                            poi_plan,
-                            plan=[],
-                            current_time="",
-                            current_position="",
-                        )
-                    except TimeOutError as e:
-                        print("TimeOutError")
-                        return False, {"error_info": "TimeOutError"}
-
-                    print(success, plan)
-                    if success:
-                        return True, plan
-                    else:
-                        if time.time() > self.time_before_search + self.TIME_CUT:
-                            print("Searching TIME OUT !!!")
-                            return False, {"error_info": "TimeOutError"}
-                        
-                        self.backtrack_count += 1
-                        print("search failed given the intercity-transport and hotels, backtrack...")
+                    yield {
+                        "poi_plan": poi_plan,
+                        "required_rooms": None,
+                        "intercity_with_hotel_cost": (
+                            go_info_i["Cost"] + back_info_i["Cost"]
+                        ) * query["people_number"],
+                    }
+
+    def enter_branch(self, branch):
+        if branch["required_rooms"] is not None:
+            self.required_rooms = branch["required_rooms"]
+        self.intercity_with_hotel_cost = branch["intercity_with_hotel_cost"]
+        if self.anytime is not None:
+            self.anytime.enter_branch()
+
+    def search_in_parallel(self, query, branches):
+        """
+        The branch loop of generate_plan_with_search, with the branches
+        searched by `search_workers` forked processes; the plan, the least
+        plans and the counters come out as in the serial loop.
+        """
+        pvalue = getattr(self, "least_plan_logic_pvalue", None)
+
+        def search(branch, cancelled):
+            return self.search_branch(query, branch, cancelled, pvalue)
+
+        # the branches are generated ahead of the searches: keep what each one
+        # added to the counters, to drop the branches the serial loop would
+        # not have reached
+        generated = []
+
+        def counted(branches):
+            for branch in branches:
+                generated.append({name: getattr(self, name) for name in SEARCH_COUNTERS})
+                yield branch
+
+        results = search_branches(
+            counted(branches),
+            search,
+            self.search_workers,
+            initializer=self.init_search_worker,
+        )
+        if len(results) > 0 and (results[-1]["success"] or results[-1]["timeout"]):
+            for name, value in generated[len(results) - 1].items():
+                setattr(self, name, value)
+
+        for result in results:
+            for name, delta in result["counters"].items():
+                setattr(self, name, getattr(self, name) + delta)
+            if self.transpositions is not None:
+                self.transpositions.add_counters(result["transposition"])
+            self.merge_least_plans(result)
+
+            if result["success"]:
+                return True, result["plan"]
+            if result["timeout"]:
+                print("Searching TIME OUT !!!")
+                return False, {"error_info": "TimeOutError"}
 
+            self.backtrack_count += 1
+            print("search failed given the intercity-transport and hotels, backtrack...")
 
         return False, {"error_info": "No solution found."}
 
+    def init_search_worker(self):
+        if isinstance(self.env, RemoteWorldEnv):
+            self.env = self.env.clone()
+
+    def search_branch(self, query, branch, cancelled, pvalue):
+        """
+        POI search of one branch in a search worker. Returns whether the
+        search ends here (a plan, or out of time) and what the parent merges:
+        the plan, the counters added to and the least plans of the branch.
+        """
+        counters = {name: getattr(self, name) for name in SEARCH_COUNTERS}
+        table = self.transpositions.counters() if self.transpositions is not None else {}
+        self.least_plan_schema, self.least_plan_comm, self.least_plan_logic = None, None, None
+        self.least_plan_logical_pass = -1
+        self.least_plan_logic_pvalue = pvalue
+
+        self.enter_branch(branch)
+        print("search: ...")
+        success, plan, timeout = False, None, False
+        self.search_cancelled = cancelled
+        try:
+            success, plan = self.dfs_poi(
+                query,
+                branch["poi_plan"],
+                plan=[],
+                current_time="",
+                current_position="",
+            )
+        except TimeOutError as e:
+            print("TimeOutError")
+            timeout = True
+        except BranchTimeOut:
+            print("out of time for the intercity-transport and hotels")
+        finally:
+            self.search_cancelled = None
+
+        print(success, plan)
+        if not success and time.time() > self.time_before_search + self.TIME_CUT:
+            timeout = True
+
+        return success or timeout, {
+            "success": success,
+            "plan": plan if success else None,
+            "timeout": timeout,
+            "counters": {
+                name: getattr(self, name) - value for name, value in counters.items()
+            },
+            "transposition": {
+                name: getattr(self.transpositions, name) - value
+                for name, value in table.items()
+            },
+            "least_plan_schema": self.least_plan_schema,
+            "least_plan_comm": self.least_plan_comm,
+            "least_plan_logical_pass": self.least_plan_logical_pass,
+            "least_plan_logic": self.least_plan_logic,
+            "least_plan_logic_pvalue": self.least_plan_logic_pvalue,
+            "time_to_first_feasible": self.time_to_first_feasible,
+        }
+
+    def merge_least_plans(self, result):
+        """
+        Update the least plans with those of a branch searched by a worker,
+        as constraints_validation would have.
+        """
+        if result["least_plan_schema"] is not None:
+            self.least_plan_schema = result["least_plan_schema"]
+
+        if result["time_to_first_feasible"] is not None and (
+            self.time_to_first_feasible is None
+            or result["time_to_first_feasible"] < self.time_to_first_feasible
+        ):
+            self.time_to_first_feasible = result["time_to_first_feasible"]
+
+        if (
+            result["least_plan_comm"] is not None
+            and result["least_plan_logical_pass"] > self.least_plan_logical_pass
+        ):
+            self.least_plan_comm = result["least_plan_comm"]
+            self.least_plan_logical_pass = result["least_plan_logical_pass"]
+
+        if result["least_plan_logic"] is None:
+            return
+        if self.least_plan_logic is None:
+            self.least_plan_logic = result["least_plan_logic"]
+            if self.preference_search:
+                self.least_plan_logic_pvalue = result["least_plan_logic_pvalue"]
+        elif self.preference_search:
+            pvalue = result["least_plan_logic_pvalue"]
+            if (self.query["preference_opt"] == "maximize" and pvalue > self.least_plan_logic_pvalue) or (
+                self.query["preference_opt"] == "minimize" and pvalue < self.least_plan_logic_pvalue
+            ):
+                self.least_plan_logic = result["least_plan_logic"]
+                self.least_plan_logic_pvalue = pvalue
+
     def symbolic_search(self, symoblic_query):
 
         # print(symoblic_query)
@@ -1772,6 +2145,13 @@ class NesyAgent(BaseAgent):
             symoblic_query["target_city"], "restaurant"
         )
 
+        self.candidate_filters = None
+        if self.prefilter_candidates:
+            self.candidate_filters = compile_candidate_filters(
+                symoblic_query.get("hard_logic_py", [])
+            )
+            self.memory = self.candidate_filters.apply(self.memory)
+
         # print(symoblic_query)
 
 
@@ -1786,20 +2166,9 @@ class NesyAgent(BaseAgent):
 
     def collect_innercity_transport(self, city, start, end, start_time, trans_type):
 
-        call_str = (
-            'goto("{city}", "{start}", "{end}", "{start_time}", "{trans_type}")'.format(
-                city=city,
-                start=start,
-                end=end,
-                start_time=start_time,
-                trans_type=trans_type,
-            )
-        )
-
-        # print(call_str)
         if start == end:
             return []
-        info = self.env(call_str)["data"]
+        info = self.env.call("goto", city, start, end, start_time, trans_type)["data"]
 
         # print(info)
 
@@ -1822,25 +2191,57 @@ class NesyAgent(BaseAgent):
 
         return info
 
+    def collect_innercity_transport_many(self, city, start, ends, start_time, trans_type):
+        """
+        collect_innercity_transport from one start to many ends, with a single
+        goto_many call for walk and taxi. Returns one entry per end.
+        """
+        if trans_type == "metro":
+            return [
+                self.collect_innercity_transport(city, start, end, start_time, trans_type)
+                for end in ends
+            ]
+        res = self.env.goto_many(city, start, ends, start_time, trans_type)
+        end_time, cost, distance = (
+            res["end_time"],
+            res["cost"].tolist(),
+            res["distance"].tolist(),
+        )
+        cars = int((self.query["people_number"] - 1) / 4) + 1
+        infos = []
+        for i, end in enumerate(ends):
+            if start == end:
+                infos.append([])
+                continue
+            if not res["valid"][i]:
+                infos.append("No solution")
+                continue
+            info = {
+                "start": start,
+                "end": end,
+                "mode": trans_type,
+                "start_time": start_time,
+                "end_time": end_time[i],
+                "cost": cost[i],
+                "distance": distance[i],
+                "price": cost[i],
+            }
+            if trans_type == "taxi":
+                info["cars"] = cars
+                info["cost"] = info["price"] * info["cars"]
+            infos.append([info])
+        return infos
+
     def collect_intercity_transport(self, source_city, target_city, trans_type):
 
-        info_return = self.env(
+        info_return = self.env.fetch_all(
             "intercity_transport_select('{source_city}', '{target_city}', '{trans_type}')".format(
                 source_city=source_city, target_city=target_city, trans_type=trans_type
             )
         )
         if not info_return["success"]:
             return pd.DataFrame([])
-        trans_info = info_return["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                trans_info = pd.concat([trans_info, info_i], axis=0, ignore_index=True)
-        # print(poi_info)
-        return trans_info
+        return info_return["data"]
 
     def collect_poi_info_all(self, city, poi_type):
 
@@ -1853,16 +2254,9 @@ class NesyAgent(BaseAgent):
         else:
             raise NotImplementedError
 
-        poi_info = self.env(
+        poi_info = self.env.fetch_all(
             "{func}('{city}', 'name', lambda x: True)".format(func=func_name, city=city)
         )["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                poi_info = pd.concat([poi_info, info_i], axis=0, ignore_index=True)
 
         # print(poi_info)
         return poi_info
@@ -74,7 +74,8 @@ class RuleDrivenAgent(NesyAgent):
 
         # print("{} accommmodation, {} hotels (satisfied requirments)".format(query["target_city"], num_hotel))
 
-        index_list = hotel_info["id"].tolist()
+        # row positions: hotel_info can be a filtered table
+        index_list = list(range(num_hotel))
 
         # if "cost" in query:
         cost_list = hotel_info["price"].tolist()
@@ -262,19 +263,14 @@ class RuleDrivenAgent(NesyAgent):
         attr_weight = np.ones(num_attractions)
         attr_info = self.memory["attractions"]
 
-        attr_dist = []
-        for i in range(num_attractions):
-            transports_sel = self.collect_innercity_transport(
-                self.query["target_city"],
-                current_position,
-                attr_info.iloc[i]["name"],
-                current_time,
-                "walk",
-            )
-            if len(transports_sel) == 0:
-                attr_dist.append(0)
-            else:
-                attr_dist.append(transports_sel[0]["distance"])
+        transports_all = self.env.goto_many(
+            self.query["target_city"],
+            current_position,
+            attr_info["name"].tolist(),
+            current_time,
+            "walk",
+        )
+        attr_dist = np.where(transports_all["valid"], transports_all["distance"], 0)
         # print(attr_dist)
 
         ranking_idx = np.argsort(np.array(attr_dist))
@@ -308,19 +304,14 @@ class RuleDrivenAgent(NesyAgent):
 
         ranking_price = np.argsort(np.array(res_price))
 
-        attr_dist = []
-        for i in range(num_restaurants):
-            transports_sel = self.collect_innercity_transport(
-                self.query["target_city"],
-                current_position,
-                res_info.iloc[i]["name"],
-                current_time,
-                "walk",
-            )
-            if len(transports_sel) == 0:
-                attr_dist.append(0)
-            else:            
-                attr_dist.append(transports_sel[0]["distance"])
+        transports_all = self.env.goto_many(
+            self.query["target_city"],
+            current_position,
+            res_info["name"].tolist(),
+            current_time,
+            "walk",
+        )
+        attr_dist = np.where(transports_all["valid"], transports_all["distance"], 0)
 
         ranking_dist = np.argsort(np.array(attr_dist))
 
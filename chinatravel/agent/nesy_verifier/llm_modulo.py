@@ -61,53 +61,27 @@ class LLMModuloAgent(BaseAgent):
         else:
             raise NotImplementedError
 
-        poi_info = self.env(
+        poi_info = self.env.fetch_all(
             "{func}('{city}', 'name', lambda x: True)".format(func=func_name, city=city)
         )["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                poi_info = pd.concat([poi_info, info_i], axis=0, ignore_index=True)
 
         poi_info = poi_info.rename(columns={'cost': 'price'})
         return poi_info
 
     def collect_intercity_transport(self, source_city, target_city, trans_type):
-        trans_info = self.env(
+        trans_info = self.env.fetch_all(
             "intercity_transport_select('{source_city}', '{target_city}', '{trans_type}')".format(
                 source_city=source_city, target_city=target_city, trans_type=trans_type
             )
         )["data"]
-        # print(poi_info)
-        while True:
-            info_i = self.env("next_page()")["data"]
-            if len(info_i) == 0:
-                break
-            else:
-                trans_info = pd.concat([trans_info, info_i], axis=0, ignore_index=True)
-        # print(poi_info)
         trans_info = trans_info.rename(columns={'Cost': 'price'})
         return trans_info
     
     def collect_innercity_transport(self, city, start, end, start_time, trans_type):
 
-        call_str = (
-            'goto("{city}", "{start}", "{end}", "{start_time}", "{trans_type}")'.format(
-                city=city,
-                start=start,
-                end=end,
-                start_time=start_time,
-                trans_type=trans_type,
-            )
-        )
-
-        # print(call_str)
         if start == end:
             return []
-        info = self.env(call_str)["data"]
+        info = self.env.call("goto", city, start, end, start_time, trans_type)["data"]
 
         # print(start, end, info)
 
@@ -666,16 +640,14 @@ class LLMModuloAgent(BaseAgent):
                             activity['transports']['end_time']
                             activity['transports']['mode']
                             activity['transports']['cost']
-                            call_str = (
-                                    'goto("{city}", "{start}", "{end}", "{start_time}", "{trans_type}")'.format(
-                                        city=problem["target_city"],
-                                        start=activity['transports']['from'],
-                                        end=activity['transports']['to'],
-                                        start_time=activity['transports']['start_time'],
-                                        trans_type=activity['transports']['mode'], 
-                                    )
-                                )
-                            info = self.env(call_str)["data"]
+                            info = self.env.call(
+                                "goto",
+                                problem["target_city"],
+                                activity['transports']['from'],
+                                activity['transports']['to'],
+                                activity['transports']['start_time'],
+                                activity['transports']['mode'],
+                            )["data"]
                             if len(info) == 3:
                                 info[1]["price"] = info[1]["cost"]
                                 info[1]["tickets"] = self.problem["people_number"]
@@ -2,11 +2,8 @@
 import sys
 
 
-from chinatravel.environment.tools.accommodations.apis import Accommodations
-from chinatravel.environment.tools.restaurants.apis import Restaurants
-from chinatravel.environment.tools.attractions.apis import Attractions
-from chinatravel.environment.tools.intercity_transport.apis import IntercityTransport
-from chinatravel.environment.tools.transportation.apis import Transportation
+from chinatravel.environment.tools.catalog import get_catalog
+from chinatravel.environment.tools.predicates import eq
 # from env.tools.transportation.apis import GoTo
 # from envs import goto
 import json
@@ -18,11 +15,12 @@ from chinatravel.evaluation.utils import load_json_file
     
 import pandas as pd
 
-accommodation = Accommodations()
-restaurants = Restaurants()
-attractions = Attractions()
-intercity_transport=IntercityTransport()
-innercity_transport=Transportation()
+catalog = get_catalog()
+accommodation = catalog.accommodations
+restaurants = catalog.restaurants
+attractions = catalog.attractions
+intercity_transport = catalog.intercity_transport
+innercity_transport = catalog.transportation
 
 
 '''
@@ -315,7 +313,7 @@ def collect_attractions_error(symbolic_input, plan_json, verbose=False):
                 error_info.append(f"No position information in attraction activity, day {day_i+1}.")
                 continue
             
-            select_attraction=attractions.select(target_city,key='name',func=lambda x:x==activity_i['position'])
+            select_attraction=attractions.select(target_city,key='name',func=eq(activity_i['position']))
 
             if select_attraction.empty:
                 error_info.append(f"Attraction activity, {activity_i['position']}, in day {day_i+1} is not valid in the provided information.")
@@ -406,7 +404,7 @@ def collect_hotels_error(symbolic_input, plan_json, verbose=False):
                 error_info.append(f"No position information in accommodation activity, day {day_i+1}.")
                 continue
             
-            select_hotel=accommodation.select(target_city,key='name',func=lambda x:x==activity_i['position'])
+            select_hotel=accommodation.select(target_city,key='name',func=eq(activity_i['position']))
 
             if select_hotel.empty:
                 error_info.append(f"Accommodation activity, {activity_i['position']}, in day {day_i+1} is not valid in the provided information.")
@@ -493,13 +491,13 @@ def collect_restaurants_error(symbolic_input, plan_json, verbose=False):
                 continue
             
 
-            select_restaurant=restaurants.select(target_city,key='name',func=lambda x:x==activity_i['position'])
+            select_restaurant=restaurants.select(target_city,key='name',func=eq(activity_i['position']))
 
             # print(select_restaurant)
 
             if activity_i["type"] == "breakfast" and select_restaurant.empty:
 
-                select_hotel=accommodation.select(target_city,key='name',func=lambda x:x==activity_i['position'])
+                select_hotel=accommodation.select(target_city,key='name',func=eq(activity_i['position']))
     
                 if select_hotel.empty:
                     error_info.append(f"Breakfast activity, {activity_i['position']}, in day {day_i+1} is not valid in the provided information.")
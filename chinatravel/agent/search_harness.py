@@ -0,0 +1,80 @@
+"""
+Searches run by the checks of the search components.
+
+The checks of the search components (`--search` of
+symbol_verification/incremental.py and constraint_scorer.py, and
+check_anytime.py) compare them on the plans and the candidate batches of real
+searches. This module gives them the queries and
+runs the agents quietly:
+
+- `check_queries` rotates through the supported city pairs, 1-3 days,
+- `run_search` runs `symbolic_search` of an agent with a TIME_CUT, with its
+  output silenced, and counts a search that raises as unsolved (e.g. no
+  intercity transport for the pair of cities).
+"""
+
+import os
+import time
+import tempfile
+from contextlib import redirect_stdout
+
+
+class NoLLM:
+    # the rule-driven agents only read the name of their LLM, for the cache
+    name = "none"
+
+
+_cache_dir = None
+
+
+def cache_dir():
+    global _cache_dir
+    if _cache_dir is None:
+        _cache_dir = tempfile.mkdtemp()
+    return _cache_dir
+
+
+def check_queries(cities, n, hard_logic_py=(), people_number=None):
+    """
+    n queries over the pairs of distinct `cities`, for 1-3 days and 1-4
+    people unless `people_number` is given.
+    """
+    cities = sorted(cities)
+    queries = []
+    for k in range(n):
+        # the k-th target after the start, skipping the start itself
+        offset = 1 + (k // len(cities)) % (len(cities) - 1)
+        queries.append(
+            {
+                "uid": "check_{}".format(k),
+                "start_city": cities[k % len(cities)],
+                "target_city": cities[(k + offset) % len(cities)],
+                "days": k % 3 + 1,
+                "people_number": k % 4 + 1 if people_number is None else people_number,
+                "hard_logic_py": list(hard_logic_py),
+                "nature_language": "",
+            }
+        )
+    return queries
+
+
+def run_search(agent_class, env, query, time_cut, **kwargs):
+    """
+    Search `query` with a new agent; returns (agent, success, plan, seconds).
+    """
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        agent = agent_class(
+            env=env,
+            backbone_llm=NoLLM(),
+            cache_dir=cache_dir(),
+            method="RuleNeSy",
+            **kwargs
+        )
+        agent.TIME_CUT = time_cut
+        start_time = time.time()
+        try:
+            success, plan = agent.symbolic_search(dict(query))
+        except Exception as e:
+            success, plan = False, {"error_info": type(e).__name__}
+        elapsed = time.time() - start_time
+    return agent, success, plan, elapsed
@@ -0,0 +1,99 @@
+"""
+Transposition table of the POI search.
+
+dfs_poi reaches the same sub-problem through different activity orders:
+lunch then a museum, or the museum then lunch, end at the same place and
+time with the same things done. `poi_state` is a canonical signature of
+such a state:
+
+    (day, time, position, the (type, position) pairs of every day with the
+     order within a day dropped, money spent so far)
+
+The agents record the states whose search was exhausted without a plan and
+backtrack at once when they reach one of them again. The table holds at most
+`max_size` states and evicts the least recently used ones. NesyAgent does not
+use it in preference search: the plans below a state reached another way are
+not the ones already scored, and skipping them would lose their preference
+values.
+
+The signature leaves out the order of the activities within a day and the
+transports taken before the state, so a constraint that depends on those can
+fail for one order and pass for another; the table is opt-in for this reason.
+"""
+
+from collections import OrderedDict
+
+from chinatravel.environment.tools.api_stats import hit_rate
+
+
+def poi_state(plan, current_day, current_time, current_position, extra=()):
+    """
+    Signature of a dfs_poi state; `extra` is appended for search flags that
+    change what the search below the state does.
+    """
+    days, spent = [], 0
+    for day in plan:
+        activities = []
+        for activity in day["activities"]:
+            activities.append((activity["type"], activity.get("position", "")))
+            spent += activity.get("cost", 0)
+            for transport in activity.get("transports", []):
+                spent += transport.get("cost", 0)
+        days.append(tuple(sorted(activities)))
+    return (
+        current_day,
+        current_time,
+        current_position,
+        tuple(days),
+        round(float(spent), 2),
+    ) + tuple(extra)
+
+
+class TranspositionTable:
+    def __init__(self, max_size: int = 100000):
+        self.max_size = max_size
+        self._exhausted = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def exhausted(self, state) -> bool:
+        if state in self._exhausted:
+            self._exhausted.move_to_end(state)
+            self.hits += 1
+            return True
+        self.misses += 1
+        return False
+
+    def add(self, state):
+        self._exhausted[state] = True
+        self._exhausted.move_to_end(state)
+        if len(self._exhausted) > self.max_size:
+            self._exhausted.popitem(last=False)
+            self.evictions += 1
+
+    def counters(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+    def add_counters(self, counters: dict):
+        """
+        Add the counters of a copy of the table, e.g. in a search worker.
+        """
+        for name, value in counters.items():
+            setattr(self, name, getattr(self, name) + value)
+
+    def clear(self):
+        """
+        Drop the states, e.g. for a new intercity-transport and hotel branch;
+        the counters are kept.
+        """
+        self._exhausted.clear()
+
+    def summary(self) -> dict:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": hit_rate(self.hits, self.misses),
+            "evictions": self.evictions,
+            "size": len(self._exhausted),
+        }
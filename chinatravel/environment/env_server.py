@@ -0,0 +1,246 @@
+"""
+Local environment server shared by several agent processes.
+
+Every `run_exp.py` worker used to build its own `WorldEnv` and read its own
+copy of the database. `EnvServer` owns one data catalog and answers WorldEnv
+calls over a Unix socket instead; each connection gets its own `WorldEnv`
+(its own Results and next_page state) on top of the shared tables.
+`RemoteWorldEnv` is the client and is used in place of a WorldEnv:
+
+    python chinatravel/environment/env_server.py --socket /tmp/chinatravel_env.sock
+    python run_exp.py ... --env_socket /tmp/chinatravel_env.sock
+
+so N workers hold one database, and a worker starts without reading it.
+
+Arguments and results are pickled, and every call is one round trip on top of
+the API itself: prefer fetch_all / goto_many / call for bulk work. A lambda
+can only be sent inside a command string. The socket is created readable by
+its owner only; the peers are trusted, as with any pickle channel.
+"""
+
+import os
+import sys
+import threading
+from multiprocessing.connection import Listener, Client
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+
+from pandas import DataFrame
+
+from chinatravel.environment.world_env import WorldEnv
+from chinatravel.environment.tools import get_catalog
+
+# WorldEnv methods a client may call
+REMOTE_METHODS = [
+    "__call__",
+    "call",
+    "fetch_all",
+    "goto_many",
+    "open_mask",
+    "open_window",
+    "next_page",
+    "reset",
+    "history_bytes",
+    "stats",
+]
+
+
+class RemoteEnvError(Exception):
+    pass
+
+
+class EnvServer:
+    def __init__(self, address, catalog=None, authkey: bytes = None):
+        self.address = address
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.authkey = authkey
+        self._listener = None
+        self._closed = threading.Event()
+
+    def serve_forever(self):
+        """
+        Accept clients until close(), each served by its own thread.
+        """
+        if os.path.exists(self.address):
+            # left over by a server that did not exit cleanly
+            os.remove(self.address)
+        umask = os.umask(0o177)
+        try:
+            self._listener = Listener(self.address, family="AF_UNIX", authkey=self.authkey)
+        finally:
+            os.umask(umask)
+        try:
+            while not self._closed.is_set():
+                try:
+                    conn = self._listener.accept()
+                except Exception:
+                    # failed handshake, or the listener was closed
+                    continue
+                threading.Thread(target=self._serve, args=(conn,), daemon=True).start()
+        finally:
+            self._listener.close()
+
+    def close(self):
+        self._closed.set()
+        try:
+            # wake up accept()
+            Client(self.address, family="AF_UNIX", authkey=self.authkey).close()
+        except Exception:
+            pass
+
+    def _serve(self, conn):
+        env = None
+        with conn:
+            while True:
+                try:
+                    method, args, kwargs = conn.recv()
+                except (EOFError, OSError):
+                    break
+                try:
+                    if method == "open":
+                        env = WorldEnv(catalog=self.catalog, **kwargs)
+                        reply = env.support_cities
+                    elif env is None:
+                        raise RuntimeError("no session, send 'open' first")
+                    elif method not in REMOTE_METHODS:
+                        raise AttributeError(f"WorldEnv.{method} is not served")
+                    else:
+                        reply = getattr(env, method)(*args, **kwargs)
+                    message = ("ok", reply)
+                except Exception as e:
+                    message = ("error", f"{type(e).__name__}: {e}")
+                try:
+                    self._send(conn, message)
+                except (EOFError, OSError):
+                    break
+
+    def _send(self, conn, message):
+        try:
+            conn.send(message)
+        except (EOFError, OSError):
+            raise
+        except Exception as e:
+            # the reply could not be pickled
+            conn.send(("error", f"{type(e).__name__}: {e}"))
+
+
+class RemoteWorldEnv:
+    """
+    Client of an EnvServer with the interface of WorldEnv. The keyword
+    arguments (history_size, release_paged, stats) configure the WorldEnv of the
+    session on the server.
+    """
+
+    def __init__(self, address, authkey: bytes = None, **env_kwargs):
+        self.address = address
+        self.authkey = authkey
+        self.env_kwargs = env_kwargs
+        self._conn = Client(address, family="AF_UNIX", authkey=authkey)
+        self._lock = threading.Lock()
+        self.support_cities = self._request("open", kwargs=env_kwargs)
+
+    def _request(self, method, args=(), kwargs=None):
+        with self._lock:
+            self._conn.send((method, args, kwargs if kwargs is not None else {}))
+            status, reply = self._conn.recv()
+        if status != "ok":
+            raise RemoteEnvError(reply)
+        return reply
+
+    def __call__(self, cmd_str: str):
+        return self._request("__call__", (cmd_str,))
+
+    def call(self, name: str, *args, **kwargs):
+        return self._request("call", (name,) + args, kwargs)
+
+    def fetch_all(self, cmd_str: str):
+        return self._request("fetch_all", (cmd_str,))
+
+    def iter_pages(self, cmd_str: str, chunk_size: int = 10):
+        data = self.fetch_all(cmd_str)["data"]
+        if not isinstance(data, DataFrame):
+            yield data
+            return
+        for i in range(0, len(data), chunk_size):
+            yield data.iloc[i : i + chunk_size]
+
+    def goto_many(self, city, start, ends, start_time, transport_type):
+        return self._request(
+            "goto_many", (city, start, ends, start_time, transport_type)
+        )
+
+    def open_mask(self, city, kind, time):
+        return self._request("open_mask", (city, kind, time))
+
+    def open_window(self, city, kind, ids):
+        return self._request("open_window", (city, kind, ids))
+
+    def next_page(self):
+        return self._request("next_page")
+
+    def reset(self):
+        return self._request("reset")
+
+    def history_bytes(self):
+        return self._request("history_bytes")
+
+    def stats(self, reset: bool = False):
+        return self._request("stats", (reset,))
+
+    def clone(self):
+        """
+        A new session with the same settings, e.g. for a forked process, which
+        must not share the connection of its parent.
+        """
+        return RemoteWorldEnv(self.address, self.authkey, **self.env_kwargs)
+
+    def close(self):
+        self._conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+if __name__ == "__main__":
+    import signal
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Serve WorldEnv over a Unix socket.")
+    parser.add_argument("--socket", type=str, default="/tmp/chinatravel_env.sock")
+    parser.add_argument(
+        "--preload_cities",
+        type=str,
+        nargs="*",
+        default=None,
+        help="Read the data of these cities at start (no names: all cities).",
+    )
+    parser.add_argument(
+        "--route_cache",
+        type=str,
+        default=None,
+        help="Json file of goto routes, loaded at start and saved at exit.",
+    )
+    args = parser.parse_args()
+
+    catalog = get_catalog()
+    if args.route_cache is not None:
+        catalog.transportation.route_cache.attach(args.route_cache)
+    if args.preload_cities is not None:
+        catalog.preload(args.preload_cities if len(args.preload_cities) > 0 else None)
+
+    server = EnvServer(args.socket, catalog)
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    print(f"serving WorldEnv on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
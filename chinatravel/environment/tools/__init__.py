@@ -4,6 +4,8 @@ from .restaurants.apis import Restaurants
 from .intercity_transport.apis import IntercityTransport
 from .transportation.apis import Transportation
 from .poi.apis import Poi
+from .catalog import DataCatalog, get_catalog
+from .predicates import eq, isin, in_range, contains, has_token
 
 __all__ = [
     "Attractions",
@@ -12,4 +14,11 @@ __all__ = [
     "IntercityTransport",
     "Transportation",
     "Poi",
+    "DataCatalog",
+    "get_catalog",
+    "eq",
+    "isin",
+    "in_range",
+    "contains",
+    "has_token",
 ]
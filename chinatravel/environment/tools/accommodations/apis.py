@@ -1,67 +1,58 @@
 import pandas as pd
 from pandas import DataFrame
 from typing import Callable
-from geopy.distance import geodesic
 import os
 
-import sys
-
-sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
-from poi.apis import Poi
+from chinatravel.environment.tools.poi.apis import Poi
+from chinatravel.environment.tools.snapshot import read_table
+from chinatravel.environment.tools.cities import (
+    CITY_LIST,
+    LazyData,
+    to_chinese,
+    to_english,
+)
+from chinatravel.environment.tools.spatial import SpatialIndexCache, nearby_rows
+from chinatravel.environment.tools.predicates import HashIndexCache, select_rows
 
 
 class Accommodations:
 
     def __init__(
-        self, base_path: str = "../../database/accommodations/", en_version=False
+        self,
+        base_path: str = "../../database/accommodations/",
+        en_version=False,
+        poi: Poi = None,
     ):
         curdir = os.path.dirname(os.path.realpath(__file__))
-        city_list = [
-            "beijing",
-            "shanghai",
-            "nanjing",
-            "suzhou",
-            "hangzhou",
-            "shenzhen",
-            "chengdu",
-            "wuhan",
-            "guangzhou",
-            "chongqing",
-        ]
-        data_path_list = [
-            os.path.join(curdir, f"{base_path}/{city}/accommodations.csv")
-            for city in city_list
-        ]
-        self.data = {}
-        for i, city in enumerate(city_list):
-            self.data[city] = pd.read_csv(data_path_list[i]).dropna()
-        self.key_type_tuple_list = {}
-        for city in city_list:
-            self.key_type_tuple_list[city] = []
-            for key in self.data[city].keys():
-                self.key_type_tuple_list[city].append(
-                    (key, type(self.data[city].iloc[0][key]))
-                )
-        city_cn_list = [
-            "北京",
-            "上海",
-            "南京",
-            "苏州",
-            "杭州",
-            "深圳",
-            "成都",
-            "武汉",
-            "广州",
-            "重庆",
-        ]
-
-        for i, city in enumerate(city_list):
-            self.data[city_cn_list[i]] = self.data.pop(city)
-            self.key_type_tuple_list[city_cn_list[i]] = self.key_type_tuple_list.pop(
-                city
-            )
-
-        self.poi = Poi(en_version=en_version)
+        self.base_path = os.path.join(curdir, base_path)
+        # per-city tables, read on first use
+        self.data = LazyData(self._load_table, CITY_LIST)
+        self.key_type_tuple_list = LazyData(self._load_keys, CITY_LIST)
+
+        self.poi = poi if poi is not None else Poi(en_version=en_version)
+        self.spatial_index = SpatialIndexCache()
+        self.hash_index = HashIndexCache()
+
+    def _load_table(self, city):
+        path = os.path.join(self.base_path, to_english(city), "accommodations.csv")
+        return read_table(path, pd.read_csv).dropna()
+
+    def _load_keys(self, city):
+        data = self.data[city]
+        return [(key, type(data.iloc[0][key])) for key in data.keys()]
+
+    def preload(self, cities=None):
+        self.data.preload(None if cities is None else [to_chinese(x) for x in cities])
+
+    def evict(self, city=None):
+        """
+        Drop the tables of `city` (of every city if None) and their indexes.
+        """
+        city = None if city is None else to_chinese(city)
+        for table in [self.data, self.key_type_tuple_list]:
+            table.evict(city)
+        for cache in [self.spatial_index, self.hash_index]:
+            cache.discard(city)
 
     def keys(self, city):
         return self.key_type_tuple_list[city]
@@ -69,26 +60,18 @@ class Accommodations:
     def select(self, city, key, func: Callable) -> DataFrame:
         if key not in self.data[city].keys():
             return "Key not found."
-        bool_list = [func(x) for x in self.data[city][key]]
-        return self.data[city][bool_list]
+        return select_rows(self.data[city], city, key, func, self.hash_index)
 
     def nearby(self, city, point: str, topk: int = None, dist: float = 5) -> DataFrame:
         lat_lon = self.poi.search(city, point)
         if isinstance(lat_lon, str):
             return lat_lon
         lat, lon = lat_lon
-        distance = [
-            geodesic((lat, lon), (x, y)).km
-            for x, y in zip(self.data[city]["lat"], self.data[city]["lon"])
-        ]
-        tmp = self.data[city].copy()
-        tmp["distance"] = distance
-        if dist is not None:
-            tmp = tmp[tmp["distance"] < dist]
-        tmp = tmp.sort_values(by=["distance"])
-        if topk is not None:
-            return tmp.head(topk)
-        return tmp
+        index = self.spatial_index.get(city, self.data[city])
+        # accommodations keep the rows strictly closer than `dist`
+        return nearby_rows(
+            self.data[city], index, lat, lon, topk=topk, dist=dist, strict=True
+        )
 
 
 if __name__ == "__main__":
@@ -0,0 +1,156 @@
+"""
+Per-API call counters and latency histograms.
+
+Opt-in instrumentation of the environment: with `WorldEnv(stats=True)` every
+API called through the environment is timed, and `env.stats()` reports
+
+    {
+        "apis": {
+            "goto": {"calls": 1520, "errors": 0, "total_sec": 0.41,
+                     "mean_us": 270.1, "p50_us": 256.0, "p90_us": 430.5,
+                     "p99_us": 861.1, "max_us": 1302.7,
+                     "histogram_us": {"215.3": 301, "256.0": 611, ...}},
+            ...
+        },
+        "caches": {"route": {"hits": 1400, "misses": 120, "hit_rate": 0.92}, ...},
+    }
+
+The latencies go into log-spaced buckets, four per factor of two, so the
+memory per API is fixed and a percentile is the upper bound of its bucket
+(at most 19% above the exact value). `histogram_us` maps the upper bound of
+every non-empty bucket to its count.
+"""
+
+import math
+import time
+import functools
+import threading
+
+BUCKETS_PER_OCTAVE = 4
+# the last bucket starts at 2 ** 31 us, about 36 minutes
+N_BUCKETS = 32 * BUCKETS_PER_OCTAVE
+
+
+def _bucket(seconds) -> int:
+    us = seconds * 1e6
+    if us <= 1:
+        return 0
+    return min(int(math.log2(us) * BUCKETS_PER_OCTAVE) + 1, N_BUCKETS - 1)
+
+
+def _upper_us(bucket) -> float:
+    return 2 ** (bucket / BUCKETS_PER_OCTAVE)
+
+
+def hit_rate(hits, misses) -> float:
+    total = hits + misses
+    return hits / total if total > 0 else 0.0
+
+
+class LatencyHistogram:
+    def __init__(self):
+        self.calls = 0
+        self.errors = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.counts = [0] * N_BUCKETS
+
+    def add(self, seconds, error=False):
+        self.calls += 1
+        self.errors += int(error)
+        self.total += seconds
+        self.max = max(self.max, seconds)
+        self.counts[_bucket(seconds)] += 1
+
+    def percentile(self, q) -> float:
+        """
+        Latency in us below which a fraction `q` of the calls fall.
+        """
+        if self.calls == 0:
+            return 0.0
+        rank = q * self.calls
+        seen = 0
+        for bucket, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return min(_upper_us(bucket), self.max * 1e6)
+        return self.max * 1e6
+
+    def summary(self) -> dict:
+        return {
+            "calls": self.calls,
+            "errors": self.errors,
+            "total_sec": self.total,
+            "mean_us": self.total / self.calls * 1e6 if self.calls > 0 else 0.0,
+            "p50_us": self.percentile(0.5),
+            "p90_us": self.percentile(0.9),
+            "p99_us": self.percentile(0.99),
+            "max_us": self.max * 1e6,
+            "histogram_us": {
+                f"{_upper_us(bucket):.1f}": count
+                for bucket, count in enumerate(self.counts)
+                if count > 0
+            },
+        }
+
+
+class ApiStats:
+    """
+    Latency histograms per API name, plus the hits and misses of the given
+    caches (objects with `hits` and `misses` counters) since the last clear().
+    """
+
+    def __init__(self, caches: dict = None):
+        self.caches = caches if caches is not None else {}
+        self._lock = threading.Lock()
+        self._apis = {}
+        self._cache_base = {}
+        self.clear()
+
+    def record(self, name, seconds, error=False):
+        with self._lock:
+            if name not in self._apis:
+                self._apis[name] = LatencyHistogram()
+            self._apis[name].add(seconds, error)
+
+    def timed(self, name, func):
+        """
+        `func` recording the duration of every call under `name`; calls that
+        raise count as errors.
+        """
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                res = func(*args, **kwargs)
+            except Exception:
+                self.record(name, time.perf_counter() - start, error=True)
+                raise
+            self.record(name, time.perf_counter() - start)
+            return res
+
+        return wrapper
+
+    def summary(self) -> dict:
+        with self._lock:
+            apis = sorted(self._apis.items(), key=lambda x: -x[1].total)
+            summary = {"apis": {name: hist.summary() for name, hist in apis}}
+        caches = {}
+        for name, cache in self.caches.items():
+            base_hits, base_misses = self._cache_base[name]
+            hits, misses = cache.hits - base_hits, cache.misses - base_misses
+            caches[name] = {
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": hit_rate(hits, misses),
+            }
+        summary["caches"] = caches
+        return summary
+
+    def clear(self):
+        with self._lock:
+            self._apis = {}
+            self._cache_base = {
+                name: (cache.hits, cache.misses) for name, cache in self.caches.items()
+            }
@@ -0,0 +1,225 @@
+"""
+Process-wide data catalog.
+
+Every module that needs the sandbox data (WorldEnv, the symbolic verifiers,
+the evaluation scripts, the search agents) used to build its own tool
+instances, so one process parsed the database several times over. The catalog
+owns one instance of each tool per process, built on first access, and all
+tools share the same `Poi`. The tools read the data of a city on first use;
+`preload` reads a declared set of cities up front and `evict` drops a city.
+
+The instances are shared: treat their tables as read-only.
+
+Memory report:
+    python chinatravel/environment/tools/catalog.py --compare
+"""
+
+import os
+import sys
+import resource
+import threading
+import subprocess
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0,
+        os.path.dirname(
+            os.path.dirname(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            )
+        ),
+    )
+
+from chinatravel.environment.tools.poi.apis import Poi
+from chinatravel.environment.tools.attractions.apis import Attractions
+from chinatravel.environment.tools.accommodations.apis import Accommodations
+from chinatravel.environment.tools.restaurants.apis import Restaurants
+from chinatravel.environment.tools.intercity_transport.apis import IntercityTransport
+from chinatravel.environment.tools.transportation.apis import Transportation
+
+
+TOOL_NAMES = [
+    "poi",
+    "attractions",
+    "accommodations",
+    "restaurants",
+    "intercity_transport",
+    "transportation",
+]
+
+
+def rss_bytes():
+    """
+    Resident set size of the current process.
+    """
+    try:
+        with open("/proc/self/statm", "r") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        # ru_maxrss is the peak RSS, in KB on Linux
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class DataCatalog:
+    """
+    Owns one instance of each tool. Instances are built lazily and are safe
+    to request from several threads.
+    """
+
+    def __init__(self):
+        self._lock = threading.RLock()
+        self._instances = {}
+
+    def _get(self, name, factory):
+        with self._lock:
+            if name not in self._instances:
+                self._instances[name] = factory()
+            return self._instances[name]
+
+    @property
+    def poi(self) -> Poi:
+        return self._get("poi", Poi)
+
+    @property
+    def attractions(self) -> Attractions:
+        return self._get("attractions", lambda: Attractions(poi=self.poi))
+
+    @property
+    def accommodations(self) -> Accommodations:
+        return self._get("accommodations", lambda: Accommodations(poi=self.poi))
+
+    @property
+    def restaurants(self) -> Restaurants:
+        return self._get("restaurants", lambda: Restaurants(poi=self.poi))
+
+    @property
+    def intercity_transport(self) -> IntercityTransport:
+        return self._get("intercity_transport", IntercityTransport)
+
+    @property
+    def transportation(self) -> Transportation:
+        return self._get("transportation", lambda: Transportation(poi=self.poi))
+
+    def load_all(self):
+        for name in TOOL_NAMES:
+            getattr(self, name)
+        return self.preload()
+
+    def preload(self, cities=None):
+        """
+        Read the data of the given cities (Chinese or English names, all
+        cities if None) in every tool.
+        """
+        for name in TOOL_NAMES:
+            getattr(self, name).preload(cities)
+        return self
+
+    def evict(self, city=None):
+        """
+        Drop the data of `city` (of every city if None) from the tools built so far.
+        """
+        with self._lock:
+            instances = list(self._instances.values())
+        for instance in instances:
+            instance.evict(city)
+
+    def memory_report(self):
+        """
+        RSS of the process and the in-memory size of every loaded table.
+        """
+        tables = {}
+        with self._lock:
+            instances = dict(self._instances)
+        for name, instance in instances.items():
+            frames = []
+            if name == "intercity_transport":
+                if instance._airplane_df is not None:
+                    frames.append(instance._airplane_df)
+                frames.extend(instance.train_df_dict.loaded().values())
+            elif name in ["attractions", "accommodations", "restaurants"]:
+                frames.extend(instance.data.loaded().values())
+            tables[name] = int(
+                sum(df.memory_usage(index=True, deep=True).sum() for df in frames)
+            )
+        return {"rss_bytes": rss_bytes(), "tables": tables}
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog() -> DataCatalog:
+    """
+    The catalog shared by the whole process.
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DataCatalog()
+    return _catalog
+
+
+def _load_separately():
+    """
+    Build the tools the way every module did before the catalog:
+    one WorldEnv plus the module-level copies of the verifiers.
+    """
+    instances = [
+        Attractions(),
+        Accommodations(),
+        Restaurants(),
+        IntercityTransport(),
+        Transportation(),
+        Poi(),
+    ]
+    # symbol_verification/commonsense_constraint.py
+    instances += [
+        Accommodations(),
+        Restaurants(),
+        Attractions(),
+        IntercityTransport(),
+        Transportation(),
+    ]
+    # symbol_verification/preference.py, symbol_verification/hard_constraint.py
+    for _ in range(2):
+        instances += [Accommodations(), Restaurants(), Attractions()]
+    for instance in instances:
+        instance.preload()
+    return instances
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Memory report of the data catalog.")
+    parser.add_argument(
+        "--mode", type=str, default="catalog", choices=["catalog", "separate"]
+    )
+    parser.add_argument(
+        "--compare",
+        action="store_true",
+        help="Run both modes in fresh processes and report the RSS saved.",
+    )
+    args = parser.parse_args()
+
+    if args.compare:
+        rss = {}
+        for mode in ["separate", "catalog"]:
+            out = subprocess.run(
+                [sys.executable, os.path.abspath(__file__), "--mode", mode],
+                capture_output=True,
+                text=True,
+                check=True,
+            ).stdout
+            rss[mode] = int(out.strip().splitlines()[-1])
+            print(f"{mode}: {rss[mode] / 2**20:.1f} MB")
+        print(f"saved: {(rss['separate'] - rss['catalog']) / 2**20:.1f} MB")
+    else:
+        base_rss = rss_bytes()
+        if args.mode == "catalog":
+            catalog = get_catalog().load_all()
+            for name, size in catalog.memory_report()["tables"].items():
+                print(f"{name}: {size / 2**20:.1f} MB")
+        else:
+            instances = _load_separately()
+        print(rss_bytes() - base_rss)
@@ -0,0 +1,151 @@
+"""
+Supported cities and lazily loaded per-city data.
+
+The cities are listed once, in the manifest `cities.json` next to this file,
+as {"name": Chinese name, "en": English name}. The English name is the
+directory of the city in the database.
+
+The tools keep their per-city tables in `LazyData` mappings instead of reading
+every city at construction: a table is read on first access, can be preloaded
+for a declared set of cities and evicted again, e.g.
+
+    get_catalog().preload(["上海", "北京"])
+    get_catalog().evict("上海")
+"""
+
+import os
+import json
+import threading
+from collections.abc import Mapping
+
+MANIFEST_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "cities.json")
+
+
+def load_manifest(path: str = MANIFEST_PATH):
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)["cities"]
+
+
+_manifest = load_manifest()
+CITY_LIST = [city["name"] for city in _manifest]
+CITY_LIST_EN = [city["en"] for city in _manifest]
+
+
+def to_chinese(city):
+    """
+    Chinese name of a city given by its Chinese or English name.
+    """
+    if city in CITY_LIST_EN:
+        return CITY_LIST[CITY_LIST_EN.index(city)]
+    return city
+
+
+def to_english(city):
+    """
+    English name of a city given by its Chinese or English name.
+    """
+    if city in CITY_LIST:
+        return CITY_LIST_EN[CITY_LIST.index(city)]
+    return city
+
+
+class LazyData(Mapping):
+    """
+    key -> value built by `loader(key)` on first access, for a fixed set of
+    keys. Safe to use from several threads: a key is loaded once even if it
+    is requested concurrently, and loading one key does not block the others.
+
+    Iterating values() or items() loads every key; loaded() only returns
+    those already in memory.
+    """
+
+    def __init__(self, loader, keys):
+        self._loader = loader
+        self._keys = list(keys)
+        self._locks = {key: threading.Lock() for key in self._keys}
+        self._values = {}
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            pass
+        with self._locks[key]:
+            if key not in self._values:
+                self._values[key] = self._loader(key)
+            return self._values[key]
+
+    def __setitem__(self, key, value):
+        with self._locks[key]:
+            self._values[key] = value
+
+    def __contains__(self, key):
+        try:
+            return key in self._locks
+        except TypeError:
+            return False
+
+    def __iter__(self):
+        return iter(self._keys)
+
+    def __len__(self):
+        return len(self._keys)
+
+    def loaded(self) -> dict:
+        """
+        The values already loaded, without loading the others.
+        """
+        return dict(self._values)
+
+    def preload(self, keys=None):
+        for key in self._keys if keys is None else keys:
+            if key in self:
+                self[key]
+        return self
+
+    def evict(self, key=None):
+        """
+        Drop the value of `key` (of every key if None); it is loaded again on
+        next access.
+        """
+        for k in self._keys if key is None else [key]:
+            if k in self:
+                with self._locks[k]:
+                    self._values.pop(k, None)
+
+    def field(self, name):
+        """
+        Mapping of key -> value[name], loading through this mapping.
+        """
+        return LazyField(self, name)
+
+
+class LazyField(Mapping):
+    def __init__(self, data: LazyData, name):
+        self._data = data
+        self._name = name
+
+    def __getitem__(self, key):
+        return self._data[key][self._name]
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __iter__(self):
+        return iter(self._data)
+
+    def __len__(self):
+        return len(self._data)
+
+
+def discard_city(cache: dict, city):
+    """
+    Remove the entries of `city` from a cache keyed by city or by tuples
+    starting with the city; all entries if city is None.
+    """
+    if city is None:
+        cache.clear()
+        return
+    for key in list(cache):
+        if key == city or (isinstance(key, tuple) and len(key) > 0 and key[0] == city):
+            del cache[key]
@@ -1,58 +1,183 @@
 import os
+import threading
+
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 
+from chinatravel.environment.tools.snapshot import read_table, read_airplane, read_train
+from chinatravel.environment.tools.cities import (
+    CITY_LIST,
+    CITY_LIST_EN,
+    LazyData,
+    to_chinese,
+)
+
 
 def time2float(time_str):
     h, m = time_str.split(":")
     return int(h) + int(m) / 60
 
 
+def time2minute(time_str):
+    h, m = time_str.split(":")
+    return int(h) * 60 + int(m)
+
+
+class Timetable:
+    """
+    The trains or flights between two cities, sorted by departure as `select`
+    returns them, with departure / arrival minutes and prices as arrays.
+    """
+
+    def __init__(self, data: DataFrame):
+        self.data = data
+        self.begin = np.array(
+            [time2minute(x) for x in data["BeginTime"]], dtype=np.int64
+        )
+        # arrival in minutes after midnight of the departure day
+        self.arrival = None
+        if "EndTime" in data:
+            end = np.array([time2minute(x) for x in data["EndTime"]], dtype=np.int64)
+            if "Duration" in data:
+                duration = data["Duration"].to_numpy(dtype=np.float64)
+                days = np.round((self.begin + duration * 60 - end) / 1440)
+                self.arrival = end + 1440 * days.astype(np.int64)
+            else:
+                self.arrival = np.where(end < self.begin, end + 1440, end)
+        self.cost = (
+            data["Cost"].to_numpy(dtype=np.float64) if "Cost" in data else None
+        )
+        # "HH:MM" strings sort like their minutes unless some are not zero-padded
+        self.sorted = bool(np.all(self.begin[1:] >= self.begin[:-1]))
+
+    def filter(self, earliest_leave_time=None, latest_arrival_time=None, max_price=None):
+        if latest_arrival_time is None and max_price is None:
+            if earliest_leave_time is None:
+                return self.data.copy()
+            earliest = time2minute(earliest_leave_time)
+            if self.sorted:
+                lo = np.searchsorted(self.begin, earliest, side="left")
+                return self.data.iloc[lo:].copy()
+        mask = np.ones(len(self.data), dtype=bool)
+        if earliest_leave_time is not None:
+            mask &= self.begin >= time2minute(earliest_leave_time)
+        if latest_arrival_time is not None:
+            if self.arrival is None:
+                raise ValueError("latest_arrival_time needs an EndTime column")
+            latest = (
+                time2minute(latest_arrival_time)
+                if isinstance(latest_arrival_time, str)
+                else latest_arrival_time
+            )
+            mask &= self.arrival <= latest
+        if max_price is not None:
+            if self.cost is None:
+                raise ValueError("max_price needs a Cost column")
+            mask &= self.cost <= max_price
+        return self.data[mask]
+
+
 class IntercityTransport:
     def __init__(self, path: str = "../../database/intercity_transport/"):
         curdir = os.path.dirname(os.path.realpath(__file__))
         self.base_path = os.path.join(curdir, path)
         self.airplane_path = self.base_path + "airplane.jsonl"
-        self.airplane_df = pd.read_json(
-            self.airplane_path, lines=True, keep_default_dates=False
+        self._airplane_df = None
+        self._airplane_lock = threading.Lock()
+        # trains per (start_city, end_city) and airport masks per city, read on first use
+        pairs = [(a, b) for a in CITY_LIST for b in CITY_LIST if a != b]
+        self.train_df_dict = LazyData(self._load_trains, pairs)
+        self._airport_masks = LazyData(self._airport_mask, CITY_LIST)
+
+        # sorted timetables per (start_city, end_city, intercity_type)
+        self._lock = threading.Lock()
+        self._timetables = {}
+
+    @property
+    def airplane_df(self) -> DataFrame:
+        with self._airplane_lock:
+            if self._airplane_df is None:
+                self._airplane_df = read_table(self.airplane_path, read_airplane)
+            return self._airplane_df
+
+    def _load_trains(self, pair):
+        train_path = (
+            self.base_path + "train/" + "from_{}_to_{}.json".format(pair[0], pair[1])
         )
-        city_list = [
-            "上海",
-            "北京",
-            "深圳",
-            "广州",
-            "重庆",
-            "苏州",
-            "成都",
-            "杭州",
-            "武汉",
-            "南京",
-        ]
-        self.train_df_dict = {}
-
-        for start_city in city_list:
-            for end_city in city_list:
-                if start_city == end_city:
-                    continue
-                train_path = (
-                    self.base_path
-                    + "train/"
-                    + "from_{}_to_{}.json".format(start_city, end_city)
-                )
-                train_df = pd.read_json(train_path)
-                self.train_df_dict[(start_city, end_city)] = train_df
+        return read_table(train_path, read_train)
+
+    def _airport_mask(self, city):
+        # the masks of _select, computed once per city instead of per pair
+        return (
+            self.airplane_df["From"].str.contains(city),
+            self.airplane_df["To"].str.contains(city),
+        )
+
+    def preload(self, cities=None):
+        """
+        Read the trains between the given cities (all if None) and the flights,
+        and sort their timetables.
+        """
+        cities = CITY_LIST if cities is None else [to_chinese(x) for x in cities]
+        for start_city in cities:
+            for end_city in cities:
+                if start_city != end_city and (start_city, end_city) in self.train_df_dict:
+                    self._timetable(start_city, end_city, "train")
+                    self._timetable(start_city, end_city, "airplane")
+
+    def evict(self, city=None):
+        """
+        Drop the trains and timetables from or to `city` (all, and the flights,
+        if None).
+        """
+        city = None if city is None else to_chinese(city)
+        for pair in self.train_df_dict:
+            if city is None or city in pair:
+                self.train_df_dict.evict(pair)
+        self._airport_masks.evict(city)
+        with self._lock:
+            for key in list(self._timetables):
+                if city is None or city in key[:2]:
+                    del self._timetables[key]
+        if city is None:
+            with self._airplane_lock:
+                self._airplane_df = None
 
     def select(
-        self, start_city, end_city, intercity_type, earliest_leave_time="00:00"
+        self,
+        start_city,
+        end_city,
+        intercity_type,
+        earliest_leave_time="00:00",
+        latest_arrival_time=None,
+        max_price=None,
     ) -> DataFrame:
+        """
+        Trains or flights sorted by departure time, leaving at or after
+        `earliest_leave_time`. Optionally only those arriving by
+        `latest_arrival_time` ("HH:MM" on the departure day, or minutes after
+        its midnight for later days) and costing at most `max_price`.
+        """
         if intercity_type not in ["train", "airplane"]:
             return "only support intercity_type in ['train','airplane']"
+        timetable = self._timetable(start_city, end_city, intercity_type)
+        if timetable is None:
+            raise TypeError(
+                "No {} data from {} to {}.".format(intercity_type, start_city, end_city)
+            )
+        return timetable.filter(earliest_leave_time, latest_arrival_time, max_price)
+
+    def _timetable(self, start_city, end_city, intercity_type) -> Timetable:
+        key = (start_city, end_city, intercity_type)
+        with self._lock:
+            if key in self._timetables:
+                return self._timetables[key]
         res = self._select(start_city, end_city, intercity_type)
-        bool_list = [False] * len(res)
-        for i in range(len(res)):
-            if time2float(res.loc[i, "BeginTime"]) >= time2float(earliest_leave_time):
-                bool_list[i] = True
-        return res[bool_list]
+        timetable = None if res is None else Timetable(res)
+        with self._lock:
+            self._timetables[key] = timetable
+        return timetable
 
     def _select(self, start_city, end_city, intercity_type) -> DataFrame:
         # intercity_type=='train' | 'airplane'
@@ -61,10 +186,13 @@ class IntercityTransport:
             if len(self.airplane_df) == 0:
                 return None
 
-            filtered_flights = self.airplane_df[
-                (self.airplane_df["From"].str.contains(start_city))
-                & (self.airplane_df["To"].str.contains(end_city))
-            ]
+            if start_city in self._airport_masks and end_city in self._airport_masks:
+                from_mask = self._airport_masks[start_city][0]
+                to_mask = self._airport_masks[end_city][1]
+            else:
+                from_mask = self.airplane_df["From"].str.contains(start_city)
+                to_mask = self.airplane_df["To"].str.contains(end_city)
+            filtered_flights = self.airplane_df[from_mask & to_mask]
             sorted_flights = filtered_flights.sort_values(by="BeginTime").reset_index(
                 drop=True
             )
@@ -83,30 +211,8 @@ class IntercityTransport:
 
 if __name__ == "__main__":
     a = IntercityTransport()
-    city_list = [
-        "上海",
-        "北京",
-        "深圳",
-        "广州",
-        "重庆",
-        "苏州",
-        "成都",
-        "杭州",
-        "武汉",
-        "南京",
-    ]
-    city_en_list = [
-        "shanghai",
-        "beijing",
-        "shenzhen",
-        "guangzhou",
-        "chongqing",
-        "suzhou",
-        "chengdu",
-        "hangzhou",
-        "wuhan",
-        "nanjing",
-    ]
+    city_list = CITY_LIST
+    city_en_list = CITY_LIST_EN
     str_list = []
     for i in range(len(city_list)):
         for j in range(i + 1, len(city_list)):
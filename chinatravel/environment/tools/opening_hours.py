@@ -0,0 +1,111 @@
+"""
+Opening hours of the attraction and restaurant tables as minute intervals.
+
+The "HH:MM" `opentime` / `endtime` strings are parsed once per table into
+integer minutes since midnight. A row is open at minute t if
+
+    open <= t <= end                 when open < end
+    open <= t or t <= end            otherwise (overnight, or open == end)
+
+and never if either bound is "不营业" (closed). This is the rule `id_is_open`
+applies to a single row, evaluated for the whole table at once.
+"""
+
+import threading
+
+import numpy as np
+from pandas import DataFrame
+
+from chinatravel.environment.tools.cities import discard_city
+
+
+CLOSED = "不营业"
+
+
+def parse_minute(time) -> int:
+    """
+    Minutes since midnight of an "HH:MM" string, -1 if the place is closed.
+    """
+    if not isinstance(time, str) or time == CLOSED:
+        return -1
+    parts = time.split(":")
+    return int(float(parts[0]) * 60 + float(parts[1]))
+
+
+def as_minute(time):
+    """
+    Minutes since midnight of an "HH:MM" string; numbers are taken as minutes.
+    """
+    if isinstance(time, str):
+        parts = time.split(":")
+        return float(parts[0]) * 60 + float(parts[1])
+    return time
+
+
+class OpeningHours:
+    def __init__(self, opentime, endtime):
+        self.open = np.array([parse_minute(x) for x in opentime], dtype=np.int32)
+        self.end = np.array([parse_minute(x) for x in endtime], dtype=np.int32)
+        self.closed = (self.open == -1) | (self.end == -1)
+        self.overnight = self.open >= self.end
+
+    def is_open(self, minute, positions=None) -> np.ndarray:
+        """
+        Mask of the rows (or of `positions`) open at `minute`.
+        """
+        open_, end = self.open, self.end
+        closed, overnight = self.closed, self.overnight
+        if positions is not None:
+            open_, end = open_[positions], end[positions]
+            closed, overnight = closed[positions], overnight[positions]
+        after_open = open_ <= minute
+        before_end = minute <= end
+        return ~closed & np.where(
+            overnight, after_open | before_end, after_open & before_end
+        )
+
+    def window(self, positions):
+        """
+        open / end minutes and closed flags of `positions`; -1 marks an
+        unknown row, which counts as closed.
+        """
+        positions = np.asarray(positions, dtype=np.int64)
+        known = positions >= 0
+        safe = np.where(known, positions, 0)
+        return {
+            "open": np.where(known, self.open[safe], -1),
+            "end": np.where(known, self.end[safe], -1),
+            "closed": np.where(known, self.closed[safe], True),
+        }
+
+
+class OpeningHoursCache:
+    """
+    Parses the hours of a table on first use and again if the table object
+    is replaced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._hours = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, data: DataFrame) -> OpeningHours:
+        with self._lock:
+            cached = self._hours.get(key)
+            if cached is not None and cached[0] is data:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        hours = OpeningHours(data["opentime"].tolist(), data["endtime"].tolist())
+        with self._lock:
+            self._hours[key] = (data, hours)
+        return hours
+
+    def discard(self, city=None):
+        """
+        Drop the hours of `city`, of every city if None.
+        """
+        with self._lock:
+            discard_city(self._hours, city)
@@ -1,54 +1,40 @@
 import os
 import json
 
+from chinatravel.environment.tools.snapshot import read_table, read_poi
+from chinatravel.environment.tools.cities import (
+    CITY_LIST,
+    CITY_LIST_EN,
+    LazyData,
+    to_chinese,
+    to_english,
+)
+
 
 class Poi:
     def __init__(self, base_path: str = "../../database/poi/", en_version=False):
-
-        city_list = [
-            "beijing",
-            "shanghai",
-            "nanjing",
-            "suzhou",
-            "hangzhou",
-            "shenzhen",
-            "chengdu",
-            "wuhan",
-            "guangzhou",
-            "chongqing",
-        ]
         curdir = os.path.dirname(os.path.realpath(__file__))
-        data_path_list = [
-            os.path.join(curdir, f"{base_path}/{city}/poi.json") for city in city_list
-        ]
-        self.data = {}
-        for i, city in enumerate(city_list):
-            self.data[city] = json.load(open(data_path_list[i], "r", encoding="utf-8"))
-            city_data = {}
-            for name_pos in self.data[city]:
-                name = name_pos["name"]
-                pos = name_pos["position"]
-                city_data[name] = tuple(pos)
-            self.data[city] = city_data
-            # self.data[city] = [
-            #     (x["name"], tuple(x["position"])) for x in self.data[city]
-            # ]
-        city_cn_list = [
-            "北京",
-            "上海",
-            "南京",
-            "苏州",
-            "杭州",
-            "深圳",
-            "成都",
-            "武汉",
-            "广州",
-            "重庆",
-        ]
-        for i, city in enumerate(city_list):
-            self.data[city_cn_list[i]] = self.data.pop(city)
-        self.city_cn_list = city_cn_list
-        self.city_list = city_list
+        self.base_path = os.path.join(curdir, base_path)
+        # {name: (lat, lon)} per city, read on first use
+        self.data = LazyData(self._load_points, CITY_LIST)
+        self.city_cn_list = list(CITY_LIST)
+        self.city_list = list(CITY_LIST_EN)
+
+    def _load_points(self, city):
+        path = os.path.join(self.base_path, to_english(city), "poi.json")
+        poi_df = read_table(path, read_poi)
+        return dict(
+            zip(
+                poi_df["name"].tolist(),
+                zip(poi_df["lat"].tolist(), poi_df["lon"].tolist()),
+            )
+        )
+
+    def preload(self, cities=None):
+        self.data.preload(None if cities is None else [to_chinese(x) for x in cities])
+
+    def evict(self, city=None):
+        self.data.evict(None if city is None else to_chinese(city))
 
     def search(self, city: str, name: str):
         if city in self.city_list:
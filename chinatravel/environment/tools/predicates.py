@@ -0,0 +1,253 @@
+"""
+Structured predicates for the `select` APIs of the tools.
+
+`select(city, key, func)` accepts any callable and applies it to every value of
+the column in Python. The predicates below can be passed as `func` instead:
+
+    attractions_select("南京", "name", eq("夫子庙"))
+    restaurants_select("上海", "price", in_range(50, 100))
+    accommodations_select("北京", "name", isin(["A", "B"]))
+    restaurants_select("上海", "name", contains("咖啡"))
+    restaurants_select("上海", "recommendedfood", has_token("烤鸭"))
+
+They select the same rows as the matching lambda, but are evaluated on the
+whole column at once. `eq` / `isin` on `name`, `id`, `cuisine` and `type` are
+answered from a hash index without scanning the table, and `contains` /
+`has_token` on `recommendedfood` from an inverted index of its dishes.
+Predicates are callables too, so they also work wherever a lambda is expected.
+"""
+
+import re
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame, Series
+
+from chinatravel.environment.tools.cities import discard_city
+
+
+# columns that get a hash index for eq / isin
+INDEXED_KEYS = ["name", "id", "cuisine", "type"]
+# columns holding separated lists, e.g. "烤鸭,炸酱面", that get a token index
+TOKEN_KEYS = ["recommendedfood"]
+
+_separators = re.compile(r"[,，、;；/|\[\]'\"\s]+")
+
+
+def tokenize(value) -> list:
+    """
+    The items of a separated list: the runs of text between separators.
+    """
+    if not isinstance(value, str):
+        return []
+    return [x for x in _separators.split(value) if x]
+
+
+class Predicate:
+    def __call__(self, x) -> bool:
+        raise NotImplementedError
+
+    def mask(self, column: Series) -> np.ndarray:
+        """Boolean mask over the column, same as calling the predicate per value."""
+        return np.array([bool(self(x)) for x in column], dtype=bool)
+
+
+class eq(Predicate):
+    """x == value"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, x):
+        return x == self.value
+
+    def mask(self, column):
+        return (column == self.value).to_numpy(dtype=bool)
+
+    def __repr__(self):
+        return f"eq({self.value!r})"
+
+
+class isin(Predicate):
+    """x in values"""
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def __call__(self, x):
+        return x in self.values
+
+    def mask(self, column):
+        return column.isin(self.values).to_numpy(dtype=bool)
+
+    def __repr__(self):
+        return f"isin({self.values!r})"
+
+
+class in_range(Predicate):
+    """low <= x <= high, a bound of None is open"""
+
+    def __init__(self, low=None, high=None):
+        self.low = low
+        self.high = high
+
+    def __call__(self, x):
+        if self.low is not None and not self.low <= x:
+            return False
+        if self.high is not None and not x <= self.high:
+            return False
+        return True
+
+    def mask(self, column):
+        mask = np.ones(len(column), dtype=bool)
+        if self.low is not None:
+            mask &= (column >= self.low).to_numpy(dtype=bool)
+        if self.high is not None:
+            mask &= (column <= self.high).to_numpy(dtype=bool)
+        return mask
+
+    def __repr__(self):
+        return f"in_range({self.low!r}, {self.high!r})"
+
+
+class contains(Predicate):
+    """value is a substring of x; values that are not strings never match"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, x):
+        return isinstance(x, str) and self.value in x
+
+    def mask(self, column):
+        if pd.api.types.is_string_dtype(column.dtype):
+            return (
+                column.str.contains(self.value, regex=False, na=False)
+                .astype(bool)
+                .to_numpy(dtype=bool)
+            )
+        return super().mask(column)
+
+    def __repr__(self):
+        return f"contains({self.value!r})"
+
+
+class has_token(Predicate):
+    """value is one of the items of the separated list x"""
+
+    def __init__(self, value):
+        self.value = value
+
+    def __call__(self, x):
+        return self.value in tokenize(x)
+
+    def __repr__(self):
+        return f"has_token({self.value!r})"
+
+
+class HashIndex:
+    """
+    value -> row positions of one column.
+    """
+
+    def __init__(self, values):
+        positions = {}
+        for i, x in enumerate(values):
+            positions.setdefault(x, []).append(i)
+        self.positions = {
+            x: np.array(p, dtype=np.int64) for x, p in positions.items()
+        }
+
+    def lookup(self, keys):
+        """
+        Row positions, in ascending order, whose value equals one of `keys`.
+        """
+        found = [self.positions[k] for k in keys if k in self.positions]
+        if len(found) == 0:
+            return np.zeros(0, dtype=np.int64)
+        if len(found) == 1:
+            return found[0]
+        return np.unique(np.concatenate(found))
+
+
+class TokenIndex(HashIndex):
+    """
+    item -> row positions of a column of separated lists.
+    """
+
+    def __init__(self, values):
+        positions = {}
+        for i, x in enumerate(values):
+            for token in set(tokenize(x)):
+                positions.setdefault(token, []).append(i)
+        self.positions = {
+            x: np.array(p, dtype=np.int64) for x, p in positions.items()
+        }
+
+    def containing(self, value):
+        """
+        Row positions whose text contains `value`, or None if the text has to
+        be scanned. A value without separators can only occur inside one item,
+        so the items are scanned instead of the rows.
+        """
+        if not isinstance(value, str) or value == "" or _separators.search(value):
+            return None
+        return self.lookup([x for x in self.positions if value in x])
+
+
+class HashIndexCache:
+    """
+    Builds the index of a table column on first use and rebuilds it if the
+    table object is replaced.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, data: DataFrame, column, index_type=HashIndex) -> HashIndex:
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and cached[0] is data:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        index = index_type(data[column].tolist())
+        with self._lock:
+            self._indexes[key] = (data, index)
+        return index
+
+    def discard(self, city=None):
+        """
+        Drop the indexes of `city`, of every city if None.
+        """
+        with self._lock:
+            discard_city(self._indexes, city)
+
+
+def select_rows(data: DataFrame, city, key, func, indexes: HashIndexCache) -> DataFrame:
+    """
+    Rows of `data` where `func` holds on column `key`, as `select` returns them.
+    """
+    if isinstance(func, Predicate):
+        if key in INDEXED_KEYS and isinstance(func, (eq, isin)):
+            keys = [func.value] if isinstance(func, eq) else func.values
+            try:
+                positions = indexes.get((city, key), data, key).lookup(keys)
+            except TypeError:
+                # unhashable value, compare row by row
+                return data[func.mask(data[key])]
+            return data.iloc[positions]
+        if key in TOKEN_KEYS and isinstance(func, (contains, has_token)):
+            index = indexes.get((city, key, "token"), data, key, TokenIndex)
+            if isinstance(func, has_token):
+                return data.iloc[index.lookup([func.value])]
+            positions = index.containing(func.value)
+            if positions is not None:
+                return data.iloc[positions]
+        return data[func.mask(data[key])]
+    bool_list = [func(x) for x in data[key]]
+    return data[bool_list]
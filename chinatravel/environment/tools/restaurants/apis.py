@@ -1,66 +1,65 @@
+import re
+import numpy as np
 import pandas as pd
 from pandas import DataFrame
 from typing import Callable
 import os
-from geopy.distance import geodesic
 
-import sys
-
-sys.path.append(os.path.join(os.path.dirname(__file__), ".."))
-from poi.apis import Poi
+from chinatravel.environment.tools.poi.apis import Poi
+from chinatravel.environment.tools.snapshot import read_table
+from chinatravel.environment.tools.cities import (
+    CITY_LIST,
+    LazyData,
+    to_chinese,
+    to_english,
+)
+from chinatravel.environment.tools.spatial import SpatialIndexCache, nearby_rows
+from chinatravel.environment.tools.predicates import (
+    HashIndexCache,
+    contains,
+    has_token,
+    select_rows,
+)
+from chinatravel.environment.tools.opening_hours import OpeningHoursCache, as_minute
 
 
 class Restaurants:
-    def __init__(self, base_path: str = "../../database/restaurants"):
-        city_list = [
-            "beijing",
-            "shanghai",
-            "nanjing",
-            "suzhou",
-            "hangzhou",
-            "shenzhen",
-            "chengdu",
-            "wuhan",
-            "guangzhou",
-            "chongqing",
-        ]
-        self.data = {}
+    def __init__(self, base_path: str = "../../database/restaurants", poi: Poi = None):
         curdir = os.path.dirname(os.path.realpath(__file__))
-        for city in city_list:
-            path = os.path.join(curdir, base_path, city, "restaurants_" + city + ".csv")
-            self.data[city] = pd.read_csv(path)
-
-        self.key_type_tuple_list_map = {}
-        for city in city_list:
-            self.key_type_tuple_list_map[city] = []
-            for key in self.data[city].keys():
-                self.key_type_tuple_list_map[city].append(
-                    (key, type(self.data[city][key][0]))
-                )
-        self.cuisine_list_map = {}
-        for city in city_list:
-            self.cuisine_list_map[city] = self.data[city]["cuisine"].unique()
-        city_cn_list = [
-            "北京",
-            "上海",
-            "南京",
-            "苏州",
-            "杭州",
-            "深圳",
-            "成都",
-            "武汉",
-            "广州",
-            "重庆",
-        ]
-
-        for i, city in enumerate(city_list):
-            self.data[city_cn_list[i]] = self.data.pop(city)
-            self.key_type_tuple_list_map[city_cn_list[i]] = (
-                self.key_type_tuple_list_map.pop(city)
-            )
-            self.cuisine_list_map[city_cn_list[i]] = self.cuisine_list_map.pop(city)
+        self.base_path = os.path.join(curdir, base_path)
+        # per-city tables, read on first use
+        self.data = LazyData(self._load_table, CITY_LIST)
+        self.key_type_tuple_list_map = LazyData(self._load_keys, CITY_LIST)
+        self.cuisine_list_map = LazyData(
+            lambda city: self.data[city]["cuisine"].unique(), CITY_LIST
+        )
+
+        self.poi = poi if poi is not None else Poi()
+        self.spatial_index = SpatialIndexCache()
+        self.hash_index = HashIndexCache()
+        self.opening_hours = OpeningHoursCache()
+
+    def _load_table(self, city):
+        city_en = to_english(city)
+        path = os.path.join(self.base_path, city_en, "restaurants_" + city_en + ".csv")
+        return read_table(path, pd.read_csv)
+
+    def _load_keys(self, city):
+        data = self.data[city]
+        return [(key, type(data[key][0])) for key in data.keys()]
+
+    def preload(self, cities=None):
+        self.data.preload(None if cities is None else [to_chinese(x) for x in cities])
 
-        self.poi = Poi()
+    def evict(self, city=None):
+        """
+        Drop the tables of `city` (of every city if None) and their indexes.
+        """
+        city = None if city is None else to_chinese(city)
+        for table in [self.data, self.key_type_tuple_list_map, self.cuisine_list_map]:
+            table.evict(city)
+        for cache in [self.spatial_index, self.hash_index, self.opening_hours]:
+            cache.discard(city)
 
     def keys(self, city: str):
         return self.key_type_tuple_list_map[city]
@@ -68,49 +67,64 @@ class Restaurants:
     def select(self, city: str, key, func: Callable) -> DataFrame:
         if key not in self.data[city].keys():
             return "Key not found."
-        bool_list = [func(x) for x in self.data[city][key]]
-        return self.data[city][bool_list]
+        return select_rows(self.data[city], city, key, func, self.hash_index)
 
     def id_is_open(self, city: str, id: int, time: str) -> bool:
-        match = self.data[city].loc[self.data[city]["id"] == id]
-        open_time = match["opentime"].values[0]
-        end_time = match["endtime"].values[0]
-        open_time = (
-            -1
-            if open_time == "不营业"
-            else float(open_time.split(":")[0]) + float(open_time.split(":")[1]) / 60
-        )
-        end_time = (
-            -1
-            if end_time == "不营业"
-            else float(end_time.split(":")[0]) + float(end_time.split(":")[1]) / 60
-        )
-        time = float(time.split(":")[0]) + float(time.split(":")[1]) / 60
-        if open_time == -1 or end_time == -1:
-            return False
-        if open_time < end_time:
-            return open_time <= time <= end_time
-        else:
-            return open_time <= time or time <= end_time
+        index = self.hash_index.get((city, "id"), self.data[city], "id")
+        # the first row with this id, as the boolean-mask lookup did
+        position = index.lookup([id])[:1]
+        if len(position) == 0:
+            raise IndexError(f"No row with id {id}.")
+        hours = self.opening_hours.get(city, self.data[city])
+        return bool(hours.is_open(as_minute(time), position)[0])
+
+    def open_mask(self, city: str, time) -> np.ndarray:
+        """
+        Mask over self.data[city] of the rows open at `time` ("HH:MM" or minutes).
+        """
+        hours = self.opening_hours.get(city, self.data[city])
+        return hours.is_open(as_minute(time))
+
+    def open_window(self, city: str, ids) -> dict:
+        """
+        Opening minutes of the rows with the given ids, see OpeningHours.window.
+        """
+        index = self.hash_index.get((city, "id"), self.data[city], "id")
+        positions = []
+        for id in ids:
+            found = index.lookup([id])
+            positions.append(found[0] if len(found) > 0 else -1)
+        return self.opening_hours.get(city, self.data[city]).window(positions)
 
     def nearby(self, city: str, point: str, topk: int = None, dist=2) -> DataFrame:
         lat_lon = self.poi.search(city, point)
         if isinstance(lat_lon, str):
             return lat_lon
         lat, lon = lat_lon
-        distance = [
-            geodesic((lat, lon), (x, y)).km
-            for x, y in zip(self.data[city]["lat"], self.data[city]["lon"])
-        ]
-        tmp = self.data[city].copy()
-        tmp["distance"] = distance
-        tmp = tmp.sort_values(by=["distance"])
-        if topk is None:
-            return tmp[tmp["distance"] <= dist]
-        return tmp[tmp["distance"] <= dist].head(topk)
-
-    def restaurants_with_recommended_food(self, city: str, food: str):
-        return self.data[city][self.data[city]["recommendedfood"].str.contains(food)]
+        index = self.spatial_index.get(city, self.data[city])
+        return nearby_rows(self.data[city], index, lat, lon, topk=topk, dist=dist)
+
+    def restaurants_with_recommended_food(
+        self, city: str, food: str, mode: str = "substring"
+    ):
+        """
+        Restaurants recommending `food`. mode "substring" matches `food`
+        anywhere in the recommended food, as str.contains does (a regular
+        expression is matched against the text); mode "token" only matches a
+        whole dish.
+        """
+        data = self.data[city]
+        if mode == "token":
+            return select_rows(
+                data, city, "recommendedfood", has_token(food), self.hash_index
+            )
+        if mode != "substring":
+            return "only support mode in ['substring', 'token']"
+        if isinstance(food, str) and re.escape(food) == food:
+            return select_rows(
+                data, city, "recommendedfood", contains(food), self.hash_index
+            )
+        return data[data["recommendedfood"].str.contains(food)]
 
     def get_cuisine_list(self, city: str):
         return self.cuisine_list_map[city]
@@ -0,0 +1,314 @@
+"""
+Columnar snapshot of the sandbox database.
+
+`build_snapshot` compiles the `database/` tree into one `.npy` file per column
+plus a `manifest.json`. `Snapshot` memory-maps those files back into
+DataFrames, so numeric columns are shared between processes through the page
+cache instead of being re-parsed from csv/json by every `WorldEnv()`.
+
+The tool classes read their sources through `read_table` / `read_json_file`,
+which use the default snapshot when it is up to date with the source file and
+fall back to parsing the raw file otherwise.
+
+Build the snapshot with:
+    python chinatravel/environment/tools/snapshot.py
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+import numpy as np
+import pandas as pd
+from pandas import DataFrame
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0,
+        os.path.dirname(
+            os.path.dirname(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            )
+        ),
+    )
+
+from chinatravel.environment.tools.cities import CITY_LIST, CITY_LIST_EN
+
+
+DATABASE_PATH = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.realpath(__file__))), "database"
+)
+SNAPSHOT_PATH = os.path.join(DATABASE_PATH, "snapshot")
+MANIFEST_NAME = "manifest.json"
+SNAPSHOT_VERSION = 1
+
+
+def read_airplane(path):
+    return pd.read_json(path, lines=True, keep_default_dates=False)
+
+
+def read_train(path):
+    return pd.read_json(path)
+
+
+def read_poi(path):
+    with open(path, "r", encoding="utf-8") as f:
+        records = json.load(f)
+    return DataFrame(
+        {
+            "name": [x["name"] for x in records],
+            "lat": [x["position"][0] for x in records],
+            "lon": [x["position"][1] for x in records],
+        }
+    )
+
+
+def database_sources():
+    """
+    Yield (relative path, reader) for every table the tools load.
+    A reader of None means the file is kept as a json document.
+    """
+    for city in CITY_LIST_EN:
+        yield f"attractions/{city}/attractions.csv", pd.read_csv
+        yield f"accommodations/{city}/accommodations.csv", pd.read_csv
+        yield f"restaurants/{city}/restaurants_{city}.csv", pd.read_csv
+        yield f"poi/{city}/poi.json", read_poi
+    yield "intercity_transport/airplane.jsonl", read_airplane
+    for start_city in CITY_LIST:
+        for end_city in CITY_LIST:
+            if start_city == end_city:
+                continue
+            yield "intercity_transport/train/from_{}_to_{}.json".format(
+                start_city, end_city
+            ), read_train
+    yield "transportation/subways.json", None
+
+
+def source_stamp(path):
+    stat = os.stat(path)
+    return {"size": stat.st_size, "mtime_ns": stat.st_mtime_ns}
+
+
+def _save_column(series, prefix):
+    """Save one column, returning its manifest entry."""
+    entry = {"name": series.name, "dtype": str(series.dtype)}
+    values = series.to_numpy()
+    if values.dtype.kind in "biuf":
+        entry["kind"] = "numeric"
+        np.save(prefix + ".npy", np.ascontiguousarray(values))
+        return entry
+    if values.dtype.kind == "M":
+        entry["kind"] = "datetime"
+        np.save(prefix + ".npy", values.astype("datetime64[ns]").view("int64"))
+        return entry
+
+    mask = pd.isna(series).to_numpy()
+    present = [x for x, missing in zip(values, mask) if not missing]
+    if all(isinstance(x, str) for x in present):
+        entry["kind"] = "str"
+        encoded = ["" if missing else x for x, missing in zip(values, mask)]
+    else:
+        entry["kind"] = "json"
+        encoded = [
+            "" if missing else json.dumps(x, ensure_ascii=False)
+            for x, missing in zip(values, mask)
+        ]
+    width = max([len(x) for x in encoded] + [1])
+    np.save(prefix + ".npy", np.array(encoded, dtype=f"U{width}"))
+    if mask.any():
+        np.save(prefix + ".mask.npy", mask)
+        entry["mask"] = True
+    return entry
+
+
+def build_snapshot(database_path=DATABASE_PATH, snapshot_path=None, verbose=True):
+    """
+    Compile the database tree into a columnar snapshot.
+    """
+    if snapshot_path is None:
+        snapshot_path = os.path.join(database_path, "snapshot")
+    os.makedirs(snapshot_path, exist_ok=True)
+
+    manifest = {"version": SNAPSHOT_VERSION, "tables": {}}
+    for table_idx, (rel_path, reader) in enumerate(database_sources()):
+        src_path = os.path.join(database_path, rel_path)
+        if not os.path.exists(src_path):
+            if verbose:
+                print(f"skip {rel_path}: not found")
+            continue
+        table_dir = f"t{table_idx:04d}"
+        os.makedirs(os.path.join(snapshot_path, table_dir), exist_ok=True)
+        entry = {"dir": table_dir, "source": source_stamp(src_path)}
+        if reader is None:
+            with open(src_path, "r", encoding="utf-8") as f:
+                doc = json.load(f)
+            with open(
+                os.path.join(snapshot_path, table_dir, "doc.json"), "w", encoding="utf-8"
+            ) as f:
+                json.dump(doc, f, ensure_ascii=False)
+            entry["kind"] = "json"
+        else:
+            df = reader(src_path)
+            if not df.index.equals(pd.RangeIndex(len(df))):
+                raise ValueError(f"{rel_path}: only a default RangeIndex is supported")
+            entry["kind"] = "table"
+            entry["rows"] = len(df)
+            entry["columns"] = [
+                _save_column(
+                    df[col], os.path.join(snapshot_path, table_dir, f"c{col_idx:03d}")
+                )
+                for col_idx, col in enumerate(df.columns)
+            ]
+        manifest["tables"][rel_path] = entry
+        if verbose:
+            print(f"{rel_path} -> {table_dir}")
+
+    with open(os.path.join(snapshot_path, MANIFEST_NAME), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    return manifest
+
+
+class Snapshot:
+    """
+    Read-only view of a snapshot directory.
+    Numeric columns are memory-mapped; string columns are materialized on load.
+    """
+
+    def __init__(self, snapshot_path=SNAPSHOT_PATH, database_path=DATABASE_PATH):
+        self.snapshot_path = snapshot_path
+        self.database_path = os.path.realpath(database_path)
+        with open(
+            os.path.join(snapshot_path, MANIFEST_NAME), "r", encoding="utf-8"
+        ) as f:
+            self.manifest = json.load(f)
+        if self.manifest.get("version") != SNAPSHOT_VERSION:
+            raise ValueError(
+                f"snapshot version {self.manifest.get('version')} is not supported"
+            )
+        self.tables = self.manifest["tables"]
+
+    def resolve(self, path):
+        """
+        Map a source file path to its manifest key, or None if the snapshot
+        does not hold an up-to-date copy of it.
+        """
+        rel_path = os.path.relpath(os.path.realpath(path), self.database_path)
+        rel_path = rel_path.replace(os.sep, "/")
+        if rel_path not in self.tables:
+            return None
+        # a snapshot may be shipped without the raw files
+        if os.path.exists(path):
+            if source_stamp(path) != self.tables[rel_path]["source"]:
+                return None
+        return rel_path
+
+    def table(self, rel_path) -> DataFrame:
+        entry = self.tables[rel_path]
+        table_dir = os.path.join(self.snapshot_path, entry["dir"])
+        columns = {}
+        for col_idx, col in enumerate(entry["columns"]):
+            prefix = os.path.join(table_dir, f"c{col_idx:03d}")
+            values = np.load(prefix + ".npy", mmap_mode="r").view(np.ndarray)
+            if col["kind"] == "numeric":
+                columns[col["name"]] = pd.Series(values, copy=False)
+                continue
+            if col["kind"] == "datetime":
+                columns[col["name"]] = pd.Series(
+                    values.view("datetime64[ns]")
+                ).astype(col["dtype"])
+                continue
+            decoded = values.astype(object)
+            if col["kind"] == "json":
+                for i, x in enumerate(decoded):
+                    decoded[i] = json.loads(x) if x else x
+            if col.get("mask"):
+                decoded[np.load(prefix + ".mask.npy")] = np.nan
+            columns[col["name"]] = pd.Series(decoded, dtype=col["dtype"])
+        if len(columns) == 0:
+            return DataFrame(index=pd.RangeIndex(entry["rows"]))
+        return DataFrame(columns, copy=False)
+
+    def json_file(self, rel_path):
+        entry = self.tables[rel_path]
+        with open(
+            os.path.join(self.snapshot_path, entry["dir"], "doc.json"),
+            "r",
+            encoding="utf-8",
+        ) as f:
+            return json.load(f)
+
+
+_default_snapshot = None
+_default_snapshot_loaded = False
+_default_snapshot_lock = threading.Lock()
+
+
+def default_snapshot():
+    """
+    The snapshot under `database/snapshot`, or None if it has not been built.
+    """
+    global _default_snapshot, _default_snapshot_loaded
+    with _default_snapshot_lock:
+        if not _default_snapshot_loaded:
+            if os.path.exists(os.path.join(SNAPSHOT_PATH, MANIFEST_NAME)):
+                _default_snapshot = Snapshot()
+            _default_snapshot_loaded = True
+    return _default_snapshot
+
+
+def read_table(path, reader) -> DataFrame:
+    """
+    Load a table from the default snapshot, or parse `path` with `reader`.
+    """
+    snapshot = default_snapshot()
+    if snapshot is not None:
+        rel_path = snapshot.resolve(path)
+        if rel_path is not None:
+            return snapshot.table(rel_path)
+    return reader(path)
+
+
+def read_json_file(path):
+    """
+    Load a json document from the default snapshot, or parse `path`.
+    """
+    snapshot = default_snapshot()
+    if snapshot is not None:
+        rel_path = snapshot.resolve(path)
+        if rel_path is not None:
+            return snapshot.json_file(rel_path)
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile the database into a memory-mapped snapshot."
+    )
+    parser.add_argument("--database", type=str, default=DATABASE_PATH)
+    parser.add_argument("--output", type=str, default=None)
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="Compare every snapshot table with the parsed source file.",
+    )
+    args = parser.parse_args()
+
+    if not args.check:
+        build_snapshot(args.database, args.output)
+    else:
+        snapshot = Snapshot(
+            args.output or os.path.join(args.database, "snapshot"), args.database
+        )
+        for rel_path, reader in database_sources():
+            src_path = os.path.join(args.database, rel_path)
+            if snapshot.resolve(src_path) is None:
+                print(f"{rel_path}: missing or stale")
+            elif reader is None:
+                with open(src_path, "r", encoding="utf-8") as f:
+                    assert snapshot.json_file(rel_path) == json.load(f)
+            else:
+                pd.testing.assert_frame_equal(snapshot.table(rel_path), reader(src_path))
+        print("snapshot check done")
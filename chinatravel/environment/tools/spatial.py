@@ -0,0 +1,136 @@
+"""
+Spatial index for the `nearby` queries of the tools.
+
+Points are sorted by latitude, so a radius query only looks at the latitude
+strip around the query point and then at the rows whose longitude falls in
+the bounding box. Every candidate is re-checked with `geodesic`, so the
+distances and the selected rows are the same as a full scan of the table.
+"""
+
+import math
+import threading
+
+import numpy as np
+from pandas import DataFrame
+from geopy.distance import geodesic
+
+from chinatravel.environment.tools.cities import discard_city
+
+
+# lower bounds of the length of one degree on the WGS-84 ellipsoid
+KM_PER_DEG_LAT = 110.574
+KM_PER_DEG_LON = 111.319
+# widen the bounding box; candidates are filtered exactly afterwards
+BOX_MARGIN = 1.05
+
+
+class SpatialIndex:
+    def __init__(self, lat, lon):
+        self.lat = np.asarray(lat, dtype=np.float64)
+        self.lon = np.asarray(lon, dtype=np.float64)
+        self.order = np.argsort(self.lat, kind="stable")
+        self.sorted_lat = self.lat[self.order]
+
+    def __len__(self):
+        return len(self.lat)
+
+    def candidates(self, lat, lon, radius):
+        """
+        Row positions inside the bounding box of a circle of `radius` km,
+        in ascending order.
+        """
+        dlat = radius / KM_PER_DEG_LAT * BOX_MARGIN
+        lo = np.searchsorted(self.sorted_lat, lat - dlat, side="left")
+        hi = np.searchsorted(self.sorted_lat, lat + dlat, side="right")
+        positions = self.order[lo:hi]
+        max_lat = min(max(abs(lat - dlat), abs(lat + dlat)), 89.0)
+        dlon = radius / (KM_PER_DEG_LON * math.cos(math.radians(max_lat))) * BOX_MARGIN
+        positions = positions[np.abs(self.lon[positions] - lon) <= dlon]
+        return np.sort(positions)
+
+    def distances(self, lat, lon, positions):
+        return np.array(
+            [
+                geodesic((lat, lon), (x, y)).km
+                for x, y in zip(self.lat[positions], self.lon[positions])
+            ],
+            dtype=np.float64,
+        )
+
+    def query_radius(self, lat, lon, radius, strict=False):
+        """
+        Rows within `radius` km (strictly closer if `strict`), as
+        (positions, distances) in row order.
+        """
+        positions = self.candidates(lat, lon, radius)
+        distances = self.distances(lat, lon, positions)
+        keep = distances < radius if strict else distances <= radius
+        return positions[keep], distances[keep]
+
+    def query_nearest(self, lat, lon, k=None):
+        """
+        A set of rows that contains the `k` nearest ones, as
+        (positions, distances) in row order. All rows if k is None.
+        """
+        if k is None or k <= 0 or k >= len(self):
+            positions = np.arange(len(self))
+            return positions, self.distances(lat, lon, positions)
+        radius = 1.0
+        while radius < 1e4:
+            positions, distances = self.query_radius(lat, lon, radius)
+            if len(positions) >= k:
+                return positions, distances
+            radius *= 2
+        positions = np.arange(len(self))
+        return positions, self.distances(lat, lon, positions)
+
+
+class SpatialIndexCache:
+    """
+    Builds the index of a table on first use and rebuilds it if the table
+    object is replaced (e.g. by a subclass that merges extra columns).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._indexes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, data: DataFrame) -> SpatialIndex:
+        with self._lock:
+            cached = self._indexes.get(key)
+            if cached is not None and cached[0] is data:
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+        index = SpatialIndex(data["lat"].to_numpy(), data["lon"].to_numpy())
+        with self._lock:
+            self._indexes[key] = (data, index)
+        return index
+
+    def discard(self, city=None):
+        """
+        Drop the indexes of `city`, of every city if None.
+        """
+        with self._lock:
+            discard_city(self._indexes, city)
+
+
+def nearby_rows(
+    data: DataFrame, index: SpatialIndex, lat, lon, topk=None, dist=2, strict=False
+) -> DataFrame:
+    """
+    Rows of `data` within `dist` km of (lat, lon) with a `distance` column,
+    sorted by distance and cut to `topk`. `dist=None` means no radius.
+    """
+    if dist is None:
+        positions, distances = index.query_nearest(lat, lon, topk)
+    else:
+        positions, distances = index.query_radius(lat, lon, dist, strict=strict)
+    tmp = data.iloc[positions].copy()
+    tmp["distance"] = distances
+    tmp = tmp.sort_values(by=["distance"], kind="stable")
+    if topk is not None:
+        return tmp.head(topk)
+    return tmp
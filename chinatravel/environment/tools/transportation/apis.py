@@ -1,16 +1,30 @@
 import os
 import json
 import heapq
+import threading
+import numpy as np
 from geopy.distance import geodesic
 
 from chinatravel.environment.tools.poi.apis import Poi
-
-
-def get_lines_and_stations(city, SUBWAY_PATH):
+from chinatravel.environment.tools.snapshot import read_json_file
+from chinatravel.environment.tools.transportation.distance_matrix import DistanceMatrix
+from chinatravel.environment.tools.transportation.stations import StationTable
+from chinatravel.environment.tools.transportation.routing import MetroRouting
+from chinatravel.environment.tools.transportation.route_cache import RouteCache
+from chinatravel.environment.tools.spatial import SpatialIndex
+from chinatravel.environment.tools.cities import (
+    CITY_LIST,
+    CITY_LIST_EN,
+    LazyData,
+    to_english,
+)
+
+
+def get_lines_and_stations(city, SUBWAY_PATH, subway_data=None):
     stations_all = []
     metro_lines = {}
-    with open(SUBWAY_PATH, "r", encoding="utf-8") as file:
-        subway_data = json.load(file)
+    if subway_data is None:
+        subway_data = read_json_file(SUBWAY_PATH)
     for line in subway_data[city]:
         metro_lines[line["name"]] = []
         for station in line["stations"]:
@@ -71,6 +85,30 @@ def add_time(time1, hours):
     return time_new
 
 
+def stamp_route(route, start_time):
+    """
+    Give the legs of a route their start and end times, chaining add_time
+    from `start_time` as goto does.
+    """
+    transports = []
+    time = start_time
+    for leg in route:
+        end_time = add_time(time, leg["hours"])
+        transports.append(
+            {
+                "start": leg["start"],
+                "end": leg["end"],
+                "mode": leg["mode"],
+                "start_time": time,
+                "end_time": end_time,
+                "cost": leg["cost"],
+                "distance": leg["distance"],
+            }
+        )
+        time = end_time
+    return transports
+
+
 def dijkstra(graph, start, end):
     queue = [(0, start, [])]
     seen = set()
@@ -137,77 +175,250 @@ def calculate_cost(distance):
 
 class Transportation:
     def __init__(
-        self, base_path: str = "../../database/transportation/", en_version=False
+        self,
+        base_path: str = "../../database/transportation/",
+        en_version=False,
+        poi: Poi = None,
+        distance_matrix: DistanceMatrix = None,
+        station_table: StationTable = None,
+        route_cache: RouteCache = None,
     ):
-        self.city_list = [
-            "shanghai",
-            "beijing",
-            "shenzhen",
-            "guangzhou",
-            "chongqing",
-            "suzhou",
-            "chengdu",
-            "hangzhou",
-            "wuhan",
-            "nanjing",
-        ]
-        self.city_list_chinese = [
-            "上海",
-            "北京",
-            "深圳",
-            "广州",
-            "重庆",
-            "苏州",
-            "成都",
-            "杭州",
-            "武汉",
-            "南京",
-        ]
+        self.city_list = list(CITY_LIST_EN)
+        self.city_list_chinese = list(CITY_LIST)
 
         curdir = os.path.dirname(os.path.realpath(__file__))
-        SUBWAY_PATH = os.path.join(curdir, base_path + "subways.json")
-        self.city_stations_dict = {}
-        self.city_lines_dict = {}
-        self.city_station_to_line = {}
-        for city in self.city_list:
-            stations_all, metro_lines, station_to_line = get_lines_and_stations(
-                city, SUBWAY_PATH
-            )
-            self.city_stations_dict[city] = stations_all
-            self.city_lines_dict[city] = metro_lines
-            self.city_station_to_line[city] = station_to_line
-
-        self.graphs = {}
-        for city in self.city_list:
-            self.graphs[city] = build_graph(self.city_lines_dict[city])
-
-        self.poi_search = Poi()
+        self.subway_path = os.path.join(curdir, base_path + "subways.json")
+        self._subway_data = None
+        self._subway_lock = threading.Lock()
+        # metro network per city, built on first use
+        self.metro = LazyData(self._load_metro, self.city_list)
+        self.city_stations_dict = self.metro.field("stations")
+        self.city_lines_dict = self.metro.field("lines")
+        self.city_station_to_line = self.metro.field("station_to_line")
+        self.graphs = self.metro.field("graph")
+        self.station_index = self.metro.field("station_index")
+        self.metro_routing = MetroRouting(self.city_lines_dict)
+        self.station_table = station_table if station_table is not None else StationTable()
+
+        self.poi_search = poi if poi is not None else Poi()
+        self.distance_matrix = (
+            distance_matrix if distance_matrix is not None else DistanceMatrix()
+        )
+        self.route_cache = route_cache if route_cache is not None else RouteCache()
+
+    def _load_metro(self, city):
+        with self._subway_lock:
+            if self._subway_data is None:
+                self._subway_data = read_json_file(self.subway_path)
+        stations_all, metro_lines, station_to_line = get_lines_and_stations(
+            city, self.subway_path, self._subway_data
+        )
+        return {
+            "stations": stations_all,
+            "lines": metro_lines,
+            "station_to_line": station_to_line,
+            "graph": build_graph(metro_lines),
+            "station_index": SpatialIndex(
+                [station["position"][0] for station in stations_all],
+                [station["position"][1] for station in stations_all],
+            ),
+        }
+
+    def preload(self, cities=None):
+        self.metro.preload(None if cities is None else [to_english(x) for x in cities])
+
+    def evict(self, city=None):
+        """
+        Drop the metro network and routing tables of `city`, of every city if None.
+        """
+        city = None if city is None else to_english(city)
+        self.metro.evict(city)
+        self.metro_routing.discard(city)
+
+    def poi_distance(self, city, start, end, location_start, location_end):
+        """
+        Distance in km between two named points. Read from the precomputed
+        matrix when both are known, otherwise computed with geodesic.
+        """
+        distance = self.distance_matrix.lookup(city, start, end)
+        if distance is None:
+            distance = geodesic(location_start, location_end).kilometers
+        return distance
+
+    def _nearest_station_idx(self, city, name, location):
+        found = self.station_table.nearest(city, name)
+        if found is not None:
+            return found
+        index = self.station_index[city]
+        if len(index) == 0:
+            return None, float("inf")
+        positions, distances = index.query_nearest(location[0], location[1], 1)
+        # ties go to the first station in the list, as in find_nearest_station
+        k = int(np.argmin(distances))
+        return int(positions[k]), float(distances[k])
+
+    def nearest_station(self, city, name, location):
+        """
+        Nearest metro station of a point and the distance to it in km, the
+        same result as find_nearest_station. Known POIs are read from the
+        precomputed table, other points go through the station index.
+        """
+        idx, distance = self._nearest_station_idx(city, name, location)
+        if idx is None:
+            return None, distance
+        return self.city_stations_dict[city][idx], distance
+
+    def metro_route(self, city, start, end):
+        """
+        Metro route between two stations, read from the routing tables:
+        {"path": [station names], "hops": stops, "line_changes": changes}.
+        The path is the one find_shortest_path returns, empty if there is none.
+        """
+        if city in self.city_list_chinese:
+            city = self.city_list[self.city_list_chinese.index(city)]
+        start, end = start.removesuffix("-地铁站"), end.removesuffix("-地铁站")
+        return self.metro_routing.get(city).route(start, end)
 
     def goto(self, city, start, end, start_time, transport_type, verbose=False):
         if transport_type not in ["walk", "metro", "taxi"]:
             return "only support transport_type in ['walk','metro','taxi']"
+        key = (city, start, end, transport_type)
+        route = None if verbose else self.route_cache.get(key)
+        if route is None:
+            route = self._route(city, start, end, transport_type, verbose)
+            self.route_cache.put(key, route)
+        if isinstance(route, str):
+            return route
+        return stamp_route(route, start_time)
+
+    def goto_many(self, city, start, ends, start_time, transport_type):
+        """
+        goto from one start to many ends in one pass. Returns a dict of arrays
+        aligned with `ends`:
+            distance, duration (hours), cost: totals over the legs of goto
+            end_time: arrival time strings, end_minute: arrival in minutes
+            valid: False where goto has no route or a point is unknown
+        walk and taxi are computed with NumPy over a row of the distance
+        matrix; metro goes through goto for every end.
+        """
+        if transport_type not in ["walk", "metro", "taxi"]:
+            raise ValueError("only support transport_type in ['walk','metro','taxi']")
+        ends = list(ends)
+        n = len(ends)
+        hour, minu = int(start_time.split(":")[0]), int(start_time.split(":")[1])
+        start_minute = hour * 60 + minu
+        distance = np.zeros(n, dtype=np.float64)
+        duration = np.zeros(n, dtype=np.float64)
+        cost = np.zeros(n, dtype=np.float64)
+        valid = np.ones(n, dtype=bool)
+
+        if transport_type == "metro":
+            end_minute = np.full(n, start_minute, dtype=np.int64)
+            end_time = [start_time] * n
+            known_start = isinstance(self.poi_search.search(city, start), tuple)
+            for i, end in enumerate(ends):
+                if not known_start or not isinstance(
+                    self.poi_search.search(city, end), tuple
+                ):
+                    valid[i] = False
+                    continue
+                route = self.goto(city, start, end, start_time, transport_type)
+                if not isinstance(route, list):
+                    valid[i] = False
+                    continue
+                distance[i] = sum(leg["distance"] for leg in route)
+                cost[i] = sum(leg["cost"] for leg in route)
+                end_time[i] = route[-1]["end_time"]
+                hour, minu = map(int, end_time[i].split(":"))
+                end_minute[i] = hour * 60 + minu
+                duration[i] = (end_minute[i] - start_minute) / 60
+            return {
+                "distance": distance,
+                "duration": duration,
+                "cost": cost,
+                "end_time": end_time,
+                "end_minute": end_minute,
+                "valid": valid,
+            }
+
+        location_start = self.poi_search.search(city, start)
+        city_en = city
+        if city in self.city_list_chinese:
+            city_en = self.city_list[self.city_list_chinese.index(city)]
+        if not isinstance(location_start, tuple):
+            valid[:] = False
+        else:
+            row = self.distance_matrix.row(city_en, start)
+            known = np.zeros(n, dtype=bool)
+            if row is not None:
+                ids = self.distance_matrix.poi_ids(city_en, ends)
+                known = ids >= 0
+                distance[known] = row[ids[known]]
+            for i in np.flatnonzero(~known):
+                location_end = self.poi_search.search(city, ends[i])
+                if isinstance(location_end, tuple):
+                    distance[i] = geodesic(location_start, location_end).kilometers
+                else:
+                    valid[i] = False
+
+        if transport_type == "walk":
+            duration = distance / 5.0
+        else:
+            duration = distance / 40.0
+            cost = np.where(
+                distance <= 1.8,
+                11.0,
+                np.where(
+                    distance <= 10,
+                    11.0 + (distance - 1.8) * 3.5,
+                    11.0 + (10 - 1.8) * 3.5 + (distance - 10) * 4.5,
+                ),
+            )
+            # round like goto does, np.round can differ in the last digit
+            cost = np.array([round(x, 2) for x in cost.tolist()], dtype=np.float64)
+            distance = np.array(
+                [round(x, 2) for x in distance.tolist()], dtype=np.float64
+            )
+        # add_time truncates the duration to whole minutes
+        end_minute = start_minute + (duration * 60).astype(np.int64)
+        end_time = [
+            "{:02d}:{:02d}".format(m // 60, m % 60) for m in end_minute.tolist()
+        ]
+        return {
+            "distance": distance,
+            "duration": duration,
+            "cost": cost,
+            "end_time": end_time,
+            "end_minute": end_minute,
+            "valid": valid,
+        }
+
+    def _route(self, city, start, end, transport_type, verbose=False):
+        """
+        Legs of a trip without their times: every leg has its duration in
+        hours instead, see stamp_route.
+        """
         locationA = start
         locationB = end
         coordinate_A = self.poi_search.search(city, locationA)
         coordinate_B = self.poi_search.search(city, locationB)
-        city_cn = city
         if city in self.city_list_chinese:
             city = self.city_list[self.city_list_chinese.index(city)]
         locationA_name, locationB_name = locationA, locationB
         locationA, locationB = coordinate_A, coordinate_B
         transports = []
         if transport_type == "walk":
-            distance = geodesic(locationA, locationB).kilometers
+            distance = self.poi_distance(
+                city, locationA_name, locationB_name, locationA, locationB
+            )
             walking_speed = 5.0
             time = distance / walking_speed
             cost = 0.0
-            end_time = add_time(start_time, time)
             transport = {
                 "start": locationA_name,
                 "end": locationB_name,
                 "mode": "walk",
-                "start_time": start_time,
-                "end_time": end_time,
+                "hours": time,
                 "cost": cost,
                 "distance": distance,
             }
@@ -221,17 +432,17 @@ class Transportation:
             return transports
 
         elif transport_type == "taxi":
-            distance = geodesic(locationA, locationB).kilometers
+            distance = self.poi_distance(
+                city, locationA_name, locationB_name, locationA, locationB
+            )
             taxi_speed = 40.0
             time = distance / taxi_speed
             cost = calculate_cost_taxi(distance)
-            end_time = add_time(start_time, time)
             transport = {
                 "start": locationA_name,
                 "end": locationB_name,
                 "mode": "taxi",
-                "start_time": start_time,
-                "end_time": end_time,
+                "hours": time,
                 "cost": round(cost, 2),
                 "distance": round(distance, 2),
             }
@@ -245,51 +456,39 @@ class Transportation:
             return transports
 
         elif transport_type == "metro":
-            graph = self.graphs[city]
-            stationA, distanceA = find_nearest_station(
-                locationA, self.city_stations_dict[city]
+            stations_all = self.city_stations_dict[city]
+            stationA_idx, distanceA = self._nearest_station_idx(
+                city, locationA_name, locationA
             )
-            stationB, distanceB = find_nearest_station(
-                locationB, self.city_stations_dict[city]
+            stationB_idx, distanceB = self._nearest_station_idx(
+                city, locationB_name, locationB
             )
+            stationA = None if stationA_idx is None else stations_all[stationA_idx]
+            stationB = None if stationB_idx is None else stations_all[stationB_idx]
             if stationA == stationB:
                 if verbose:
                     print("Too near. Walk.")
                 return "No solution"
-                return self.goto(
-                    city_cn,
-                    locationA_name,
-                    locationB_name,
-                    start_time,
-                    transport_type="walk",
-                    verbose=verbose,
-                )
-            shortest_path = find_shortest_path(
-                graph, stationA["name"], stationB["name"]
-            )
             if stationA and stationB:
-                distance_between_stations = geodesic(
-                    stationA["position"], stationB["position"]
-                ).kilometers
+                distance_between_stations = self.station_table.station_distance(
+                    city, stationA_idx, stationB_idx
+                )
+                if distance_between_stations is None:
+                    distance_between_stations = geodesic(
+                        stationA["position"], stationB["position"]
+                    ).kilometers
                 subway_speed = 30.0
                 time_between_stations = distance_between_stations / subway_speed
                 walking_speed = 5.0
                 timeA = distanceA / walking_speed
                 timeB = distanceB / walking_speed
-                total_time = timeA + time_between_stations + timeB
                 cost = calculate_cost(distance_between_stations)
-                distance = distanceA + distance_between_stations + distanceB
-                end_timeA = add_time(start_time, timeA)
-                end_timeB = add_time(end_timeA, time_between_stations)
-                end_time_final = add_time(end_timeB, timeB)
-                end_time = end_time_final
                 transports.append(
                     {
                         "start": locationA_name,
                         "end": stationA["name"] + "-地铁站",
                         "mode": "walk",
-                        "start_time": start_time,
-                        "end_time": end_timeA,
+                        "hours": timeA,
                         "cost": 0,
                         "distance": round(distanceA, 2),
                     }
@@ -299,8 +498,7 @@ class Transportation:
                         "start": stationA["name"] + "-地铁站",
                         "end": stationB["name"] + "-地铁站",
                         "mode": "metro",
-                        "start_time": end_timeA,
-                        "end_time": end_timeB,
+                        "hours": time_between_stations,
                         "cost": cost,
                         "distance": round(distance_between_stations, 2),
                     }
@@ -310,13 +508,15 @@ class Transportation:
                         "start": stationB["name"] + "-地铁站",
                         "end": locationB_name,
                         "mode": "walk",
-                        "start_time": end_timeB,
-                        "end_time": end_time,
+                        "hours": timeB,
                         "cost": 0,
                         "distance": round(distanceB, 2),
                     }
                 )
                 if verbose:
+                    shortest_path = self.metro_route(
+                        city, stationA["name"], stationB["name"]
+                    )["path"]
                     print(
                         "Walk: From starting point to metro {}, Distance: {}.".format(
                             stationA["name"] + "-地铁站", distanceA
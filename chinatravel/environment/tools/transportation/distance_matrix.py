@@ -0,0 +1,197 @@
+"""
+Precomputed POI-to-POI distance matrix.
+
+For every city, the points of `poi.json` (attractions, restaurants, hotels
+and stations) are interned in file order and the geodesic distance between
+every pair is stored in a memory-mapped float64 matrix:
+
+    database/precomputed/<city>/meta.json
+    database/precomputed/<city>/distances.npy
+
+`Transportation.goto` reads walk/taxi distances from it and falls back to a
+live geodesic for points that are not in the matrix. A city whose `poi.json`
+changed after the build is ignored until the matrix is rebuilt.
+
+Build and validate with:
+    python chinatravel/environment/tools/transportation/distance_matrix.py --build
+    python chinatravel/environment/tools/transportation/distance_matrix.py --validate
+"""
+
+import os
+import sys
+import json
+import random
+import argparse
+import threading
+
+import numpy as np
+from tqdm import tqdm
+from geopy.distance import geodesic
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0,
+        os.path.dirname(
+            os.path.dirname(
+                os.path.dirname(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                )
+            )
+        ),
+    )
+
+from chinatravel.environment.tools.snapshot import DATABASE_PATH, source_stamp
+
+PRECOMPUTED_PATH = os.path.join(DATABASE_PATH, "precomputed")
+
+
+def poi_source_path(city):
+    return os.path.join(DATABASE_PATH, "poi", city, "poi.json")
+
+
+class DistanceMatrix:
+    """
+    Read-only access to the precomputed matrices, loaded per city on first use.
+    Cities are keyed by their English name, as in the database directories.
+    """
+
+    def __init__(self, path: str = PRECOMPUTED_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._ids = {}
+        self._matrix = {}
+
+    def _load(self, city):
+        with self._lock:
+            if city in self._matrix:
+                return
+            ids, matrix = None, None
+            meta_path = os.path.join(self.path, city, "meta.json")
+            if os.path.exists(meta_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                src_path = poi_source_path(city)
+                if not os.path.exists(src_path) or source_stamp(src_path) == meta["source"]:
+                    ids = {name: i for i, name in enumerate(meta["names"])}
+                    matrix = np.load(
+                        os.path.join(self.path, city, "distances.npy"), mmap_mode="r"
+                    )
+            self._ids[city] = ids
+            self._matrix[city] = matrix
+
+    def available(self, city) -> bool:
+        self._load(city)
+        return self._matrix[city] is not None
+
+    def poi_ids(self, city, names):
+        """
+        Interned ids of `names`, -1 for unknown points.
+        """
+        self._load(city)
+        ids = self._ids[city] or {}
+        return np.array([ids.get(name, -1) for name in names], dtype=np.int64)
+
+    def lookup(self, city, start, end):
+        """
+        Distance in km between two named points, or None if either is unknown.
+        """
+        self._load(city)
+        ids = self._ids[city]
+        if ids is None:
+            return None
+        i, j = ids.get(start), ids.get(end)
+        if i is None or j is None:
+            return None
+        return float(self._matrix[city][i, j])
+
+    def row(self, city, start):
+        """
+        Distances from one named point to every interned point, or None.
+        """
+        self._load(city)
+        ids = self._ids[city]
+        if ids is None or start not in ids:
+            return None
+        return self._matrix[city][ids[start]]
+
+
+def build_distance_matrix(poi_data, city, path=PRECOMPUTED_PATH):
+    """
+    poi_data: {name: (lat, lon)} of one city, as loaded by `Poi`.
+    """
+    names = list(poi_data.keys())
+    positions = [poi_data[name] for name in names]
+    n = len(names)
+    city_path = os.path.join(path, city)
+    os.makedirs(city_path, exist_ok=True)
+
+    matrix = np.lib.format.open_memmap(
+        os.path.join(city_path, "distances.npy"),
+        mode="w+",
+        dtype=np.float64,
+        shape=(n, n),
+    )
+    for i in tqdm(range(n), desc=city):
+        matrix[i, i] = geodesic(positions[i], positions[i]).kilometers
+        for j in range(i + 1, n):
+            distance = geodesic(positions[i], positions[j]).kilometers
+            matrix[i, j] = distance
+            matrix[j, i] = distance
+    matrix.flush()
+    del matrix
+
+    with open(os.path.join(city_path, "meta.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {"source": source_stamp(poi_source_path(city)), "names": names},
+            f,
+            ensure_ascii=False,
+        )
+
+
+def validate_distance_matrix(poi_data, city, samples=10000, tol=1e-6, path=PRECOMPUTED_PATH):
+    """
+    Compare random entries of the matrix with a live geodesic.
+    Returns the number of entries whose absolute error exceeds `tol` km.
+    """
+    distance_matrix = DistanceMatrix(path)
+    if not distance_matrix.available(city):
+        print(f"{city}: no up-to-date matrix")
+        return -1
+    names = list(poi_data.keys())
+    bad = 0
+    max_err = 0.0
+    for _ in range(samples):
+        start, end = random.choice(names), random.choice(names)
+        expected = geodesic(poi_data[start], poi_data[end]).kilometers
+        err = abs(distance_matrix.lookup(city, start, end) - expected)
+        max_err = max(max_err, err)
+        if err > tol:
+            bad += 1
+    print(f"{city}: {samples} samples, max error {max_err:.3g} km, {bad} above {tol} km")
+    return bad
+
+
+if __name__ == "__main__":
+    from chinatravel.environment.tools.poi.apis import Poi
+
+    parser = argparse.ArgumentParser(description="POI distance matrices.")
+    parser.add_argument("--build", action="store_true")
+    parser.add_argument("--validate", action="store_true")
+    parser.add_argument(
+        "--cities", type=str, nargs="*", default=None, help="English city names"
+    )
+    parser.add_argument("--samples", type=int, default=10000)
+    parser.add_argument("--tol", type=float, default=1e-6, help="tolerance in km")
+    args = parser.parse_args()
+
+    poi = Poi()
+    cities = args.cities if args.cities else poi.city_list
+    bad = 0
+    for city in cities:
+        poi_data = poi.data[poi.city_cn_list[poi.city_list.index(city)]]
+        if args.build:
+            build_distance_matrix(poi_data, city)
+        if args.validate:
+            bad += max(validate_distance_matrix(poi_data, city, args.samples, args.tol), 0)
+    if bad > 0:
+        sys.exit(1)
@@ -0,0 +1,137 @@
+"""
+Route cache for `Transportation.goto`.
+
+The legs of a route only depend on the departure time through `add_time`, so
+the cache keeps the time-independent part of every leg (names, mode, cost,
+distance and duration in hours) under (city, start, end, mode) and the times
+are stamped again on every lookup.
+
+The cache is an LRU bounded by `maxsize` entries. It can be attached to a json
+file, which is loaded once and written back at exit, so that later runs of the
+agents and of the evaluation start with warm routes. A file written against
+other database files is ignored.
+"""
+
+import os
+import json
+import atexit
+import threading
+from collections import OrderedDict
+
+from chinatravel.environment.tools.snapshot import DATABASE_PATH, source_stamp
+
+CACHE_VERSION = 1
+
+
+def _database_stamp():
+    """
+    Stamps of the files a route depends on.
+    """
+    stamps = {}
+    paths = [os.path.join(DATABASE_PATH, "transportation", "subways.json")]
+    poi_path = os.path.join(DATABASE_PATH, "poi")
+    if os.path.isdir(poi_path):
+        for city in sorted(os.listdir(poi_path)):
+            paths.append(os.path.join(poi_path, city, "poi.json"))
+    for path in paths:
+        if os.path.exists(path):
+            stamps[os.path.relpath(path, DATABASE_PATH)] = source_stamp(path)
+    return stamps
+
+
+class RouteCache:
+    def __init__(self, maxsize=200000):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.path = None
+        self._lock = threading.Lock()
+        self._routes = OrderedDict()
+        self._attached = False
+
+    def __len__(self):
+        return len(self._routes)
+
+    def get(self, key):
+        """
+        The cached route of `key`, or None.
+        """
+        with self._lock:
+            route = self._routes.get(key)
+            if route is None:
+                self.misses += 1
+                return None
+            self._routes.move_to_end(key)
+            self.hits += 1
+            return route
+
+    def put(self, key, route):
+        with self._lock:
+            self._routes[key] = route
+            self._routes.move_to_end(key)
+            while len(self._routes) > self.maxsize:
+                self._routes.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._routes.clear()
+            self.hits = 0
+            self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._routes),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total > 0 else 0.0,
+            }
+
+    def load(self, path):
+        """
+        Add the routes stored in `path`. Returns the number of routes loaded.
+        """
+        with open(path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        if doc.get("version") != CACHE_VERSION or doc.get("database") != _database_stamp():
+            return 0
+        with self._lock:
+            for key, route in doc["routes"]:
+                key = tuple(key)
+                if key not in self._routes:
+                    self._routes[key] = route
+            while len(self._routes) > self.maxsize:
+                self._routes.popitem(last=False)
+        return len(doc["routes"])
+
+    def save(self, path=None):
+        path = path if path is not None else self.path
+        with self._lock:
+            routes = [[list(key), route] for key, route in self._routes.items()]
+        dirname = os.path.dirname(os.path.abspath(path))
+        os.makedirs(dirname, exist_ok=True)
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(
+                {
+                    "version": CACHE_VERSION,
+                    "database": _database_stamp(),
+                    "routes": routes,
+                },
+                f,
+                ensure_ascii=False,
+            )
+        os.replace(tmp_path, path)
+
+    def attach(self, path):
+        """
+        Load `path` if it exists and write the cache back to it at exit.
+        """
+        self.path = path
+        if os.path.exists(path):
+            self.load(path)
+        if not self._attached:
+            atexit.register(self.save)
+            self._attached = True
+        return self
@@ -0,0 +1,197 @@
+"""
+All-pairs metro routing tables.
+
+The metro graph of a city is static, so instead of running a search for every
+metro `goto`, one BFS per station fills three station-by-station tables:
+
+    hops[i, j]          number of stops from station i to station j (-1: unreachable)
+    predecessor[i, j]   station before j on the route from i (-1: none)
+    line_changes[i, j]  fewest line changes along that route
+
+A route is then read back in O(path length) from the predecessor row.
+
+The routes are the ones `dijkstra` returns: among the shortest paths it keeps
+the lexicographically smallest sequence of station names, so the BFS ranks
+each level by (rank of the predecessor, station name) and every station keeps
+its best-ranked predecessor.
+
+Check against dijkstra with:
+    python chinatravel/environment/tools/transportation/routing.py --validate
+"""
+
+import os
+import sys
+import argparse
+import threading
+
+import numpy as np
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0,
+        os.path.dirname(
+            os.path.dirname(
+                os.path.dirname(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                )
+            )
+        ),
+    )
+
+from chinatravel.environment.tools.cities import discard_city
+
+
+class MetroRoutes:
+    """
+    Routing tables of one city, built from its {line: [station names]}.
+    """
+
+    def __init__(self, metro_lines):
+        self.names = []
+        self.ids = {}
+        for stations in metro_lines.values():
+            for station in stations:
+                if station not in self.ids:
+                    self.ids[station] = len(self.names)
+                    self.names.append(station)
+        n = len(self.names)
+
+        neighbors = [[] for _ in range(n)]
+        edge_lines = {}
+        for line_idx, stations in enumerate(metro_lines.values()):
+            for i in range(1, len(stations)):
+                a, b = self.ids[stations[i - 1]], self.ids[stations[i]]
+                if b not in neighbors[a]:
+                    neighbors[a].append(b)
+                if a not in neighbors[b]:
+                    neighbors[b].append(a)
+                edge_lines.setdefault((a, b), set()).add(line_idx)
+                edge_lines.setdefault((b, a), set()).add(line_idx)
+
+        self.hops = np.full((n, n), -1, dtype=np.int16)
+        self.predecessor = np.full((n, n), -1, dtype=np.int32)
+        self.line_changes = np.full((n, n), -1, dtype=np.int16)
+        for source in range(n):
+            self._bfs(source, neighbors, edge_lines)
+
+    def _bfs(self, source, neighbors, edge_lines):
+        hops = self.hops[source]
+        predecessor = self.predecessor[source]
+        line_changes = self.line_changes[source]
+        hops[source] = 0
+        line_changes[source] = 0
+        # lines that can carry the whole last run of the route, None at the source
+        current_lines = {source: None}
+        level = [source]
+        rank = {source: 0}
+        depth = 0
+        while level:
+            depth += 1
+            best = {}
+            for node in level:
+                for next_node in neighbors[node]:
+                    if hops[next_node] != -1:
+                        continue
+                    if next_node not in best or rank[node] < rank[best[next_node]]:
+                        best[next_node] = node
+            next_level = sorted(best, key=lambda x: (rank[best[x]], self.names[x]))
+            for i, node in enumerate(next_level):
+                parent = best[node]
+                hops[node] = depth
+                predecessor[node] = parent
+                lines = edge_lines[(parent, node)]
+                carried = current_lines[parent]
+                if carried is None:
+                    current_lines[node] = lines
+                    line_changes[node] = 0
+                elif carried & lines:
+                    current_lines[node] = carried & lines
+                    line_changes[node] = line_changes[parent]
+                else:
+                    current_lines[node] = lines
+                    line_changes[node] = line_changes[parent] + 1
+                rank[node] = i
+            level = next_level
+
+    def route(self, start, end):
+        """
+        {"path", "hops", "line_changes"} from station `start` to `end`;
+        the path is empty if there is no route.
+        """
+        i, j = self.ids.get(start), self.ids.get(end)
+        if start == end:
+            return {"path": [start], "hops": 0, "line_changes": 0}
+        if i is None or j is None or self.hops[i, j] < 0:
+            return {"path": [], "hops": -1, "line_changes": -1}
+        path = [j]
+        predecessor = self.predecessor[i]
+        while path[-1] != i:
+            path.append(int(predecessor[path[-1]]))
+        return {
+            "path": [self.names[x] for x in reversed(path)],
+            "hops": int(self.hops[i, j]),
+            "line_changes": int(self.line_changes[i, j]),
+        }
+
+
+class MetroRouting:
+    """
+    Per-city `MetroRoutes`, built on first use.
+    """
+
+    def __init__(self, city_lines_dict):
+        self.city_lines_dict = city_lines_dict
+        self._lock = threading.Lock()
+        self._routes = {}
+
+    def get(self, city) -> MetroRoutes:
+        with self._lock:
+            if city not in self._routes:
+                self._routes[city] = MetroRoutes(self.city_lines_dict[city])
+            return self._routes[city]
+
+    def discard(self, city=None):
+        """
+        Drop the tables of `city`, of every city if None.
+        """
+        with self._lock:
+            discard_city(self._routes, city)
+
+
+if __name__ == "__main__":
+    import time
+    import random
+
+    from chinatravel.environment.tools.transportation.apis import (
+        Transportation,
+        find_shortest_path,
+    )
+
+    parser = argparse.ArgumentParser(description="Metro routing tables.")
+    parser.add_argument("--validate", action="store_true")
+    parser.add_argument(
+        "--cities", type=str, nargs="*", default=None, help="English city names"
+    )
+    parser.add_argument("--samples", type=int, default=20000)
+    args = parser.parse_args()
+
+    transportation = Transportation()
+    cities = args.cities if args.cities else transportation.city_list
+    bad = 0
+    for city in cities:
+        start_time = time.time()
+        routes = transportation.metro_routing.get(city)
+        print(
+            f"{city}: {len(routes.names)} stations, built in {time.time() - start_time:.2f}s"
+        )
+        if args.validate:
+            graph = transportation.graphs[city]
+            city_bad = 0
+            for _ in range(args.samples):
+                a, b = random.choice(routes.names), random.choice(routes.names)
+                if routes.route(a, b)["path"] != find_shortest_path(graph, a, b):
+                    city_bad += 1
+            print(f"{city}: {args.samples} samples, {city_bad} mismatches")
+            bad += city_bad
+    if bad > 0:
+        sys.exit(1)
@@ -0,0 +1,213 @@
+"""
+Precomputed metro station tables.
+
+For every city the build stores, next to the distance matrix:
+
+    database/precomputed/<city>/nearest_station.json
+        POI name -> (index of its nearest station in the city's station list,
+        walking distance in km), exactly as `find_nearest_station` returns it.
+    database/precomputed/<city>/station_distances.npy
+        geodesic distance in km between every pair of stations.
+
+With both tables a metro `goto` between two known POIs needs no distance
+computation at all. Points that are not in the table are resolved with the
+per-city station spatial index kept by `Transportation`.
+
+Build and validate with:
+    python chinatravel/environment/tools/transportation/stations.py --build
+    python chinatravel/environment/tools/transportation/stations.py --validate
+"""
+
+import os
+import sys
+import json
+import argparse
+import threading
+
+import numpy as np
+from tqdm import tqdm
+from geopy.distance import geodesic
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0,
+        os.path.dirname(
+            os.path.dirname(
+                os.path.dirname(
+                    os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+                )
+            )
+        ),
+    )
+
+from chinatravel.environment.tools.snapshot import DATABASE_PATH, source_stamp
+from chinatravel.environment.tools.transportation.distance_matrix import (
+    PRECOMPUTED_PATH,
+    poi_source_path,
+)
+
+SUBWAY_SOURCE_PATH = os.path.join(DATABASE_PATH, "transportation", "subways.json")
+
+
+class StationTable:
+    """
+    Read-only access to the station tables, loaded per city on first use.
+    Cities are keyed by their English name.
+    """
+
+    def __init__(self, path: str = PRECOMPUTED_PATH):
+        """
+        path: directory of the precomputed tables, None to disable them.
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        self._nearest = {}
+        self._distances = {}
+
+    def _load(self, city):
+        with self._lock:
+            if city in self._nearest:
+                return
+            nearest, distances = None, None
+            table_path = (
+                None
+                if self.path is None
+                else os.path.join(self.path, city, "nearest_station.json")
+            )
+            if table_path is not None and os.path.exists(table_path):
+                with open(table_path, "r", encoding="utf-8") as f:
+                    table = json.load(f)
+                fresh = True
+                for src_path, stamp in [
+                    (poi_source_path(city), table["source"]),
+                    (SUBWAY_SOURCE_PATH, table["subway_source"]),
+                ]:
+                    if os.path.exists(src_path) and source_stamp(src_path) != stamp:
+                        fresh = False
+                if fresh:
+                    nearest = {
+                        name: (station, distance)
+                        for name, station, distance in zip(
+                            table["names"], table["station"], table["distance"]
+                        )
+                    }
+                    distances = np.load(
+                        os.path.join(self.path, city, "station_distances.npy"),
+                        mmap_mode="r",
+                    )
+            self._nearest[city] = nearest
+            self._distances[city] = distances
+
+    def nearest(self, city, name):
+        """
+        (station index, distance in km) of a named point, or None.
+        """
+        self._load(city)
+        if self._nearest[city] is None:
+            return None
+        return self._nearest[city].get(name)
+
+    def station_distance(self, city, i, j):
+        self._load(city)
+        if self._distances[city] is None:
+            return None
+        return float(self._distances[city][i, j])
+
+
+def nearest_station_linear(location, stations):
+    """
+    Same scan as `find_nearest_station`, returning the station index.
+    """
+    nearest_idx = None
+    min_distance = float("inf")
+    for idx, station in enumerate(stations):
+        distance = geodesic(location, station["position"]).kilometers
+        if distance < min_distance:
+            min_distance = distance
+            nearest_idx = idx
+    return nearest_idx, min_distance
+
+
+def build_station_tables(poi_data, stations, city, path=PRECOMPUTED_PATH):
+    """
+    poi_data: {name: (lat, lon)} of one city, as loaded by `Poi`.
+    stations: the city's station list, as built by `get_lines_and_stations`.
+    """
+    city_path = os.path.join(path, city)
+    os.makedirs(city_path, exist_ok=True)
+
+    n = len(stations)
+    distances = np.zeros((n, n), dtype=np.float64)
+    for i in range(n):
+        distances[i, i] = geodesic(
+            stations[i]["position"], stations[i]["position"]
+        ).kilometers
+        for j in range(i + 1, n):
+            distance = geodesic(stations[i]["position"], stations[j]["position"]).kilometers
+            distances[i, j] = distance
+            distances[j, i] = distance
+    np.save(os.path.join(city_path, "station_distances.npy"), distances)
+
+    names, station_ids, station_distances = [], [], []
+    for name, location in tqdm(poi_data.items(), desc=city):
+        idx, distance = nearest_station_linear(location, stations)
+        if idx is None:
+            continue
+        names.append(name)
+        station_ids.append(idx)
+        station_distances.append(distance)
+    with open(os.path.join(city_path, "nearest_station.json"), "w", encoding="utf-8") as f:
+        json.dump(
+            {
+                "source": source_stamp(poi_source_path(city)),
+                "subway_source": source_stamp(SUBWAY_SOURCE_PATH),
+                "names": names,
+                "station": station_ids,
+                "distance": station_distances,
+            },
+            f,
+            ensure_ascii=False,
+        )
+
+
+if __name__ == "__main__":
+    from chinatravel.environment.tools.transportation.apis import Transportation
+
+    parser = argparse.ArgumentParser(description="Metro station tables.")
+    parser.add_argument("--build", action="store_true")
+    parser.add_argument(
+        "--validate",
+        action="store_true",
+        help="Compare Transportation.nearest_station with the linear scan for every POI.",
+    )
+    parser.add_argument(
+        "--cities", type=str, nargs="*", default=None, help="English city names"
+    )
+    args = parser.parse_args()
+
+    transportation = Transportation()
+    poi = transportation.poi_search
+    cities = args.cities if args.cities else transportation.city_list
+    bad = 0
+    for city in cities:
+        poi_data = poi.data[poi.city_cn_list[poi.city_list.index(city)]]
+        stations = transportation.city_stations_dict[city]
+        if args.build:
+            build_station_tables(poi_data, stations, city)
+        if args.validate:
+            # check the persisted table and the spatial index fallback
+            for station_table, source in [
+                (StationTable(), "table"),
+                (StationTable(path=None), "index"),
+            ]:
+                transportation.station_table = station_table
+                city_bad = 0
+                for name, location in poi_data.items():
+                    idx, distance = nearest_station_linear(location, stations)
+                    expected = (None if idx is None else stations[idx], distance)
+                    if transportation.nearest_station(city, name, location) != expected:
+                        city_bad += 1
+                print(f"{city} ({source}): {len(poi_data)} points, {city_bad} mismatches")
+                bad += city_bad
+    if bad > 0:
+        sys.exit(1)
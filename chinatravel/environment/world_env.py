@@ -1,25 +1,104 @@
 import os
 import sys
+import ast
+import copy
+import inspect
+import functools
+from collections import deque
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 sys.path.append("../..")
-from environment.tools import *
+from chinatravel.environment.tools import *
+from chinatravel.environment.tools.cities import CITY_LIST
+from chinatravel.environment.tools.api_stats import ApiStats
 from pandas import DataFrame
 from typing import Any
 
 
+def _argument(node):
+    """
+    Value of a literal argument. `lambda x: x == v` and `lambda x: x in [...]`
+    with literal strings or numbers become the eq / isin predicates, which
+    select the same rows through the hash indexes.
+    """
+    if not isinstance(node, ast.Lambda):
+        return ast.literal_eval(node)
+    args = node.args
+    if (
+        len(args.args) != 1
+        or args.posonlyargs
+        or args.kwonlyargs
+        or args.vararg
+        or args.kwarg
+        or args.defaults
+        or not isinstance(node.body, ast.Compare)
+        or len(node.body.ops) != 1
+    ):
+        raise ValueError("not a predicate")
+    name = args.args[0].arg
+    left, op, right = node.body.left, node.body.ops[0], node.body.comparators[0]
+    scalar = (str, int, float)
+
+    def is_arg(x):
+        return isinstance(x, ast.Name) and x.id == name
+
+    if isinstance(op, ast.Eq) and (is_arg(left) or is_arg(right)):
+        value = ast.literal_eval(right if is_arg(left) else left)
+        if isinstance(value, scalar) and not isinstance(value, bool):
+            return eq(value)
+    if isinstance(op, ast.In) and is_arg(left):
+        values = ast.literal_eval(right)
+        if isinstance(values, (list, tuple, set)) and all(
+            isinstance(x, scalar) and not isinstance(x, bool) for x in values
+        ):
+            return isin(values)
+    raise ValueError("not a predicate")
+
+
+@functools.lru_cache(maxsize=65536)
+def parse_command(cmd_str: str):
+    """
+    (name, args, kwargs, mutable) of a command that is a single call with literal
+    arguments, e.g. 'goto("上海", "A", "B", "08:00", "walk")'. Returns None for
+    any other command (other lambdas, Results[...], expressions), which is
+    evaluated as python instead. `mutable` tells if an argument is a list, dict, set or
+    tuple that has to be copied before use.
+    """
+    try:
+        node = ast.parse(cmd_str.lstrip(" \t"), mode="eval").body
+    except (SyntaxError, ValueError):
+        return None
+    if not isinstance(node, ast.Call) or not isinstance(node.func, ast.Name):
+        return None
+    if any(keyword.arg is None for keyword in node.keywords):
+        return None
+    try:
+        args = tuple(_argument(x) for x in node.args)
+        kwargs = tuple(
+            (keyword.arg, _argument(keyword.value)) for keyword in node.keywords
+        )
+    except (ValueError, TypeError, SyntaxError, MemoryError, RecursionError):
+        return None
+    mutable = any(
+        isinstance(x, (list, dict, set, tuple))
+        for x in args + tuple(value for _, value in kwargs)
+    )
+    return node.func.id, args, kwargs, mutable
+
+
 class EnvOutput:
     class KeyError(Exception):
         pass
 
-    def __init__(self, success: bool, data: Any):
+    def __init__(self, success: bool, data: Any, paged: bool = True):
         self._success = success
         self._data = data
         if isinstance(data, DataFrame):
             self._page_idx = 0
             self._page_total = len(data) // 10 + (1 if len(data) % 10 != 0 else 0)
             self._original_data = data
-            self._data = data.head(10)
+            if paged:
+                self._data = data.head(10)
 
     def __getitem__(self, key):
         if key == "success":
@@ -62,6 +141,27 @@ class EnvOutput:
             return res
         return str(self._data)
 
+    def release(self):
+        """
+        Keep only the current page and drop the rest of the data, after which
+        next_page() has nothing more to show.
+        """
+        if isinstance(self._data, DataFrame):
+            # a page is a view of the whole frame, copy it to let the frame go
+            self._data = self._data.copy()
+            self._original_data = self._data
+
+    def nbytes(self):
+        """
+        Approximate number of bytes held by the result.
+        """
+        return sum(_nbytes(x) for x in self._held())
+
+    def _held(self):
+        if isinstance(self._data, DataFrame) and self._original_data is not self._data:
+            return [self._original_data, self._data]
+        return [self._data]
+
     def next_page(self):
         if not isinstance(self._data, DataFrame):
             return (
@@ -80,77 +180,267 @@ class EnvOutput:
         return self
 
 
+def _nbytes(data):
+    if isinstance(data, DataFrame):
+        return int(data.memory_usage(index=True, deep=True).sum())
+    return sys.getsizeof(data)
+
+
 class WorldEnv:
     """
     World Environment
     Provide APIs to access the virtual world.
     """
 
-    def __init__(self, en_version=False):
+    def __init__(
+        self,
+        en_version=False,
+        catalog: DataCatalog = None,
+        history_size: int = None,
+        release_paged: bool = False,
+        stats: bool = False,
+    ):
         """
         Initialize the world environment.
+        The tools are taken from the process-wide data catalog unless one is given.
+
+        Results keeps every result by default. With `history_size` only the
+        last `history_size` results are kept (older ones are dropped, so
+        Results[i] counts from the oldest result still kept). With
+        `release_paged` a result keeps only its current page once a newer
+        result is added, since next_page() can no longer reach it.
+
+        With `stats` every API call is timed and stats() reports the calls,
+        latencies and cache hit rates per API.
         """
 
-        self.support_cities = [
-            "上海",
-            "北京",
-            "深圳",
-            "广州",
-            "重庆",
-            "苏州",
-            "成都",
-            "杭州",
-            "武汉",
-            "南京",
-        ]
-        self.attractions = Attractions()
-        self.accommodations = Accommodations()
-        self.restaurants = Restaurants()
-        self.intercitytransport = IntercityTransport()
-        self.transportation = Transportation()
-        self.poi = Poi()
+        self.support_cities = list(CITY_LIST)
+        self.catalog = catalog if catalog is not None else get_catalog()
+        self.attractions = self.catalog.attractions
+        self.accommodations = self.catalog.accommodations
+        self.restaurants = self.catalog.restaurants
+        self.intercitytransport = self.catalog.intercity_transport
+        self.transportation = self.catalog.transportation
+        self.poi = self.catalog.poi
+
+        self.history_size = history_size
+        self.release_paged = release_paged
+        self.results = self._new_history()
+        self.tools = self._build_registry()
+        self._checked_arguments = {}
+
+        self.api_stats = None
+        if stats:
+            self.api_stats = ApiStats(self._caches())
+            self.tools = {
+                name: self.api_stats.timed(name, func)
+                for name, func in self.tools.items()
+            }
+
+    def _build_registry(self):
+        """
+        name -> function of the APIs that can be called from a command.
+        """
+        return {
+            "attractions_keys": self.attractions.keys,
+            "attractions_types": self.attractions.get_type_list,
+            "attractions_select": self.attractions.select,
+            "attractions_id_is_open": self.attractions.id_is_open,
+            "attractions_nearby": self.attractions.nearby,
+            "accommodations_keys": self.accommodations.keys,
+            "accommodations_select": self.accommodations.select,
+            "accommodations_nearby": self.accommodations.nearby,
+            "restaurants_select": self.restaurants.select,
+            "restaurants_keys": self.restaurants.keys,
+            "restaurants_nearby": self.restaurants.nearby,
+            "restaurants_id_is_open": self.restaurants.id_is_open,
+            "restaurants_cuisine": self.restaurants.get_cuisine_list,
+            "restaurants_with_recommended_food": self.restaurants.restaurants_with_recommended_food,
+            "goto": self.transportation.goto,
+            "goto_many": self.transportation.goto_many,
+            "open_mask": self._open_mask,
+            "open_window": self._open_window,
+            "intercity_transport_select": self.intercitytransport.select,
+            "poi_lat_lon_search": self.poi.search,
+            "next_page": self.next_page,
+        }
+
+    def _caches(self):
+        """
+        name -> cache of the tools, for the hit rates in stats().
+        """
+        return {
+            "route": self.transportation.route_cache,
+            "attractions_hash_index": self.attractions.hash_index,
+            "attractions_spatial_index": self.attractions.spatial_index,
+            "attractions_opening_hours": self.attractions.opening_hours,
+            "accommodations_hash_index": self.accommodations.hash_index,
+            "accommodations_spatial_index": self.accommodations.spatial_index,
+            "restaurants_hash_index": self.restaurants.hash_index,
+            "restaurants_spatial_index": self.restaurants.spatial_index,
+            "restaurants_opening_hours": self.restaurants.opening_hours,
+        }
 
-        self.results = []
+    def stats(self, reset: bool = False):
+        """
+        Calls, errors, cumulative time and latency percentiles per API, and
+        the cache hit rates, since the environment was created or the last
+        stats(reset=True). None unless the environment was created with
+        `stats`. reset() does not clear them.
+        """
+        if self.api_stats is None:
+            return None
+        summary = self.api_stats.summary()
+        if reset:
+            self.api_stats.clear()
+        return summary
 
     def __call__(self, cmd_str: str):
         """
         Call the API by command string in the format of python function call.
         """
-        # init env to execute the command directly
-        attractions_keys = self.attractions.keys
-        attractions_types = self.attractions.get_type_list
-        attractions_select = self.attractions.select
-        attractions_id_is_open = self.attractions.id_is_open
-        attractions_nearby = self.attractions.nearby
-
-        accommodations_keys = self.accommodations.keys
-        accommodations_select = self.accommodations.select
-        accommodations_nearby = self.accommodations.nearby
-
-        restaurants_select = self.restaurants.select
-        restaurants_keys = self.restaurants.keys
-        restaurants_nearby = self.restaurants.nearby
-        restaurants_id_is_open = self.restaurants.id_is_open
-        restaurants_cuisine = self.restaurants.get_cuisine_list
-        restaurants_with_recommended_food = (
-            self.restaurants.restaurants_with_recommended_food
-        )
+        return self._record(self._eval(cmd_str))
 
-        goto = self.transportation.goto
-        intercity_transport_select = self.intercitytransport.select
-        poi_lat_lon_search = self.poi.search
+    def call(self, name: str, *args, **kwargs):
+        """
+        Call the API `name` with python arguments instead of a command string,
+        e.g. env.call("goto", "上海", start, end, "08:00", "walk").
+        The arguments are checked against the signature of the API first; an
+        unknown API or bad arguments give an unsuccessful EnvOutput, as the
+        string form does.
+        """
+        return self._record(self._dispatch(name, args, kwargs, check=True))
+
+    def _new_history(self):
+        if self.history_size is None:
+            return []
+        return deque(maxlen=self.history_size)
+
+    def _record(self, res):
+        # next_page() returns the result it pages, which stays pageable
+        if self.release_paged and len(self.results) > 0 and self.results[-1] is not res:
+            self.results[-1].release()
+        self.results.append(res)
+        return self.results[-1]
 
-        next_page = self.next_page
-        Results = self.results
+    def history_bytes(self):
+        """
+        Approximate number of bytes held by the results in the history. Data
+        shared by several results is counted once.
+        """
+        held = {}
+        for res in self.results:
+            for data in res._held():
+                held[id(data)] = data
+        return sum(_nbytes(x) for x in held.values())
+
+    def fetch_all(self, cmd_str: str):
+        """
+        Call the API like __call__, but return the whole result at once:
+        "data" holds every row of a DataFrame result instead of the first page.
+        The result is not added to Results, so next_page() is not affected.
+        """
+        res = self._eval(cmd_str)
+        data = res["whole_data"]
+        if isinstance(data, DataFrame):
+            data = data.reset_index(drop=True)
+        return EnvOutput(res["success"], data, paged=False)
 
+    def iter_pages(self, cmd_str: str, chunk_size: int = 10):
+        """
+        Call the API and yield a DataFrame result in chunks of `chunk_size`
+        rows. Other results are yielded once.
+        """
+        data = self.fetch_all(cmd_str)["data"]
+        if not isinstance(data, DataFrame):
+            yield data
+            return
+        for i in range(0, len(data), chunk_size):
+            yield data.iloc[i : i + chunk_size]
+
+    def _eval(self, cmd_str: str):
+        parsed = parse_command(cmd_str)
+        if parsed is not None and parsed[0] in self.tools:
+            name, args, kwargs, mutable = parsed
+            if mutable:
+                # the parsed literals are cached, never hand out the cached lists
+                args, kwargs = copy.deepcopy((args, kwargs))
+            return self._dispatch(name, args, dict(kwargs))
+        return self._eval_python(cmd_str)
+
+    def _eval_python(self, cmd_str: str):
+        namespace = dict(self.tools)
+        namespace["Results"] = self.results
         try:
-            res = eval(cmd_str)
+            res = eval(cmd_str, globals(), namespace)
             if not isinstance(res, EnvOutput):
                 res = EnvOutput(True, res)
         except Exception as e:
             res = EnvOutput(False, "Invalid command.\n" + str(e))
-        self.results.append(res)
-        return self.results[-1]
+        return res
+
+    def _dispatch(self, name, args, kwargs, check=False):
+        func = self.tools.get(name)
+        if func is None:
+            return EnvOutput(False, f"Invalid command.\nname '{name}' is not defined")
+        try:
+            if check:
+                self._check_arguments(name, args, kwargs)
+            res = func(*args, **kwargs)
+            if not isinstance(res, EnvOutput):
+                res = EnvOutput(True, res)
+        except Exception as e:
+            res = EnvOutput(False, "Invalid command.\n" + str(e))
+        return res
+
+    def _check_arguments(self, name, args, kwargs):
+        # binding only depends on the number of positional arguments and on
+        # the keyword names, so the outcome is cached on those
+        key = (name, len(args), tuple(kwargs))
+        if key not in self._checked_arguments:
+            try:
+                inspect.signature(self.tools[name]).bind(*args, **kwargs)
+                self._checked_arguments[key] = None
+            except TypeError as e:
+                self._checked_arguments[key] = f"{name}(): {e}"
+        error = self._checked_arguments[key]
+        if error is not None:
+            raise TypeError(error)
+
+    def goto_many(self, city, start, ends, start_time, transport_type):
+        """
+        goto from one start to many ends, as arrays aligned with `ends`.
+        See Transportation.goto_many.
+        """
+        return self.tools["goto_many"](city, start, ends, start_time, transport_type)
+
+    def open_mask(self, city, kind, time):
+        """
+        Mask over the attractions or restaurants of a city of the rows open at
+        `time` ("HH:MM" or minutes since midnight). kind: "attractions" or
+        "restaurants".
+        """
+        return self.tools["open_mask"](city, kind, time)
+
+    def open_window(self, city, kind, ids):
+        """
+        Opening and closing minutes of the attractions or restaurants with the
+        given ids, as arrays {"open", "end", "closed"}.
+        """
+        return self.tools["open_window"](city, kind, ids)
+
+    def _open_mask(self, city, kind, time):
+        return self._opening_hours_tool(kind).open_mask(city, time)
+
+    def _open_window(self, city, kind, ids):
+        return self._opening_hours_tool(kind).open_window(city, ids)
+
+    def _opening_hours_tool(self, kind):
+        if kind == "attractions":
+            return self.attractions
+        if kind == "restaurants":
+            return self.restaurants
+        raise ValueError("only support kind in ['attractions', 'restaurants']")
 
     def next_page(self):
         """
@@ -164,7 +454,7 @@ class WorldEnv:
         """
         Reset the environment.
         """
-        self.results = []
+        self.results = self._new_history()
 
 
 __doc__ = """
@@ -248,11 +538,12 @@ city: The city name.
 point: The name of the location.
 topk: The number of restaurants to return.
 dist: The maximum distance from the location, default is 2.
-(13) restaurants_restaurants_with_recommended_food(city: str, food: str):
+(13) restaurants_restaurants_with_recommended_food(city: str, food: str, mode: str = "substring"):
 Description: Returns all restaurants with the specified food in their recommended dishes.
 Parameters: 
 city: The city name.
 food: The food to search for.
+mode: Optional. 'substring' matches the food anywhere in the recommended dishes, 'token' only matches a whole dish.
 (14) restaurants_cuisine(city: str):
 Description: Returns a list of unique restaurant cuisines.
 Parameters: 
@@ -267,13 +558,15 @@ end: The end point's name. Must be a location name and match the data exactly.
 start_time: The departure time in the format 'HH:MM'.
 transport_type: The mode of transportation, must in ['walk', 'taxi', 'metro'].
 
-(16) intercity_transport_select(start_city: str, end_city: str, intercity_type: str, earliest_leave_time: str = None):
+(16) intercity_transport_select(start_city: str, end_city: str, intercity_type: str, earliest_leave_time: str = None, latest_arrival_time: str = None, max_price: float = None):
 Description: get the intercity transportation information between two cities. You need to call this function at least twice to get the transportation information between two locations for going and returning.
 Parameters:
 start_city: The start city name.
 end_city: The end city name.
 intercity_type: The type of intercity transportation, must in ['train', 'airplane'].
 earliest_leave_time: The earliest leave time in the format 'HH:MM'.
+latest_arrival_time: Optional. The latest arrival time on the day of departure, in the format 'HH:MM'.
+max_price: Optional. The highest price of a ticket.
 
 (17) Results[index] Results[index].next_page()
 Description: Get the result of the index or go to the next page of the result.
@@ -281,7 +574,20 @@ Description: Get the result of the index or go to the next page of the result.
 
 
 if __name__ == "__main__":
+    import gc
     import random
+    import argparse
+
+    parser = argparse.ArgumentParser(description="World environment checks.")
+    parser.add_argument(
+        "--history_check",
+        action="store_true",
+        help="Check that a bounded history keeps RSS growth under --max_growth_mb.",
+    )
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--history_size", type=int, default=20)
+    parser.add_argument("--max_growth_mb", type=float, default=64)
+    args = parser.parse_args()
 
     test_env = WorldEnv()
     test_env.transportation.goto(
@@ -449,4 +755,54 @@ if __name__ == "__main__":
         test_for_intercity_transport(city_list)
         test_for_next_page()
 
-    test_all()
+    def rss_bytes():
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+    def test_for_history_memory(queries, history_size, max_growth_mb):
+        city_list = ["上海", "北京", "南京"]
+        cmds = []
+        for city in city_list:
+            names = test_env.fetch_all(
+                f"attractions_select('{city}', 'name', lambda x: True)"
+            )["data"]["name"].tolist()
+            for func in [
+                "attractions_select",
+                "restaurants_select",
+                "accommodations_select",
+            ]:
+                cmds.append(f"{func}('{city}', 'name', lambda x: True)")
+            cmds.append(f"intercity_transport_select('{city}', '上海', 'train')")
+            for i in range(10):
+                cmds.append(
+                    f"goto('{city}', '{names[i]}', '{names[-i - 1]}', '08:00', 'metro')"
+                )
+            cmds.append("next_page()")
+
+        bounded_env = WorldEnv(history_size=history_size, release_paged=True)
+        unbounded_env = WorldEnv()
+        for cmd in cmds:
+            # warm up the tool caches so that only the history can grow
+            bounded_env(cmd)
+        bounded_env.reset()
+        gc.collect()
+        rss_start = rss_bytes()
+        for i in range(queries):
+            bounded_env(cmds[i % len(cmds)])
+        gc.collect()
+        growth_mb = (rss_bytes() - rss_start) / 2**20
+        for i in range(queries):
+            unbounded_env(cmds[i % len(cmds)])
+        print(
+            f"{queries} queries: RSS growth {growth_mb:.1f} MB, "
+            f"history {bounded_env.history_bytes() / 2**20:.2f} MB in {len(bounded_env.results)} results "
+            f"(unbounded history: {unbounded_env.history_bytes() / 2**20:.2f} MB in {len(unbounded_env.results)} results)"
+        )
+        if len(bounded_env.results) > history_size or growth_mb > max_growth_mb:
+            print(f"RSS growth over {max_growth_mb} MB")
+            sys.exit(1)
+
+    if args.history_check:
+        test_for_history_memory(args.queries, args.history_size, args.max_growth_mb)
+    else:
+        test_all()
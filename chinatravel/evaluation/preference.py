@@ -11,11 +11,12 @@ if project_root_path not in sys.path:
 
 import json
 from chinatravel.environment.world_env import WorldEnv
-from chinatravel.evaluation.utils import Attractions
+from chinatravel.environment.tools.catalog import get_catalog
+from chinatravel.environment.tools.predicates import eq
 
 from chinatravel.symbol_verification.preference import evaluate_preference_py
 env = WorldEnv()
-attractions = Attractions()
+attractions = get_catalog().attractions
 goto = env.transportation.goto
 
 city_dict = {
@@ -169,7 +170,7 @@ def attraction_satisfaction(plan_json):
             if activity["type"] == "attraction":
                 attraction_name = activity["position"]
                 attrction_info = attractions.select(
-                    city, key="name", func=lambda x: x == attraction_name
+                    city, key="name", func=eq(attraction_name)
                 ).iloc[0]
                 # attrction_info = ood_attractions_dataframe[ood_attractions_dataframe["name"] == attraction_name].iloc[0]
                 recommend_time = (attrction_info["recommendmintime"]) * 60
@@ -213,7 +214,7 @@ def indoor_attraction_ratio(plan_json):
                 attraction_name = activity["position"]
                 city = plan_json["target_city"]
                 attraction_info = attractions.select(
-                    city, key="name", func=lambda x: x == attraction_name
+                    city, key="name", func=eq(attraction_name)
                 ).iloc[0]
                 if attraction_info["indoor"] == 1:
                     indoor_attraction_count += 1
@@ -233,7 +234,7 @@ def popular_attraction_ratio(plan_json):
                 attraction_name = activity["position"]
                 city = plan_json["target_city"]
                 attraction_info = attractions.select(
-                    city, key="name", func=lambda x: x == attraction_name
+                    city, key="name", func=eq(attraction_name)
                 ).iloc[0]
                 popular_score_sum += attraction_info["popularity"]
     if attraction_count == 0:
@@ -13,52 +13,26 @@ if project_root_path not in sys.path:
     sys.path.insert(0, project_root_path)
 
 from chinatravel.agent.utils import Logger, NpEncoder
-from chinatravel.environment.tools import Attractions
+from chinatravel.environment.tools import Attractions, get_catalog
+from chinatravel.environment.tools.cities import to_english
 
 
 class AttractionsOODTag(Attractions):
     def __init__(
         self, base_path: str = os.path.dirname(__file__) + "/eval_annotation/attractions/", en_version=False
     ):
-        super().__init__(en_version=en_version)
-        city_list = [
-            "beijing",
-            "shanghai",
-            "nanjing",
-            "suzhou",
-            "hangzhou",
-            "shenzhen",
-            "chengdu",
-            "wuhan",
-            "guangzhou",
-            "chongqing",
-        ]
         curdir = os.path.dirname(os.path.realpath(__file__))
-        self.ood_tag = {}
-        for city in city_list:
-            self.ood_tag[city] = pd.read_csv(
-                os.path.join(curdir, f"{base_path}/{city}/attractions_tag.csv")
-            )
-        city_cn_list = [
-            "北京",
-            "上海",
-            "南京",
-            "苏州",
-            "杭州",
-            "深圳",
-            "成都",
-            "武汉",
-            "广州",
-            "重庆",
-        ]
-        for i, city in enumerate(city_list):
-            self.ood_tag[city_cn_list[i]] = self.ood_tag.pop(city)
-        for city in city_cn_list:
-            self.data[city] = pd.merge(
-                self.data[city], self.ood_tag[city], on=["id", "name"], how="left"
-            )
-            # print(self.data[city])
-        del self.ood_tag
+        self.tag_path = os.path.join(curdir, base_path)
+        super().__init__(en_version=en_version, poi=get_catalog().poi)
+
+    def _load_table(self, city):
+        # the attractions of the city with their OOD tags merged in
+        ood_tag = pd.read_csv(
+            os.path.join(self.tag_path, to_english(city), "attractions_tag.csv")
+        )
+        return pd.merge(
+            super()._load_table(city), ood_tag, on=["id", "name"], how="left"
+        )
 
 def load_json_file(file_path):
     with open(file_path, "r", encoding="utf-8") as f:
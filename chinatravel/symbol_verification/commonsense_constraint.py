@@ -2,11 +2,8 @@
 import sys
 
 
-from chinatravel.environment.tools.accommodations.apis import Accommodations
-from chinatravel.environment.tools.restaurants.apis import Restaurants
-from chinatravel.environment.tools.attractions.apis import Attractions
-from chinatravel.environment.tools.intercity_transport.apis import IntercityTransport
-from chinatravel.environment.tools.transportation.apis import Transportation
+from chinatravel.environment.tools.catalog import get_catalog
+from chinatravel.environment.tools.predicates import eq
 # from env.tools.transportation.apis import GoTo
 # from envs import goto
 import json
@@ -18,11 +15,12 @@ from chinatravel.evaluation.utils import load_json_file
     
 import pandas as pd
 
-accommodation = Accommodations()
-restaurants = Restaurants()
-attractions = Attractions()
-intercity_transport=IntercityTransport()
-innercity_transport=Transportation()
+catalog = get_catalog()
+accommodation = catalog.accommodations
+restaurants = catalog.restaurants
+attractions = catalog.attractions
+intercity_transport = catalog.intercity_transport
+innercity_transport = catalog.transportation
 
 
 '''
@@ -370,7 +368,7 @@ def Is_attractions_correct(symbolic_input, plan_json, verbose=False):
                 error_info.append("No position information!")
                 return table_statistics, error_info
             
-            select_attraction=attractions.select(target_city,key='name',func=lambda x:x==activity_i["position"])
+            select_attraction=attractions.select(target_city,key='name',func=eq(activity_i["position"]))
 
             # print(select_attraction)
 
@@ -476,7 +474,7 @@ def Is_hotels_correct(symbolic_input, plan_json, verbose=False):
                 error_info.append("No position information!")
                 return table_statistics, error_info
             
-            select_hotel=accommodation.select(target_city,key='name',func=lambda x:x==activity_i["position"])
+            select_hotel=accommodation.select(target_city,key='name',func=eq(activity_i["position"]))
             # print(select_hotel)
 
             if select_hotel.empty:
@@ -571,13 +569,13 @@ def Is_restaurants_correct(symbolic_input, plan_json, verbose=False):
                 return table_statistics, error_info
             
 
-            select_restaurant=restaurants.select(target_city,key='name',func=lambda x:x==activity_i["position"])
+            select_restaurant=restaurants.select(target_city,key='name',func=eq(activity_i["position"]))
 
             # print(select_restaurant)
 
             if activity_i["type"] == "breakfast" and select_restaurant.empty:
 
-                select_hotel=accommodation.select(target_city,key='name',func=lambda x:x==activity_i["position"])
+                select_hotel=accommodation.select(target_city,key='name',func=eq(activity_i["position"]))
     
                 if select_hotel.empty:
                     table_statistics.loc[0] = [1, 1, 1, 1, 1, 1]
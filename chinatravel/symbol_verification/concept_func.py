@@ -1,6 +1,5 @@
-from chinatravel.environment.tools.accommodations.apis import Accommodations
-from chinatravel.environment.tools.restaurants.apis import Restaurants
-from chinatravel.environment.tools.attractions.apis import Attractions
+from chinatravel.environment.tools.catalog import get_catalog
+from chinatravel.environment.tools.predicates import eq
 
 
 def day_count(plan):
@@ -85,16 +84,14 @@ def activity_time(activity):
 
 
 def poi_recommend_time(city, poi):
-    select = Attractions().select
-    attrction_info = select(city, key="name", func=lambda x: x == poi).iloc[0]
+    select = get_catalog().attractions.select
+    attrction_info = select(city, key="name", func=eq(poi)).iloc[0]
     recommend_time = (attrction_info["recommendmintime"]) * 60
     return recommend_time
 
 
 def poi_distance(city, poi1, poi2, start_time="00:00", transport_type="walk"):
-    from chinatravel.environment.tools.transportation.apis import Transportation
-
-    goto = Transportation().goto
+    goto = get_catalog().transportation.goto
     return goto(city, poi1, poi2, start_time, transport_type)[0]["distance"]
 
 
@@ -170,11 +167,9 @@ def room_type(activity):
 
 
 def restaurant_type(activity, target_city):
-    from chinatravel.environment.tools.restaurants.apis import Restaurants
-
-    restaurants = Restaurants()
+    restaurants = get_catalog().restaurants
     select_food_type = restaurants.select(
-        target_city, key="name", func=lambda x: x == activity["position"]
+        target_city, key="name", func=eq(activity["position"])
     )["cuisine"]
     if not select_food_type.empty:
         return select_food_type.iloc[0]
@@ -182,11 +177,9 @@ def restaurant_type(activity, target_city):
 
 
 def attraction_type(activity, target_city):
-    from chinatravel.environment.tools.attractions.apis import Attractions
-
-    attractions = Attractions()
+    attractions = get_catalog().attractions
     select_attr_type = attractions.select(
-        target_city, key="name", func=lambda x: x == activity["position"]
+        target_city, key="name", func=eq(activity["position"])
     )["type"]
     if not select_attr_type.empty:
         return select_attr_type.iloc[0]
@@ -194,11 +187,9 @@ def attraction_type(activity, target_city):
 
 
 def accommodation_type(activity, target_city):
-    from chinatravel.environment.tools.accommodations.apis import Accommodations
-
-    accommodations = Accommodations()
+    accommodations = get_catalog().accommodations
     select_hotel_type = accommodations.select(
-        target_city, key="name", func=lambda x: x == activity["position"]
+        target_city, key="name", func=eq(activity["position"])
     )["featurehoteltype"]
     if not select_hotel_type.empty:
         return select_hotel_type.iloc[0]
@@ -0,0 +1,466 @@
+"""
+Scoring of search candidates against the hard_logic_py constraints.
+
+The agents rerank the POIs of a city by the number of constraints the plan
+passes with each of them added, and used to deepcopy the plan and exec every
+constraint on the copy for every candidate. `ConstraintScorer` compiles the
+constraints once and sorts them by the parts of the plan they read:
+
+- shape constraints read the plan only through day_count, people_count,
+  start_city and target_city, which adding an activity does not change; they
+  are evaluated once per plan shape and their results reused,
+- loop constraints are of the form
+
+      <statements>
+      for activity in allactivities(plan):
+          <statements>
+      <statements>
+
+  with the same restriction on the statements; the statements up to the end
+  of the loop run once over the activities of the prefix, and each candidate
+  runs the loop body on its activity and the statements after the loop from a
+  copy of that state,
+- the other constraints run on every candidate plan, which shares the days of
+  the prefix instead of copying them.
+
+The results are the ones of evaluate_constraints_py, failures included, as
+long as the constraints do not modify the plan they check.
+
+Compare with evaluate_constraints_py with:
+    python chinatravel/symbol_verification/constraint_scorer.py --compare --search 12
+
+--search adds the batches that the reranking of the rule-driven search
+scores, each checked against a copy of the plan with the candidate added, as
+the reranking used to do.
+"""
+
+import os
+import sys
+import ast
+from copy import deepcopy
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+
+from chinatravel.symbol_verification.concept_func import func_dict, allactivities
+
+SHAPE_FUNCS = ("day_count", "people_count", "start_city", "target_city")
+
+# names a constraint must not rebind for the analysis to hold
+RESERVED_NAMES = set(func_dict) | {"plan"}
+
+UNSUPPORTED_NODES = (
+    ast.FunctionDef,
+    ast.AsyncFunctionDef,
+    ast.ClassDef,
+    ast.Lambda,
+    ast.Global,
+    ast.Nonlocal,
+    ast.Import,
+    ast.ImportFrom,
+    ast.Match,
+)
+
+ATOMIC_TYPES = (int, float, str, bool, type(None))
+
+_MISSING = object()
+
+
+def _exec(code, namespace):
+    # as in evaluate_constraints_py
+    exec(code, {"__builtins__": {"set": set}}, namespace)
+
+
+def _is_plan(node):
+    return isinstance(node, ast.Name) and node.id == "plan"
+
+
+def _is_call(node, names):
+    return (
+        isinstance(node, ast.Call)
+        and isinstance(node.func, ast.Name)
+        and node.func.id in names
+        and len(node.args) == 1
+        and len(node.keywords) == 0
+        and _is_plan(node.args[0])
+    )
+
+
+def _shape_only(nodes) -> bool:
+    """
+    Whether the statements read the plan through SHAPE_FUNCS only.
+    """
+    shape_args = set()
+    for node in nodes:
+        for sub in ast.walk(node):
+            if _is_call(sub, SHAPE_FUNCS):
+                shape_args.add(id(sub.args[0]))
+    for node in nodes:
+        for sub in ast.walk(node):
+            if _is_plan(sub) and id(sub) not in shape_args:
+                return False
+    return True
+
+
+def _supported(tree) -> bool:
+    for node in ast.walk(tree):
+        if isinstance(node, UNSUPPORTED_NODES):
+            return False
+        if isinstance(node, ast.Name) and not isinstance(node.ctx, ast.Load):
+            if node.id in RESERVED_NAMES:
+                return False
+        if isinstance(node, ast.ExceptHandler) and node.name in RESERVED_NAMES:
+            return False
+    return True
+
+
+class _Constraint:
+    def __init__(self, source):
+        self.source = source
+        self.kind = "full"
+        try:
+            self.code = compile(source, "<hard_logic_py>", "exec")
+            tree = ast.parse(source)
+        except Exception:
+            # exec raises as well
+            self.kind = "error"
+            return
+        if not _supported(tree):
+            return
+        if _shape_only(tree.body):
+            self.kind = "shape"
+            return
+
+        loops = [
+            i
+            for i, node in enumerate(tree.body)
+            if isinstance(node, ast.For) and _is_call(node.iter, ("allactivities",))
+        ]
+        if len(loops) == 0:
+            return
+        i = loops[0]
+        loop = tree.body[i]
+        pre, post = tree.body[:i], tree.body[i + 1 :]
+        if (
+            not isinstance(loop.target, ast.Name)
+            or len(loop.orelse) > 0
+            or any(isinstance(sub, ast.Break) for sub in ast.walk(loop))
+            or not _shape_only(pre + loop.body + post)
+        ):
+            return
+        step = ast.copy_location(
+            ast.For(
+                target=loop.target,
+                iter=ast.Name(id="__activities__", ctx=ast.Load()),
+                body=loop.body,
+                orelse=[],
+            ),
+            loop,
+        )
+        self.prefix_code = compile(
+            ast.fix_missing_locations(ast.Module(body=pre + [step], type_ignores=[])),
+            "<hard_logic_py>",
+            "exec",
+        )
+        self.step_code = compile(
+            ast.fix_missing_locations(ast.Module(body=[step] + post, type_ignores=[])),
+            "<hard_logic_py>",
+            "exec",
+        )
+        self.target = loop.target.id
+        self.kind = "loop"
+
+    def run(self, plan, code=None, namespace=None) -> bool:
+        if self.kind == "error":
+            return False
+        if namespace is None:
+            namespace = dict(func_dict)
+            namespace["plan"] = plan
+        try:
+            _exec(self.code if code is None else code, namespace)
+            return bool(namespace.get("result", False))
+        except Exception:
+            return False
+
+    def prefix_state(self, plan):
+        """
+        Namespace after the loop over the activities of `plan`, None if that
+        already fails.
+        """
+        namespace = dict(func_dict)
+        namespace["plan"] = plan
+        try:
+            namespace["__activities__"] = allactivities(plan)
+            _exec(self.prefix_code, namespace)
+        except Exception:
+            return None
+        namespace.pop("__activities__", None)
+        namespace.pop(self.target, None)
+        return namespace
+
+    def step(self, state, activity) -> bool:
+        """
+        Result with `activity` after the activities of the state.
+        """
+        if state is None:
+            return False
+        namespace = {}
+        for name, value in state.items():
+            if name in RESERVED_NAMES or isinstance(value, ATOMIC_TYPES):
+                namespace[name] = value
+            else:
+                namespace[name] = deepcopy(value)
+        namespace["__activities__"] = [activity]
+        return self.run(None, self.step_code, namespace)
+
+
+def _shape_key(plan):
+    try:
+        key = (len(plan["itinerary"]),) + tuple(
+            plan.get(name, _MISSING) for name in ("people_number", "start_city", "target_city")
+        )
+        hash(key)
+        return key
+    except Exception:
+        return None
+
+
+def candidate_plan(plan, current_day, activity):
+    """
+    `plan` with `activity` added to the day `current_day`; the other days and
+    the activities before it are shared with `plan`.
+    """
+    itinerary = list(plan["itinerary"])
+    day = dict(itinerary[current_day])
+    day["activities"] = day["activities"] + [activity]
+    itinerary[current_day] = day
+    res_plan = dict(plan)
+    res_plan["itinerary"] = itinerary
+    return res_plan
+
+
+class ConstraintScorer:
+    def __init__(self, hard_logic_py):
+        self.codes = list(hard_logic_py)
+        self.constraints = [_Constraint(code) for code in self.codes]
+        self._shape_results = {}
+
+    def kinds(self) -> dict:
+        kinds = {}
+        for constraint in self.constraints:
+            kinds[constraint.kind] = kinds.get(constraint.kind, 0) + 1
+        return kinds
+
+    def _shape_passed(self, plan) -> int:
+        key = _shape_key(plan)
+        if key is None or key not in self._shape_results:
+            passed = sum(
+                c.run(plan) for c in self.constraints if c.kind == "shape"
+            )
+            if key is None:
+                return passed
+            self._shape_results[key] = passed
+        return self._shape_results[key]
+
+    def evaluate(self, plan) -> list:
+        """
+        The results of evaluate_constraints_py.
+        """
+        return [constraint.run(plan) for constraint in self.constraints]
+
+    def score(self, plan) -> int:
+        """
+        Number of constraints `plan` passes.
+        """
+        return self._shape_passed(plan) + sum(
+            c.run(plan) for c in self.constraints if c.kind != "shape"
+        )
+
+    def score_candidates(self, plan, current_day, activities) -> list:
+        """
+        Number of constraints `plan` passes with each of `activities` added to
+        the day `current_day` of its itinerary, 0 for a None activity.
+        """
+        scores = [0] * len(activities)
+        live = [i for i, activity in enumerate(activities) if activity is not None]
+        if len(live) == 0:
+            return scores
+        # the candidate activity is the last one of allactivities
+        last_day = current_day == len(plan["itinerary"]) - 1
+
+        shape_passed = self._shape_passed(plan)
+        plans = {}
+        for constraint in self.constraints:
+            if constraint.kind == "shape":
+                continue
+            if constraint.kind == "loop" and last_day:
+                state = constraint.prefix_state(plan)
+                for i in live:
+                    scores[i] += constraint.step(state, activities[i])
+                continue
+            for i in live:
+                if i not in plans:
+                    plans[i] = candidate_plan(plan, current_day, activities[i])
+                scores[i] += constraint.run(plans[i])
+        for i in live:
+            scores[i] += shape_passed
+        return scores
+
+
+if __name__ == "__main__":
+    import json
+    import glob
+    import time
+    import random
+    import argparse
+
+    from chinatravel.symbol_verification.hard_constraint import evaluate_constraints_py
+
+    parser = argparse.ArgumentParser(
+        description="Compare the constraint scorer with evaluate_constraints_py."
+    )
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument(
+        "--plans",
+        type=str,
+        nargs="*",
+        default=glob.glob(
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "agent",
+                "nesy_agent",
+                "plan_for_check",
+                "*.json",
+            )
+        ),
+        help="Plan json files (with people_number, start_city, target_city).",
+    )
+    parser.add_argument(
+        "--constraints",
+        type=str,
+        default=None,
+        help="Json file with a list of hard_logic_py constraints.",
+    )
+    parser.add_argument(
+        "--search",
+        type=int,
+        default=0,
+        help="Also compare on the batches the reranking of the rule-driven search "
+        "scores for this many queries.",
+    )
+    parser.add_argument(
+        "--search-time", type=int, default=30, help="TIME_CUT of each search, in seconds."
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if args.constraints is not None:
+        with open(args.constraints, "r", encoding="utf-8") as f:
+            constraints = json.load(f)
+    else:
+        constraints = [
+            "result=(day_count(plan)==2)",
+            "result=(people_count(plan)==2)",
+            "result=(start_city(plan)!=target_city(plan))",
+            "total_cost=0\nfor activity in allactivities(plan):\n    total_cost+=activity_cost(activity)\nresult=(total_cost<=3000)",
+            "activity_set=set()\nfor activity in allactivities(plan):\n    activity_set.add(activity_type(activity))\nresult=({'attraction', 'lunch'}<=activity_set)",
+            "result=True\nfor activity in allactivities(plan):\n    if activity_type(activity)=='attraction' and activity_tickets(activity)!=people_count(plan):\n        result=False",
+            "innercity_transport_set=set()\nfor activity in allactivities(plan):\n    if activity_transports(activity)!=[]:\n        innercity_transport_set.add(innercity_transport_type(activity_transports(activity)))\nresult=(innercity_transport_set<={'taxi'})",
+            "count=0\nfor activity in allactivities(plan):\n    if activity_type(activity)=='attraction':\n        count=count+1\nresult=(count>=day_count(plan))",
+            "result=(allactivities_count(plan)<=12)",
+            "result=True\nfor activity in dayactivities(plan, 1):\n    if activity_type(activity)=='dinner':\n        result=False",
+            "result=(len(allactivities(plan))>0)",
+            "result=({activity_type(a) for a in allactivities(plan)}<={'attraction'})",
+            "for activity in allactivities(plan):\n    last=activity_end_time(activity)\nresult=(last<='20:00')",
+            "result = (",
+        ]
+    scorer = ConstraintScorer(constraints)
+    print("constraint kinds:", scorer.kinds())
+
+    def searched_batches(n, time_cut):
+        """
+        The (plan, day, activities) batches that RuleDrivenAgent reranks on n
+        queries with the constraints.
+        """
+        from chinatravel.environment.world_env import WorldEnv
+        from chinatravel.agent.nesy_agent.rule_driven_rec import RuleDrivenAgent
+        from chinatravel.agent.search_harness import check_queries, run_search
+
+        batches = []
+
+        class RecordingAgent(RuleDrivenAgent):
+            def score_candidates(self, query, plan, current_day, activities):
+                batches.append(
+                    (
+                        {
+                            "people_number": query["people_number"],
+                            "start_city": query["start_city"],
+                            "target_city": query["target_city"],
+                            "itinerary": deepcopy(plan),
+                        },
+                        current_day,
+                        deepcopy(activities),
+                    )
+                )
+                return super().score_candidates(query, plan, current_day, activities)
+
+        env = WorldEnv()
+        for query in check_queries(
+            env.support_cities, n, hard_logic_py=constraints, people_number=2
+        ):
+            run_search(RecordingAgent, env, query, time_cut)
+        print("search: {} batches from {} queries".format(len(batches), n))
+        return batches
+
+    rng = random.Random(args.seed)
+    bad, candidates = 0, 0
+    full_time, scorer_time = 0.0, 0.0
+
+    def compare(prefix, day_i, batch):
+        """
+        Scores of the batch and of the plan itself, against the copies of the
+        plan that the reranking used to check.
+        """
+        global bad, candidates, full_time, scorer_time
+        start_time = time.time()
+        expected = []
+        for activity in batch:
+            if activity is None:
+                expected.append(0)
+                continue
+            full_plan = deepcopy(prefix)
+            full_plan["itinerary"][day_i]["activities"].append(activity)
+            expected.append(sum(evaluate_constraints_py(constraints, full_plan)))
+        expected.append(sum(evaluate_constraints_py(constraints, prefix)))
+        full_time += time.time() - start_time
+        start_time = time.time()
+        got = scorer.score_candidates(prefix, day_i, batch) + [scorer.score(prefix)]
+        scorer_time += time.time() - start_time
+        candidates += len(batch)
+        if got != expected:
+            bad += 1
+            print("mismatch: full {}, scorer {}".format(expected, got))
+
+    for path in args.plans:
+        with open(path, "r", encoding="utf-8") as f:
+            plan = json.load(f)
+        activities = [a for day in plan["itinerary"] for a in day["activities"]]
+        # every prefix of the plan, with candidates taken from the whole plan
+        for day_i, day in enumerate(plan["itinerary"]):
+            for n in range(len(day["activities"]) + 1):
+                prefix = dict(plan)
+                prefix["itinerary"] = deepcopy(plan["itinerary"][:day_i]) + [
+                    {"day": day["day"], "activities": deepcopy(day["activities"][:n])}
+                ]
+                batch = [deepcopy(a) for a in rng.sample(activities, min(8, len(activities)))]
+                batch.append(None)
+                compare(prefix, day_i, batch)
+    if args.search > 0:
+        for prefix, day_i, batch in searched_batches(args.search, args.search_time):
+            compare(prefix, day_i, batch)
+    print("{} candidates, {} mismatching batches".format(candidates, bad))
+    print("full: {:.3f}s, scorer: {:.3f}s".format(full_time, scorer_time))
+    if bad > 0:
+        sys.exit(1)
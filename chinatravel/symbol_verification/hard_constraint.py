@@ -1,11 +1,8 @@
 import sys
 import os
 
-from chinatravel.environment.tools.accommodations.apis import Accommodations
-from chinatravel.environment.tools.restaurants.apis import Restaurants
-from chinatravel.environment.tools.attractions.apis import Attractions
-from chinatravel.environment.tools.intercity_transport.apis import IntercityTransport
-from chinatravel.environment.tools.transportation.apis import Transportation
+from chinatravel.environment.tools.catalog import get_catalog
+from chinatravel.environment.tools.predicates import eq
 
 from chinatravel.symbol_verification.concept_func import func_dict
 from chinatravel.evaluation.utils import load_json_file
@@ -14,9 +11,10 @@ import pandas as pd
 
 from copy import deepcopy
 
-accommodation = Accommodations()
-restaurants = Restaurants()
-attractions = Attractions()
+catalog = get_catalog()
+accommodation = catalog.accommodations
+restaurants = catalog.restaurants
+attractions = catalog.attractions
 
 
 def calc_cost_from_itinerary_wo_intercity(itinerary, people_number):
@@ -185,7 +183,7 @@ def get_symbolic_concepts(symbolic_input, plan_json, need_ood=False):
                 or activity["type"] == "dinner"
             ):
                 select_food_type = restaurants.select(
-                    target_city, key="name", func=lambda x: x == activity["position"]
+                    target_city, key="name", func=eq(activity["position"])
                 )["cuisine"]
                 if not select_food_type.empty:
                     food_type.add(select_food_type.iloc[0])
@@ -199,7 +197,7 @@ def get_symbolic_concepts(symbolic_input, plan_json, need_ood=False):
 
             if activity["type"] == "accommodation":
                 select_hotel_type = accommodation.select(
-                    target_city, key="name", func=lambda x: x == activity["position"]
+                    target_city, key="name", func=eq(activity["position"])
                 )["featurehoteltype"]
                 if not select_hotel_type.empty:
                     hotel_feature.add(select_hotel_type.iloc[0])
@@ -219,7 +217,7 @@ def get_symbolic_concepts(symbolic_input, plan_json, need_ood=False):
 
             if activity["type"] == "attraction":
                 select_attraction_type = attractions.select(
-                    target_city, key="name", func=lambda x: x == activity["position"]
+                    target_city, key="name", func=eq(activity["position"])
                 )["type"]
                 if not select_attraction_type.empty:
                     spot_type.add(select_attraction_type.iloc[0])
@@ -0,0 +1,692 @@
+"""
+Incremental commonsense validation along the search path.
+
+`func_commonsense_constraints` checks the whole itinerary again, and builds a
+DataFrame per check, every time the search validates a plan. The plans of one
+search share long prefixes, so `IncrementalValidator` keeps a stack with one
+entry per activity of the current path: the verdict of the checks that only
+look at that activity (POI found, price, cost, opening hours, meal times,
+inner-city transport against goto, start before end, transport continuity
+with the previous position), and the running state of the checks across
+activities (visited attractions and restaurants, hotels).
+
+`sync(plan)` pops the entries of the activities that changed since the last
+call and pushes the new ones, so a check costs the activities added since the
+previous one. `prefix_failed(plan)` tells whether the plan already breaks a
+check that no later activity can repair, and `check(plan)` gives the verdict
+of `func_commonsense_constraints`. An activity that would make one of the
+original checks raise sends `check` to the full verifier, so errors surface
+the same way.
+
+Compare with the full verifier with:
+    python chinatravel/symbol_verification/incremental.py --compare --search 30
+
+--search adds the plans that the rule-driven search finds to the plans of
+agent/nesy_agent/plan_for_check, so that the check also sees passing plans
+and verifies that none of their prefixes is reported as failed.
+"""
+
+import os
+import sys
+
+if __name__ == "__main__":
+    sys.path.insert(
+        0, os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    )
+
+from chinatravel.environment.tools.predicates import eq
+from chinatravel.symbol_verification.commonsense_constraint import (
+    Is_intercity_transport_correct,
+    func_commonsense_constraints,
+    time_compare_if_earlier_equal,
+    time2real,
+    accommodation,
+    restaurants,
+    attractions,
+    innercity_transport,
+)
+
+_EMPTY = object()
+
+
+def _freeze(x):
+    """
+    Comparable snapshot of an activity, so that later changes to it are seen.
+    """
+    if isinstance(x, dict):
+        return tuple((k, _freeze(v)) for k, v in x.items())
+    if isinstance(x, list):
+        return ("__list__",) + tuple(_freeze(v) for v in x)
+    return x
+
+
+def _require(container, key):
+    """
+    Raise if `container[key]` would raise, for a dict or a list; any other
+    container raises too. The checks call it where the full verifier reads a
+    field that may be missing, so that such an activity is left to it.
+    """
+    if isinstance(container, dict):
+        if key not in container:
+            raise KeyError(key)
+    elif isinstance(container, list):
+        if not isinstance(key, int) or not -len(container) <= key < len(container):
+            raise IndexError(key)
+    else:
+        raise TypeError("cannot check {!r} of {}".format(key, type(container).__name__))
+
+
+def _add_day(endtime):
+    return str(int(endtime.split(":")[0]) + 24) + ":" + endtime.split(":")[1]
+
+
+class _Entry:
+    __slots__ = ("key", "failed", "unsure", "attraction", "restaurant", "hotel", "position")
+
+    def __init__(self, key):
+        self.key = key
+        self.failed = False
+        self.unsure = False
+        self.attraction = None
+        self.restaurant = None
+        self.hotel = False
+        # last position of the path after this activity
+        self.position = _EMPTY
+
+
+class IncrementalValidator:
+    def __init__(self, query):
+        self.query = query
+        self.city = query["target_city"]
+        self.people_number = query["people_number"]
+        self.fallbacks = 0
+        self._entries = []
+        self._failed = 0
+        self._unsure = 0
+        self._hotels = 0
+        self._attractions = {}
+        self._restaurants = {}
+        self._repeated = 0
+        self._rows = {}
+        self._intercity = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def sync(self, plan):
+        """
+        Make the stack follow the activities of `plan`.
+        """
+        keys = [_freeze(a) for day in plan for a in day["activities"]]
+        activities = [a for day in plan for a in day["activities"]]
+        common = 0
+        while (
+            common < len(self._entries)
+            and common < len(keys)
+            and self._entries[common].key == keys[common]
+        ):
+            common += 1
+        while len(self._entries) > common:
+            self.pop()
+        for activity, key in zip(activities[common:], keys[common:]):
+            self.push(activity, key)
+        return self
+
+    def push(self, activity, key=None):
+        entry = _Entry(_freeze(activity) if key is None else key)
+        previous = self._entries[-1].position if self._entries else _EMPTY
+        try:
+            self._check_activity(activity, previous, entry)
+        except Exception:
+            entry.unsure = True
+            entry.position = previous
+        self._entries.append(entry)
+        self._failed += int(entry.failed)
+        self._unsure += int(entry.unsure)
+        self._hotels += int(entry.hotel)
+        self._count(self._attractions, entry.attraction, 1)
+        self._count(self._restaurants, entry.restaurant, 1)
+
+    def pop(self):
+        entry = self._entries.pop()
+        self._failed -= int(entry.failed)
+        self._unsure -= int(entry.unsure)
+        self._hotels -= int(entry.hotel)
+        self._count(self._attractions, entry.attraction, -1)
+        self._count(self._restaurants, entry.restaurant, -1)
+
+    def _count(self, visited, name, delta):
+        if name is None:
+            return
+        count = visited.get(name, 0)
+        # a name repeats once it is visited twice
+        if delta > 0 and count == 1:
+            self._repeated += 1
+        if delta < 0 and count == 2:
+            self._repeated -= 1
+        visited[name] = count + delta
+
+    def prefix_failed(self, plan) -> bool:
+        """
+        True if `plan` breaks a check that stays broken whatever is added.
+        """
+        try:
+            self.sync(plan)
+        except Exception:
+            return False
+        return self._unsure == 0 and (self._failed > 0 or self._repeated > 0)
+
+    def prefix_passed(self, plan) -> bool:
+        """
+        True if every activity of `plan` passes its checks, so that whether a
+        completion passes depends only on what is added.
+        """
+        try:
+            self.sync(plan)
+        except Exception:
+            return False
+        return self._unsure == 0 and self._failed == 0 and self._repeated == 0
+
+    def check(self, plan) -> bool:
+        """
+        Same verdict as func_commonsense_constraints on the plan.
+        """
+        try:
+            self.sync(plan)
+            if self._unsure == 0 and len(plan) > 0:
+                intercity_ok = self._intercity_ok(plan)
+                return (
+                    intercity_ok
+                    and self._failed == 0
+                    and self._repeated == 0
+                    and not (len(plan) > 1 and self._hotels == 0)
+                )
+        except Exception:
+            pass
+        self.fallbacks += 1
+        return func_commonsense_constraints(
+            self.query,
+            {
+                "people_number": self.query["people_number"],
+                "start_city": self.query["start_city"],
+                "target_city": self.query["target_city"],
+                "itinerary": plan,
+            },
+            verbose=False,
+        )
+
+    def _intercity_ok(self, plan):
+        first, last = plan[0]["activities"], plan[-1]["activities"]
+        key = (
+            _freeze({k: v for k, v in first[0].items() if k != "transports"}) if first else None,
+            _freeze({k: v for k, v in last[-1].items() if k != "transports"}) if last else None,
+        )
+        if key not in self._intercity:
+            table, _ = Is_intercity_transport_correct(
+                self.query, {"itinerary": [plan[0], plan[-1]]}
+            )
+            self._intercity[key] = bool(table.iloc[0].sum() == 0)
+        return self._intercity[key]
+
+    def _row(self, tool, name, columns):
+        """
+        values[0] of `columns` for the row of `name`, None if there is none.
+        """
+        key = (id(tool), name)
+        if key not in self._rows:
+            data = tool.select(self.city, key="name", func=eq(name))
+            self._rows[key] = (
+                None if data.empty else {c: data[c].values[0] for c in columns}
+            )
+        return self._rows[key]
+
+    def _check_activity(self, a, previous, entry):
+        try:
+            activity_type = a["type"]
+        except Exception:
+            activity_type = None
+        if activity_type == "attraction":
+            self._check_attraction(a, entry)
+        elif activity_type == "accommodation":
+            self._check_hotel(a, entry)
+        elif activity_type in ["breakfast", "lunch", "dinner"]:
+            self._check_restaurant(a, entry)
+        self._check_transport(a, entry)
+        self._check_time(a, entry)
+        self._check_space(a, previous, entry)
+
+    def _check_attraction(self, a, entry):
+        if "position" not in a:
+            entry.failed = True
+            return
+        row = self._row(attractions, a["position"], ["opentime", "endtime", "price"])
+        if row is None:
+            entry.failed = True
+            return
+        entry.attraction = a["position"]
+        opentime, endtime = row["opentime"], row["endtime"]
+        if time_compare_if_earlier_equal(endtime, opentime):
+            endtime = _add_day(endtime)
+        try:
+            if not (
+                time_compare_if_earlier_equal(opentime, a["start_time"])
+                and time_compare_if_earlier_equal(a["end_time"], endtime)
+            ):
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if int(a["price"]) != int(row["price"]):
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if abs(a["price"] * a["tickets"] - a["cost"]) > 0.1:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+
+    def _check_hotel(self, a, entry):
+        if "position" not in a:
+            entry.failed = True
+            return
+        row = self._row(accommodation, a["position"], ["price", "numbed"])
+        if row is None:
+            entry.failed = True
+            return
+        entry.hotel = True
+        try:
+            if a["price"] != row["price"]:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if a["room_type"] != row["numbed"]:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if abs(a["rooms"] * a["price"] - a["cost"]) > 0.1:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+
+    def _check_restaurant(self, a, entry):
+        if "position" not in a:
+            entry.failed = True
+            return
+        row = self._row(restaurants, a["position"], ["opentime", "endtime", "price"])
+        if a["type"] == "breakfast" and row is None:
+            # breakfast at the hotel
+            if self._row(accommodation, a["position"], ["price", "numbed"]) is None:
+                entry.failed = True
+            try:
+                if a["price"] != 0:
+                    entry.failed = True
+            except Exception:
+                entry.failed = True
+            try:
+                if time_compare_if_earlier_equal(
+                    "09:00", a["start_time"]
+                ) or time_compare_if_earlier_equal(a["end_time"], "06:00"):
+                    entry.failed = True
+            except Exception:
+                entry.failed = True
+            self._check_meal_cost(a, entry)
+            return
+        if row is None:
+            entry.failed = True
+            return
+        try:
+            if a["price"] != row["price"]:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            st, et = a["start_time"], a["end_time"]
+            if a["type"] == "lunch" and (
+                time_compare_if_earlier_equal("14:00", st)
+                or time_compare_if_earlier_equal(et, "11:00")
+            ):
+                entry.failed = True
+            if a["type"] == "dinner" and (
+                time_compare_if_earlier_equal("20:00", st)
+                or time_compare_if_earlier_equal(et, "17:00")
+            ):
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        self._check_meal_cost(a, entry)
+        opentime, endtime = row["opentime"], row["endtime"]
+        if time_compare_if_earlier_equal(endtime, opentime):
+            endtime = _add_day(endtime)
+        try:
+            if not (
+                time_compare_if_earlier_equal(opentime, a["start_time"])
+                and time_compare_if_earlier_equal(a["end_time"], endtime)
+            ):
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        entry.restaurant = a["position"]
+
+    def _check_meal_cost(self, a, entry):
+        try:
+            if abs(self.people_number * a["price"] - a["cost"]) > 0.1:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+
+    def _check_transport(self, a, entry):
+        if "transports" not in a:
+            return
+        transports = a["transports"]
+        if len(transports) == 0:
+            return
+        source_poi = transports[0]["start"]
+        target_poi = transports[-1]["end"]
+        start_time = transports[0]["start_time"]
+        # the full verifier reads it with the fields above
+        _require(transports[-1], "end_time")
+
+        if len(transports) == 3:
+            try:
+                tools_return = innercity_transport.goto(
+                    city=self.city,
+                    start=source_poi,
+                    end=target_poi,
+                    start_time=start_time,
+                    transport_type="metro",
+                    verbose=False,
+                )
+            except Exception:
+                entry.failed = True
+                return
+            for idx, leg in enumerate(transports):
+                self._check_leg(leg, tools_return, idx, entry)
+                if leg["mode"] == "metro":
+                    try:
+                        if abs(leg["price"] * leg["tickets"] - leg["cost"]) > 0.1:
+                            entry.failed = True
+                    except Exception:
+                        entry.failed = True
+                elif leg["mode"] == "walk":
+                    self._check_walk_cost(leg, entry)
+            try:
+                if (
+                    transports[0]["mode"] != "walk"
+                    or transports[2]["mode"] != "walk"
+                    or transports[1]["mode"] != "metro"
+                ):
+                    entry.failed = True
+            except Exception:
+                entry.failed = True
+
+        elif len(transports) == 1 and transports[0]["mode"] in ["walk", "taxi"]:
+            try:
+                tools_return = innercity_transport.goto(
+                    city=self.city,
+                    start=source_poi,
+                    end=target_poi,
+                    start_time=start_time,
+                    transport_type=transports[0]["mode"],
+                    verbose=False,
+                )
+                if not isinstance(tools_return, list):
+                    entry.failed = True
+            except Exception:
+                entry.failed = True
+                return
+            for idx, leg in enumerate(transports):
+                self._check_leg(leg, tools_return, idx, entry)
+                if leg["mode"] == "walk":
+                    self._check_walk_cost(leg, entry)
+                elif leg["mode"] == "taxi":
+                    try:
+                        if abs(leg["price"] * leg["cars"] - leg["cost"]) > 0.1:
+                            entry.failed = True
+                    except Exception:
+                        entry.failed = True
+        else:
+            entry.failed = True
+
+    def _check_leg(self, leg, tools_return, idx, entry):
+        # every failed check of the full verifier formats tools_return[idx] in
+        # its message, which raises for a leg the tool did not return
+        _require(tools_return, idx)
+        try:
+            if leg["start"] != tools_return[idx]["start"]:
+                entry.failed = True
+            if leg["end"] != tools_return[idx]["end"]:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if (
+                leg["start_time"] != tools_return[idx]["start_time"]
+                or leg["end_time"] != tools_return[idx]["end_time"]
+            ):
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if abs(leg["price"] - tools_return[idx]["cost"]) > 0.1:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+        try:
+            if abs(leg["distance"] - tools_return[idx]["distance"]) > 0.1:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+
+    def _check_walk_cost(self, leg, entry):
+        try:
+            if leg["cost"] != 0:
+                entry.failed = True
+        except Exception:
+            entry.failed = True
+
+    def _check_time(self, a, entry):
+        # the full verifier fails an activity without start_time, or with a
+        # start_time and without end_time
+        if not (
+            isinstance(a, dict)
+            and "start_time" in a
+            and (not a["start_time"] or "end_time" in a)
+        ):
+            entry.failed = True
+            return
+        if time2real(a["start_time"]) >= time2real(a["end_time"]) and (
+            not a["type"] in ["train", "airplane"]
+        ):
+            entry.failed = True
+        if "transports" not in a:
+            return
+        if len(a["transports"]) > 0:
+            # the full verifier reads it before comparing the times
+            _require(a["transports"][0], "start_time")
+            if time2real(a["start_time"]) < time2real(a["transports"][-1]["end_time"]):
+                entry.failed = True
+
+    def _check_space(self, a, previous, entry):
+        entry.position = previous
+        if "position" not in a:
+            if "start" in a:
+                current_position = a["start"]
+            else:
+                entry.failed = True
+                return
+        else:
+            current_position = a["position"]
+
+        if "transports" not in a:
+            entry.failed = True
+
+        if previous is not _EMPTY and current_position != previous:
+            if "transports" not in a or len(a["transports"]) < 1:
+                entry.failed = True
+            else:
+                if a["transports"][0]["start"] != previous:
+                    entry.failed = True
+                if a["transports"][-1]["end"] != current_position:
+                    entry.failed = True
+
+        entry.position = a["position"] if "position" in a else a["end"]
+
+
+if __name__ == "__main__":
+    import json
+    import glob
+    import time
+    import random
+    import argparse
+    from copy import deepcopy
+
+    parser = argparse.ArgumentParser(
+        description="Compare the incremental validator with the full verifier."
+    )
+    parser.add_argument("--compare", action="store_true")
+    parser.add_argument(
+        "--plans",
+        type=str,
+        nargs="*",
+        default=glob.glob(
+            os.path.join(
+                os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                "agent",
+                "nesy_agent",
+                "plan_for_check",
+                "*.json",
+            )
+        ),
+        help="Plan json files (with people_number, start_city, target_city).",
+    )
+    parser.add_argument(
+        "--search",
+        type=int,
+        default=0,
+        help="Also check the plans the rule-driven search finds for this many queries.",
+    )
+    parser.add_argument(
+        "--search-time", type=int, default=60, help="TIME_CUT of each search, in seconds."
+    )
+    parser.add_argument("--mutations", type=int, default=200, help="Mutated plans per plan.")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    def searched_plans(n, time_cut):
+        """
+        Plans of RuleDrivenAgent on n queries without logical constraints,
+        searched with prune_invalid_prefix off so that the validator under
+        test does not shape them.
+        """
+        from chinatravel.environment.world_env import WorldEnv
+        from chinatravel.agent.nesy_agent.rule_driven_rec import RuleDrivenAgent
+        from chinatravel.agent.search_harness import check_queries, run_search
+
+        env = WorldEnv()
+        plans = []
+        for query in check_queries(env.support_cities, n):
+            _, success, plan, _ = run_search(
+                RuleDrivenAgent, env, query, time_cut, prune_invalid_prefix=False
+            )
+            if success:
+                plans.append(plan)
+        print("search: {} of {} queries solved".format(len(plans), n))
+        return plans
+
+    def mutate(plan, rng):
+        """
+        A copy of the plan with one field of one activity changed, one
+        activity dropped or one activity repeated.
+        """
+        plan = deepcopy(plan)
+        activities = [
+            (day, i) for day in plan["itinerary"] for i in range(len(day["activities"]))
+        ]
+        day, i = rng.choice(activities)
+        activity = day["activities"][i]
+        kind = rng.randrange(6)
+        if kind == 0:
+            del day["activities"][i]
+        elif kind == 1:
+            day["activities"].insert(i, deepcopy(activity))
+        elif kind == 2 and len(activity) > 0:
+            del activity[rng.choice(list(activity))]
+        elif kind == 3 and "transports" in activity and len(activity["transports"]) > 0:
+            leg = rng.choice(activity["transports"])
+            field = rng.choice(list(leg))
+            leg[field] = rng.choice([0, 1.5, "08:00", "x", None])
+        else:
+            field = rng.choice(list(activity))
+            activity[field] = rng.choice(
+                [0, 10, 99.5, "00:30", "12:00", "23:59", "x", None, [], activity.get("start_time")]
+            )
+        return plan
+
+    def verdict(func, *func_args):
+        try:
+            return func(*func_args)
+        except Exception as e:
+            return type(e).__name__
+
+    rng = random.Random(args.seed)
+    plans = []
+    for path in args.plans:
+        with open(path, "r", encoding="utf-8") as f:
+            plans.append(json.load(f))
+    if args.search > 0:
+        plans += searched_plans(args.search, args.search_time)
+    corpus = []
+    for plan in plans:
+        query = {
+            "people_number": plan["people_number"],
+            "start_city": plan["start_city"],
+            "target_city": plan["target_city"],
+        }
+        corpus.append((query, plan))
+        for _ in range(args.mutations):
+            corpus.append((query, mutate(plan, rng)))
+
+    stdout = sys.stdout
+    bad, bad_prefix, passing = 0, 0, 0
+    full_time, incremental_time = 0.0, 0.0
+    validators = {}
+    for query, plan in corpus:
+        sys.stdout = open(os.devnull, "w")
+        start_time = time.time()
+        expected = verdict(func_commonsense_constraints, query, plan, False)
+        full_time += time.time() - start_time
+        validator = validators.setdefault(id(query), IncrementalValidator(query))
+        start_time = time.time()
+        got = verdict(validator.check, plan["itinerary"])
+        incremental_time += time.time() - start_time
+        # a failed prefix can only lead to failed plans
+        prefix = []
+        prefix_failed = False
+        for day in plan["itinerary"]:
+            prefix.append({"day": day.get("day"), "activities": []})
+            for activity in day.get("activities", []):
+                prefix[-1]["activities"].append(activity)
+                prefix_failed = prefix_failed or validator.prefix_failed(prefix)
+        sys.stdout.close()
+        sys.stdout = stdout
+        passing += int(expected is True)
+        if got != expected:
+            bad += 1
+            print("mismatch: full {}, incremental {}".format(expected, got))
+        if prefix_failed and expected is True:
+            bad_prefix += 1
+            print("a passing plan has a failed prefix")
+    fallbacks = sum(v.fallbacks for v in validators.values())
+    print(
+        "{} plans ({} passing), {} mismatches, {} bad prefixes, {} full fallbacks".format(
+            len(corpus), passing, bad, bad_prefix, fallbacks
+        )
+    )
+    print(
+        "full: {:.3f}s, incremental: {:.3f}s".format(full_time, incremental_time)
+    )
+    if bad > 0 or bad_prefix > 0:
+        sys.exit(1)
@@ -1,11 +1,7 @@
 import sys
 import os
 
-from chinatravel.environment.tools.accommodations.apis import Accommodations
-from chinatravel.environment.tools.restaurants.apis import Restaurants
-from chinatravel.environment.tools.attractions.apis import Attractions
-from chinatravel.environment.tools.intercity_transport.apis import IntercityTransport
-from chinatravel.environment.tools.transportation.apis import Transportation
+from chinatravel.environment.tools.catalog import get_catalog
 
 from chinatravel.symbol_verification.concept_func import func_dict
 from chinatravel.evaluation.utils import load_json_file
@@ -14,9 +10,10 @@ import pandas as pd
 
 from copy import deepcopy
 
-accommodation = Accommodations()
-restaurants = Restaurants()
-attractions = Attractions()
+catalog = get_catalog()
+accommodation = catalog.accommodations
+restaurants = catalog.restaurants
+attractions = catalog.attractions
 
 from .concept_func import *
 
@@ -14,6 +14,7 @@ if project_root_path not in sys.path: sys.path.insert(0, project_root_path)
 
 from chinatravel.data.load_datasets import load_query
 from chinatravel.evaluation.utils import load_json_file, validate_json
+from chinatravel.environment.tools import get_catalog
 
 from chinatravel.evaluation.schema_constraint import evaluate_schema_constraints
 from chinatravel.evaluation.commonsense_constraint import evaluate_commonsense_constraints
@@ -79,8 +80,14 @@ if __name__ == "__main__":
         "--method", "-m", type=str, default="example"
     )  # , choices=METHOD_LIST)
     parser.add_argument("--preference", "-p", action="store_true", default=False)
+    parser.add_argument(
+        "--route_cache", type=str, default=None, help="json file of goto routes shared across runs"
+    )
     args = parser.parse_args()
 
+    if args.route_cache is not None:
+        get_catalog().transportation.route_cache.attach(args.route_cache)
+
     # print(args.splits)
 
     query_index, query_data = load_query(args)
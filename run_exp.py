@@ -16,6 +16,8 @@ from copy import deepcopy
 from chinatravel.data.load_datasets import load_query, save_json_file
 from chinatravel.agent.load_model import init_agent, init_llm
 from chinatravel.environment.world_env import WorldEnv
+from chinatravel.environment.tools import get_catalog
+from chinatravel.environment.env_server import RemoteWorldEnv
 
 # Import InsufficientBalanceError from both locations to handle different agents
 try:
@@ -70,12 +72,64 @@ if __name__ == "__main__":
         default=None,
         help='Specify output directory name (e.g., LLMNeSy_glm4-plus_oracletranslation_20251116_1430). If provided, will resume from this directory and skip completed tasks.'
     )
+    parser.add_argument(
+        '--route_cache',
+        type=str,
+        default=None,
+        help='Json file of goto routes, loaded at start and saved at exit to share warm routes across runs.'
+    )
+    parser.add_argument(
+        '--env_history',
+        type=int,
+        default=None,
+        help='Keep only the last N results of the environment and release the pages of older ones (default: keep all).'
+    )
+    parser.add_argument(
+        '--preload_cities',
+        type=str,
+        nargs='*',
+        default=None,
+        help='Read the data of these cities at start (no names: all cities). Other cities are read on first use.'
+    )
+    parser.add_argument(
+        '--env_stats',
+        action='store_true',
+        help='Time every environment API call and add the per-API counters (env_stats) to each plan.'
+    )
+    parser.add_argument(
+        '--env_socket',
+        type=str,
+        default=None,
+        help='Unix socket of a running env_server.py; the environment calls go to that shared server instead of a local WorldEnv.'
+    )
 
+    parser.add_argument(
+        '--search_workers',
+        type=int,
+        default=1,
+        help='Processes searching the intercity-transport and hotel combinations of a query in parallel (RuleNeSy, LLMNeSy; LLMs served over an API only).'
+    )
+    parser.add_argument(
+        '--transposition_size',
+        type=int,
+        default=0,
+        help='Remember up to N exhausted POI-search states and backtrack when reaching one again (LLMNeSy, RuleNeSy, UrbanTrip; default: off; not used with --preference_search).'
+    )
+    parser.add_argument(
+        '--anytime_search',
+        action='store_true',
+        help='Spread the search time over the intercity-transport and hotel combinations, narrow the search near the deadline and return the best plan found (LLMNeSy, RuleNeSy, UrbanTrip).'
+    )
 
     args = parser.parse_args()
 
     print(args)
 
+    if args.route_cache is not None:
+        get_catalog().transportation.route_cache.attach(args.route_cache)
+    if args.preload_cities is not None:
+        get_catalog().preload(args.preload_cities if len(args.preload_cities) > 0 else None)
+
     query_index, query_data = load_query(args)
     print(len(query_index), "samples")
 
@@ -127,13 +181,25 @@ if __name__ == "__main__":
         max_model_len = 8192
     else:
         max_model_len = None
+    env_kwargs = {
+        "history_size": args.env_history,
+        "release_paged": args.env_history is not None,
+        "stats": args.env_stats,
+    }
+    if args.env_socket is not None:
+        env = RemoteWorldEnv(args.env_socket, **env_kwargs)
+    else:
+        env = WorldEnv(**env_kwargs)
     kwargs = {
         "method": args.agent,
-        "env": WorldEnv(),
+        "env": env,
         "backbone_llm": init_llm(args.llm, max_model_len=max_model_len),
         "cache_dir": cache_dir,
         "debug": True,
         "refine_steps": args.refine_steps,
+        "search_workers": args.search_workers,
+        "transposition_size": args.transposition_size,
+        "anytime_search": args.anytime_search,
     }
     agent = init_agent(kwargs)
 